@@ -0,0 +1,200 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import threading
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+RESPONSE_BODY = json.dumps({"id": "fake-file", "webViewLink": "https://drive.example/fake-file"}).encode()
+
+
+class FakeEndpoint:
+    """
+    Local stand-in for the Drive/Docs API: every request waits `latency`
+    seconds (server-side RTT) and returns a small JSON body. HTTP/1.1 is
+    served by http.server; HTTP/2 by an h2c (prior knowledge) server on
+    the h2 library. Counts the connections each client opens.
+    """
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.connections = {"http1": 0, "http2": 0}
+        self._lock = threading.Lock()
+
+    def _connected(self, kind: str):
+        with self._lock:
+            self.connections[kind] += 1
+
+    def start_http1(self) -> str:
+        endpoint = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                endpoint._connected("http1")
+
+            def _respond(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                if length:
+                    self.rfile.read(length)
+                time.sleep(endpoint.latency)
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(RESPONSE_BODY)))
+                self.end_headers()
+                self.wfile.write(RESPONSE_BODY)
+
+            do_GET = do_POST = do_PUT = _respond
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name="fake-http1", daemon=True).start()
+        return f"http://127.0.0.1:{server.server_address[1]}"
+
+    def start_http2(self) -> str:
+        import h2.config
+        import h2.connection
+        import h2.events
+        import h2.settings
+        endpoint = self
+        ready = threading.Event()
+        address = {}
+
+        class H2Protocol(asyncio.Protocol):
+            def connection_made(self, transport):
+                endpoint._connected("http2")
+                self.transport = transport
+                self.conn = h2.connection.H2Connection(config=h2.config.H2Configuration(client_side=False))
+                self.conn.initiate_connection()
+                # 與 Google 前端相近的大流量控制視窗，避免上傳卡在預設的 64 KB 視窗
+                self.conn.update_settings({h2.settings.SettingCodes.INITIAL_WINDOW_SIZE: 1 << 20})
+                self.conn.increment_flow_control_window((1 << 24) - 65535)
+                transport.write(self.conn.data_to_send())
+
+            def data_received(self, data):
+                for event in self.conn.receive_data(data):
+                    if isinstance(event, h2.events.DataReceived):
+                        self.conn.acknowledge_received_data(event.flow_controlled_length, event.stream_id)
+                    elif isinstance(event, h2.events.StreamEnded):
+                        asyncio.get_running_loop().call_later(endpoint.latency, self._respond, event.stream_id)
+                self.transport.write(self.conn.data_to_send())
+
+            def _respond(self, stream_id: int):
+                if self.transport.is_closing():
+                    return
+                self.conn.send_headers(stream_id, [
+                    (":status", "200"),
+                    ("content-type", "application/json"),
+                    ("content-length", str(len(RESPONSE_BODY))),
+                ])
+                self.conn.send_data(stream_id, RESPONSE_BODY, end_stream=True)
+                self.transport.write(self.conn.data_to_send())
+
+        def run():
+            loop = asyncio.new_event_loop()
+            server = loop.run_until_complete(loop.create_server(H2Protocol, "127.0.0.1", 0))
+            address["port"] = server.sockets[0].getsockname()[1]
+            ready.set()
+            loop.run_forever()
+
+        threading.Thread(target=run, name="fake-http2", daemon=True).start()
+        ready.wait(5)
+        return f"http://127.0.0.1:{address['port']}"
+
+
+def run_load(request, url: str, requests_total: int, concurrency: int, payload: bytes, lock=None) -> dict:
+    """以 concurrency 個執行緒送出 requests_total 個 POST，回傳吞吐量與延遲分佈"""
+    latencies = []
+    errors = 0
+
+    def one(i: int):
+        started = time.perf_counter()
+        if lock is not None:
+            # 模擬原本 GDriveClient 以單一鎖序列化所有呼叫
+            with lock:
+                resp, _ = request(f"{url}/upload/{i}", "POST", body=payload, headers={"Content-Type": "application/octet-stream"})
+        else:
+            resp, _ = request(f"{url}/upload/{i}", "POST", body=payload, headers={"Content-Type": "application/octet-stream"})
+        return resp.status, time.perf_counter() - started
+
+    wall_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for status, latency in pool.map(one, range(requests_total)):
+            latencies.append(latency)
+            errors += status != 200
+    wall = time.perf_counter() - wall_start
+    latencies.sort()
+    return {
+        "requests": requests_total,
+        "errors": errors,
+        "wall_s": wall,
+        "rps": requests_total / wall,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p95_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000,
+    }
+
+
+def print_row(name: str, result: dict, connections: int):
+    print(f"{name:<28} {result['rps']:>8.1f} {result['p50_ms']:>9.1f} {result['p95_ms']:>9.1f} {connections:>6} {result['errors']:>6}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP/1.1 vs HTTP/2 transport benchmark against a local fake Drive endpoint")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--latency-ms", type=float, default=50, help="server-side delay per request (simulated RTT)")
+    parser.add_argument("--payload-kb", type=int, default=16)
+    parser.add_argument("--max-connections", type=int, default=4, help="pool size for the httpx transports")
+    args = parser.parse_args()
+
+    try:
+        import httpx
+        import h2  # noqa: F401
+    except ImportError:
+        print("❌ [Bench] 需要安裝 httpx 與 h2 (pip install 'httpx[http2]')")
+        sys.exit(1)
+    import httplib2
+    from src.clients.http_transport import HttpxHttp
+
+    endpoint = FakeEndpoint(args.latency_ms / 1000)
+    http1_url = endpoint.start_http1()
+    http2_url = endpoint.start_http2()
+    payload = os.urandom(args.payload_kb * 1024)
+    limits = httpx.Limits(max_connections=args.max_connections, max_keepalive_connections=args.max_connections)
+
+    print(f"⏱️ [Bench] {args.requests} requests, concurrency {args.concurrency}, "
+          f"latency {args.latency_ms:.0f} ms, payload {args.payload_kb} KB")
+    print(f"{'transport':<28} {'req/s':>8} {'p50(ms)':>9} {'p95(ms)':>9} {'conns':>6} {'errors':>6}")
+
+    # 1. 目前的預設: 單一 httplib2.Http + API 鎖
+    before = endpoint.connections["http1"]
+    result = run_load(httplib2.Http().request, http1_url, args.requests, args.concurrency, payload, lock=threading.Lock())
+    print_row("httplib2 + lock (HTTP/1.1)", result, endpoint.connections["http1"] - before)
+
+    # 2. httpx 連線池 (HTTP/1.1)：每個並行請求各佔一條連線
+    before = endpoint.connections["http1"]
+    http1 = HttpxHttp(client=httpx.Client(limits=limits))
+    result = run_load(http1.request, http1_url, args.requests, args.concurrency, payload)
+    print_row(f"httpx pool={args.max_connections} (HTTP/1.1)", result, endpoint.connections["http1"] - before)
+    http1.close()
+
+    # 3. httpx HTTP/2：並行請求多工在少數連線上 (本機無 TLS，使用 h2c prior knowledge)
+    before = endpoint.connections["http2"]
+    http2 = HttpxHttp(client=httpx.Client(http1=False, http2=True, limits=limits))
+    result = run_load(http2.request, http2_url, args.requests, args.concurrency, payload)
+    print_row(f"httpx pool={args.max_connections} (HTTP/2)", result, endpoint.connections["http2"] - before)
+    http2.close()
+
+
+if __name__ == "__main__":
+    main()
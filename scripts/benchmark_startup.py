@@ -0,0 +1,80 @@
+import os
+import re
+import sys
+import time
+import argparse
+import subprocess
+
+# 冷啟動時不應被載入的重量級套件 (應延遲到第一次使用)
+DEFERRED_MODULES = ["linebot", "googleapiclient", "bs4", "requests", "pyngrok", "tqdm"]
+
+IMPORT_LINE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+def measure_import(module: str = "src.main") -> dict:
+    """以 -X importtime 在全新直譯器中匯入模組，回傳各模組的耗時 (微秒)"""
+    root = os.path.join(os.path.dirname(__file__), '..')
+    env = dict(os.environ, USE_NGROK="false")
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=root, env=env, capture_output=True, text=True
+    )
+    wall = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(f"匯入 {module} 失敗:\n{result.stderr}")
+
+    timings = []
+    for line in result.stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            timings.append({
+                "module": name,
+                "self_us": int(self_us),
+                "cumulative_us": int(cumulative_us),
+                "depth": len(indent) // 2
+            })
+    loaded = {t["module"] for t in timings}
+    target = next((t for t in timings if t["module"] == module), None)
+    return {
+        "module": module,
+        "wall_s": wall,
+        "cumulative_ms": target["cumulative_us"] / 1000 if target else 0.0,
+        "timings": timings,
+        "deferred_violations": [m for m in DEFERRED_MODULES if m in loaded]
+    }
+
+def print_report(report: dict, top: int = 15):
+    print(f"⏱️ [Startup] import {report['module']}: {report['cumulative_ms']:.1f} ms "
+          f"(process wall: {report['wall_s'] * 1000:.1f} ms)")
+    print(f"{'cumulative(ms)':>15} {'self(ms)':>10}  module")
+    top_level = [t for t in report["timings"] if t["depth"] <= 1]
+    for t in sorted(top_level, key=lambda t: t["cumulative_us"], reverse=True)[:top]:
+        print(f"{t['cumulative_us'] / 1000:>15.1f} {t['self_us'] / 1000:>10.1f}  {t['module']}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold-start import benchmark (-X importtime)")
+    parser.add_argument("--module", default="src.main")
+    parser.add_argument("--budget-ms", type=float, default=float(os.getenv("STARTUP_BUDGET_MS", 1500)))
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    # 取多次中最快的一次，降低磁碟快取等雜訊
+    reports = [measure_import(args.module) for _ in range(args.runs)]
+    best = min(reports, key=lambda r: r["cumulative_ms"])
+    print_report(best, args.top)
+
+    failed = False
+    if best["deferred_violations"]:
+        print(f"❌ [Startup] 冷啟動載入了應延遲的套件: {', '.join(best['deferred_violations'])}")
+        failed = True
+    if best["cumulative_ms"] > args.budget_ms:
+        print(f"❌ [Startup] 匯入時間 {best['cumulative_ms']:.1f} ms 超過預算 {args.budget_ms:.0f} ms")
+        failed = True
+    if failed:
+        sys.exit(1)
+    print(f"✅ [Startup] 在預算內 ({args.budget_ms:.0f} ms)")
+
+if __name__ == "__main__":
+    main()
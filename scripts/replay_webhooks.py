@@ -0,0 +1,335 @@
+import os
+import sys
+import hmac
+import json
+import time
+import base64
+import hashlib
+import argparse
+import tempfile
+import threading
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from src.services.webhook_recorder import iter_recording
+
+TEST_SECRET = "replay-test-secret"
+
+
+def sign(body: str, secret: str) -> str:
+    digest = hmac.new(secret.encode(), body.encode(), hashlib.sha256).digest()
+    return base64.b64encode(digest).decode()
+
+
+class FakeContent:
+    """LINE 內容串流的替身 (支援 iter_content / headers)"""
+    def __init__(self, data: bytes, content_type: str = "image/jpeg"):
+        self._data = data
+        self.status_code = 200
+        self.content_type = content_type
+        self.headers = {"Content-Type": content_type, "Content-Length": str(len(data))}
+
+    def iter_content(self, chunk_size: int = 1024):
+        for i in range(0, len(self._data), chunk_size):
+            yield self._data[i:i + chunk_size]
+
+    def close(self):
+        pass
+
+
+class FakeLineApi:
+    """LineBotApi 替身：每次呼叫等待 latency 秒，媒體內容為固定大小的 JPEG"""
+    data_endpoint = "https://api-data.line.me"
+
+    def __init__(self, latency: float, media_bytes: int):
+        self.latency = latency
+        self.media = b"\xff\xd8\xff" + b"\0" * max(0, media_bytes - 3)
+
+    def _call(self):
+        time.sleep(self.latency)
+
+    def reply_message(self, reply_token, messages, **kwargs):
+        self._call()
+
+    def push_message(self, to, messages, **kwargs):
+        self._call()
+
+    def get_profile(self, user_id, **kwargs):
+        self._call()
+        return SimpleNamespace(display_name="replay")
+
+    def get_group_summary(self, group_id, **kwargs):
+        self._call()
+        return SimpleNamespace(group_name="replay")
+
+    def get_message_content(self, message_id, **kwargs):
+        self._call()
+        return FakeContent(self.media)
+
+    def _get(self, path, endpoint=None, headers=None, stream=False, timeout=None):
+        self._call()
+        if path.endswith("/transcoding"):
+            return SimpleNamespace(json={"status": "succeeded"}, status_code=200, headers={})
+        return FakeContent(self.media)
+
+
+class FakeGDrive:
+    """GDriveClient 替身：每次呼叫等待 latency 秒 (上傳另加每 MB 的傳輸時間)"""
+    folder_id = None
+
+    def __init__(self, latency: float, ms_per_mb: float):
+        self.latency = latency
+        self.ms_per_mb = ms_per_mb
+        self.calls = 0
+        self._count_lock = threading.Lock()
+        self.credential_manager = SimpleNamespace(stop=lambda: None)
+        self.transport = SimpleNamespace(close=lambda: None)
+
+    def _call(self, size: int = 0) -> str:
+        with self._count_lock:
+            self.calls += 1
+            n = self.calls
+        time.sleep(self.latency + size / (1024 * 1024) * self.ms_per_mb / 1000)
+        return f"https://drive.example/replay-{n}"
+
+    def warm_up(self):
+        pass
+
+    def upload_file(self, content, filename, mime_type):
+        if isinstance(content, (bytes, bytearray)):
+            size = len(content)
+        else:
+            content.seek(0, os.SEEK_END)
+            size = content.tell()
+        return self._call(size)
+
+    def upload_public_image(self, content, filename, mime_type):
+        return self._call(len(content))
+
+    def create_doc(self, title, content_items, html_content=None):
+        return self._call()
+
+    def create_blank_doc(self, title):
+        link = self._call()
+        return {"id": link.rsplit("/", 1)[-1], "webViewLink": link}
+
+    def append_to_doc(self, doc_id, content_blocks):
+        self._call()
+
+    def get_doc_by_name(self, name):
+        self._call()
+        return None
+
+
+def build_fake_runtime(args):
+    """本地實例：真實的 adapter / 排程 / 狀態，下游 (Google、LINE、外部網頁) 全部替換為替身"""
+    from src.main import BotRuntime
+    from src.adapters.line_adapter import LineAdapter
+
+    class ReplayRuntime(BotRuntime):
+        def __init__(self):
+            super().__init__()
+            self.fake_gdrive = FakeGDrive(args.gdrive_ms / 1000, args.gdrive_ms_per_mb)
+
+        @property
+        def gdrive_client(self):
+            return self.fake_gdrive
+
+        @property
+        def save_service(self):
+            service = BotRuntime.save_service.fget(self)
+            # 連結預覽不連外
+            service._fetch_url_content = lambda url: (
+                time.sleep(args.link_ms / 1000),
+                {"title": url, "description": "", "image": "", "html_content": ""}
+            )[1]
+            return service
+
+        @property
+        def line_adapter(self):
+            with self._lock:
+                if self._line_adapter is None:
+                    adapter = LineAdapter(self.save_service, self.state_backend, limiter=self.limiter)
+                    adapter.line_bot_api = FakeLineApi(args.line_ms / 1000, args.media_kb * 1024)
+                    adapter.start()
+                    self._line_adapter = adapter
+                return self._line_adapter
+
+    return ReplayRuntime()
+
+
+def serve(args, user_ids):
+    """在背景執行緒啟動本地實例，回傳 (webhook URL, runtime)"""
+    import uvicorn
+    os.environ.update({
+        "LINE_CHANNEL_SECRET": args.secret,
+        "LINE_CHANNEL_ACCESS_TOKEN": "replay",
+        "STATE_BACKEND": "sqlite",
+        "STATE_DB_PATH": os.path.join(tempfile.mkdtemp(prefix="replay-"), "state.db"),
+        "USE_NGROK": "false",
+        # 重播的流量不再錄製 (空字串可避免 .env 的設定覆蓋)
+        "WEBHOOK_RECORD_PATH": "",
+    })
+    from src.main import create_app
+    runtime = build_fake_runtime(args)
+    app = create_app(runtime)
+    if args.auto_save:
+        for user_id in user_ids:
+            runtime.line_adapter.auto_save_settings.set(user_id, True)
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=args.port, log_level="warning"))
+    threading.Thread(target=server.run, name="replay-server", daemon=True).start()
+    deadline = time.monotonic() + 15
+    while not server.started and time.monotonic() < deadline:
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{args.port}/webhook/line", runtime
+
+
+def percentile(values, q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def replay(records, url: str, secret: str, speed: float, concurrency: int, run_id: str, keep_event_ids: bool):
+    """依原始間隔 / speed 送出 (open loop：不等前一個回應)，回傳每個請求的結果"""
+    import requests
+    local = threading.local()
+    results = []
+    results_lock = threading.Lock()
+
+    def send(offset: float, payload: dict):
+        if not keep_event_ids:
+            # 重新編號，避免與先前的重播一起被去重
+            for event in payload.get("events", []):
+                if event.get("webhookEventId"):
+                    event["webhookEventId"] = f"{event['webhookEventId']}-{run_id}"
+        body = json.dumps(payload, ensure_ascii=False, separators=(",", ":"))
+        session = getattr(local, "session", None)
+        if session is None:
+            session = local.session = requests.Session()
+        started = time.perf_counter()
+        try:
+            status = session.post(
+                url, data=body.encode("utf-8"),
+                headers={"Content-Type": "application/json", "X-Line-Signature": sign(body, secret)},
+                timeout=30
+            ).status_code
+        except Exception:
+            status = 0
+        latency = time.perf_counter() - started
+        with results_lock:
+            results.append({"offset": offset, "latency": latency, "status": status, "events": len(payload.get("events", []))})
+
+    t0 = records[0][0]
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="replay") as pool:
+        for t, payload in records:
+            offset = (t - t0) / speed
+            delay = start + offset - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(send, offset, payload)
+    return results, time.monotonic() - start
+
+
+def wait_for_drain(runtime, timeout: float) -> float:
+    """等待 Webhook 佇列與背景排程清空，回傳所需秒數 (逾時回傳 -1)"""
+    from src.adapters.line_adapter import WEBHOOK_QUEUE
+    adapter = runtime.line_adapter
+    started = time.monotonic()
+    while time.monotonic() - started < timeout:
+        stats = adapter.scheduler.stats()
+        busy = stats["running"] + stats["light"] + stats["heavy"] + stats["delayed"]
+        if not busy and not adapter.state.queue_length(WEBHOOK_QUEUE):
+            return time.monotonic() - started
+        time.sleep(0.1)
+    return -1
+
+
+def print_report(results, wall: float, bucket: float, csv_path: str = None):
+    latencies = [r["latency"] * 1000 for r in results]
+    errors = sum(1 for r in results if r["status"] != 200)
+    events = sum(r["events"] for r in results)
+    print(f"📊 [Replay] {len(results)} requests / {events} events in {wall:.1f} s "
+          f"({len(results) / wall:.1f} req/s, {events / wall:.1f} events/s), errors: {errors}")
+    print(f"   latency ms: p50 {percentile(latencies, 0.5):.1f}  p95 {percentile(latencies, 0.95):.1f}  "
+          f"p99 {percentile(latencies, 0.99):.1f}  max {max(latencies):.1f}")
+
+    # 依重播時間分桶的吞吐量與延遲曲線
+    buckets = {}
+    for r in results:
+        buckets.setdefault(int(r["offset"] // bucket), []).append(r)
+    rows = []
+    for index in range(max(buckets) + 1):
+        items = buckets.get(index, [])
+        lat = [r["latency"] * 1000 for r in items]
+        rows.append((index * bucket, len(items) / bucket, percentile(lat, 0.5), percentile(lat, 0.95),
+                     sum(1 for r in items if r["status"] != 200)))
+    print(f"{'t(s)':>8} {'req/s':>8} {'p50(ms)':>9} {'p95(ms)':>9} {'errors':>7}")
+    for t, rps, p50, p95, errs in rows:
+        print(f"{t:>8.1f} {rps:>8.1f} {p50:>9.1f} {p95:>9.1f} {errs:>7}")
+    if csv_path:
+        with open(csv_path, "w", encoding="utf-8") as f:
+            f.write("t_s,req_per_s,p50_ms,p95_ms,errors\n")
+            for row in rows:
+                f.write(",".join(f"{v:.3f}" if isinstance(v, float) else str(v) for v in row) + "\n")
+        print(f"💾 [Replay] 曲線已寫入 {csv_path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded LINE webhooks (WEBHOOK_RECORD_PATH) against a local instance")
+    parser.add_argument("recording")
+    parser.add_argument("--speed", type=float, default=1.0, help="playback speed (2 = twice as fast)")
+    parser.add_argument("--url", help="webhook URL of a running instance (default: start a local instance with fake downstreams)")
+    parser.add_argument("--secret", default=os.getenv("REPLAY_CHANNEL_SECRET", TEST_SECRET), help="channel secret used to re-sign payloads")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--concurrency", type=int, default=64, help="max requests in flight")
+    parser.add_argument("--limit", type=int, help="replay only the first N requests")
+    parser.add_argument("--bucket", type=float, default=1.0, help="curve bucket size in seconds")
+    parser.add_argument("--csv", help="write the throughput/latency curve to this CSV file")
+    parser.add_argument("--keep-event-ids", action="store_true", help="do not rewrite webhookEventId (replays will be deduplicated)")
+    parser.add_argument("--auto-save", action="store_true", help="local instance: enable auto-save for every recorded user")
+    parser.add_argument("--line-ms", type=float, default=30, help="fake LINE API latency")
+    parser.add_argument("--gdrive-ms", type=float, default=150, help="fake Google API latency")
+    parser.add_argument("--gdrive-ms-per-mb", type=float, default=100, help="fake upload time per MB")
+    parser.add_argument("--link-ms", type=float, default=300, help="fake link preview fetch latency")
+    parser.add_argument("--media-kb", type=int, default=512, help="fake media content size")
+    parser.add_argument("--drain-timeout", type=float, default=120)
+    args = parser.parse_args()
+
+    records = list(iter_recording(args.recording))
+    if args.limit:
+        records = records[:args.limit]
+    if not records:
+        print("❌ [Replay] 錄製檔沒有任何請求")
+        sys.exit(1)
+    span = records[-1][0] - records[0][0]
+    print(f"▶️ [Replay] {len(records)} requests spanning {span:.1f} s at {args.speed:g}x")
+
+    runtime = None
+    if args.url:
+        url = args.url
+    else:
+        user_ids = {e.get("source", {}).get("userId") for _, p in records for e in p.get("events", [])} - {None}
+        url, runtime = serve(args, user_ids)
+
+    results, wall = replay(records, url, args.secret, args.speed, args.concurrency,
+                           run_id=str(int(time.time())), keep_event_ids=args.keep_event_ids)
+    print_report(results, wall, args.bucket, args.csv)
+
+    if runtime is not None:
+        drained = wait_for_drain(runtime, args.drain_timeout)
+        if drained < 0:
+            print(f"⚠️ [Replay] 背景處理在 {args.drain_timeout:.0f} s 內未完成")
+        else:
+            print(f"✅ [Replay] 背景處理於最後一個請求後 {drained:.1f} s 完成 "
+                  f"(Google 呼叫 {runtime.fake_gdrive.calls} 次)")
+        print(f"   metrics: {json.dumps(runtime.metrics(), ensure_ascii=False)}")
+
+
+if __name__ == "__main__":
+    main()
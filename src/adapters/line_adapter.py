@@ -1,72 +1,274 @@
 import os
 import re
 import json
-from linebot import LineBotApi, WebhookHandler
+import threading
+from functools import partial
+from contextlib import ExitStack, nullcontext
+from concurrent.futures import ThreadPoolExecutor, wait
+from tqdm import tqdm
+from linebot import LineBotApi, SignatureValidator
+from linebot.exceptions import InvalidSignatureError
 from linebot.models import MessageEvent, TextMessage, ImageMessage, VideoMessage, FileMessage, TextSendMessage
-from concurrent.futures import ThreadPoolExecutor
+from linebot.models import StickerMessage, LocationMessage, AudioMessage
+from typing import Optional, List
 from ..services.save_service import SaveService
+from ..services.media_types import GENERIC_MIME, MIME_EXTENSION, content_type_for_mime, sniff_mime
+from ..state.backend import StateBackend, create_state_backend
+from ..state.auto_save_store import AutoSaveSettings, JournalSettings, snapshot_path_from_env
+from ..state.dedup import EventDeduplicator
+from ..state.recent_messages import RecentMessages
+from ..workers.adaptive_limit import AdaptiveLimit
+from ..workers.fair_scheduler import FairScheduler
+from ..workers.keyed_executor import KeyedExecutor
+from ..workers.memory_budget import MemoryBudget
+from ..workers.resumable_download import ResumableDownload
 from ..commands.abstraction import CommandRegistry, CommandContext
-from .line_strategies import LineHelpCommand, LineAutoSaveCommand, LineSaveCommand
+from .line_strategies import LineHelpCommand, LineAutoSaveCommand, LineSaveCommand, LineBatchSaveCommand, LineJournalCommand
 from ..locales.i18n_service import t
 
+# Quoted ID 只需要存活到 /save 指令被處理完
+QUOTED_ID_TTL = 600
+WEBHOOK_QUEUE = "webhook_events"
+HEAVY_MESSAGES = (ImageMessage, VideoMessage, FileMessage, AudioMessage)
+# 依 Payload 的 message.type 分派: 內容已在 Payload 中的類型直接儲存，媒體才需下載
+INLINE_MESSAGE_TYPES = ("text", "sticker", "location")
+MEDIA_MESSAGE_TYPES = {"image": "image", "video": "video", "audio": "audio", "file": "file"}
+# 內容需等 LINE 轉檔完成的類型 (None: 類型未知的被引用訊息)
+TRANSCODED_MESSAGE_TYPES = ("video", "audio", None)
+# 判斷未知類型內容時讀取的開頭長度
+SNIFF_BYTES = 64
+SUPPORTED_MESSAGES = (TextMessage, ImageMessage, VideoMessage, FileMessage, StickerMessage, LocationMessage, AudioMessage)
+# EVENT_PARALLEL_MEDIA 開啟時可在同一聊天內平行處理的訊息
+PARALLEL_MEDIA_MESSAGES = (ImageMessage, VideoMessage, FileMessage, AudioMessage)
+
 class LineAdapter:
-    def __init__(self, save_service: SaveService):
+    def __init__(self,
+                 save_service: SaveService,
+                 state: Optional[StateBackend] = None,
+                 limiter: Optional[AdaptiveLimit] = None,
+                 settings_file: Optional[str] = None):
         self.line_bot_api = LineBotApi(os.getenv('LINE_CHANNEL_ACCESS_TOKEN'))
-        self.handler = WebhookHandler(os.getenv('LINE_CHANNEL_SECRET'))
+        self.signature_validator = SignatureValidator(os.getenv('LINE_CHANNEL_SECRET') or '')
         self.save_service = save_service
-        self.auto_save_file = "auto_save_settings.json"
-        self._load_auto_save_settings()
+
+        # 共享狀態 (跨 worker / 節點): auto_save 設定、Quoted ID、事件去重、隊列計數
+        self.state = state or create_state_backend()
+        # auto_save 設定的 JSON 快照 (備份 / 舊版匯入)，路徑由設定決定而非工作目錄
+        self.auto_save_settings = AutoSaveSettings(self.state, legacy_file=settings_file or snapshot_path_from_env())
+        self.journal_settings = JournalSettings(self.state)
+        self.deduplicator = EventDeduplicator(self.state, ttl=int(os.getenv("EVENT_DEDUP_TTL", 24 * 3600)))
         
-        # 建立單一執行緒池處理後台任務 (防止 Webhook 逾時與改善回應速度)
-        self.executor = ThreadPoolExecutor(max_workers=10) # 增加 worker 數量
-        self.queue_count = 0  # 追蹤當前排隊中的任務數
+        # Webhook 事件消費者 (從共享佇列取出已驗證的 Payload 處理)
+        self.consumer_count = int(os.getenv("WEBHOOK_CONSUMERS", 2))
+        # 已領取但未確認的 Webhook 在此秒數後重新投遞 (消費者當機時不遺失事件)
+        self.webhook_visibility = float(os.getenv("WEBHOOK_VISIBILITY_TIMEOUT", 300))
+        self._consumers = []
+        self._stop_consumers = threading.Event()
+        # 追蹤當前排隊中的任務數
+        self._queue_count = 0
+        self._queue_lock = threading.Lock()
+
+        # 同一 Payload 的多個事件平行處理，同一聊天內仍依序 (0 = 全部依序處理)
+        dispatch_workers = int(os.getenv("EVENT_DISPATCH_WORKERS", 8))
+        self.dispatcher = KeyedExecutor(dispatch_workers) if dispatch_workers > 0 else None
+        # EVENT_PARALLEL_MEDIA=true: 同一聊天連續的媒體 (相簿) 彼此平行處理，回覆順序可能與傳送順序不同
+        self.parallel_media = os.getenv("EVENT_PARALLEL_MEDIA", "false").lower() == "true"
+
+        # 後台任務的公平排程 (防止 Webhook 逾時，且避免單一使用者的大量媒體拖慢其他人)
+        # 同時執行數由 AIMD 控制器依 Google / LINE 的延遲與錯誤調整，BACKUP_WORKERS 為上限
+        max_workers = int(os.getenv("BACKUP_WORKERS", 10))
+        self.limiter = limiter if limiter is not None else AdaptiveLimit.from_env(max_workers)
+        self.scheduler = FairScheduler(
+            max_workers=max_workers,
+            heavy_per_user=int(os.getenv("HEAVY_JOBS_PER_USER", 2)),
+            light_reserved=int(os.getenv("LIGHT_RESERVED_WORKERS", 2)),
+            limiter=self.limiter
+        )
+
+        # 下載緩衝的記憶體預算，大檔案改走少量的磁碟暫存通道
+        self.memory_budget = MemoryBudget(
+            total_bytes=int(os.getenv("MEMORY_BUDGET_MB", 256)) * 1024 * 1024,
+            large_threshold=int(os.getenv("LARGE_FILE_MB", 32)) * 1024 * 1024,
+            large_slots=int(os.getenv("LARGE_FILE_SLOTS", 2)),
+            spool_dir=os.getenv("SPOOL_DIR") or None
+        )
 
-        # Command Registry Initialization
+        # /save_batch: 最近訊息的短期參照 (Messaging API 無法查詢歷史訊息)
+        self.recent_messages = RecentMessages(
+            self.state,
+            limit=int(os.getenv("RECENT_MESSAGES_LIMIT", 50)),
+            ttl=float(os.getenv("RECENT_MESSAGES_TTL", 3600))
+        )
+        self.batch_max = int(os.getenv("BATCH_SAVE_MAX", 30))
+
+        # 內容下載: chunk 大小、每個 chunk 的讀取逾時、重試/續傳次數
+        self.download_chunk_size = int(os.getenv("DOWNLOAD_CHUNK_KB", 256)) * 1024
+        self.download_connect_timeout = float(os.getenv("DOWNLOAD_CONNECT_TIMEOUT", 10))
+        self.download_chunk_timeout = float(os.getenv("DOWNLOAD_CHUNK_TIMEOUT", 30))
+        self.download_max_attempts = int(os.getenv("DOWNLOAD_MAX_ATTEMPTS", 4))
+
+        # 影片/音訊轉檔完成前的輪詢 (指數退避)
+        self.transcode_base_delay = float(os.getenv("TRANSCODE_POLL_BASE_SECONDS", 2))
+        self.transcode_max_delay = float(os.getenv("TRANSCODE_POLL_MAX_SECONDS", 60))
+        self.transcode_max_attempts = int(os.getenv("TRANSCODE_MAX_ATTEMPTS", 10))
+        self.batch_workers = int(os.getenv("BATCH_SAVE_WORKERS", 4))
+
+        # Command Registry Initialization (/save_batch 需在 /save 之前比對)
         self.registry = CommandRegistry()
+        self.registry.register(LineBatchSaveCommand())
         self.registry.register(LineSaveCommand())
         self.registry.register(LineAutoSaveCommand())
+        self.registry.register(LineJournalCommand())
         self.registry.register(LineHelpCommand())
 
-        from linebot.models import StickerMessage, LocationMessage, AudioMessage
-        @self.handler.add(MessageEvent, message=(TextMessage, ImageMessage, VideoMessage, FileMessage, StickerMessage, LocationMessage, AudioMessage))
-        def handle_message(event):
-            self._on_message(event)
+    def start(self):
+        """啟動背景工作 (設定 write-behind、Webhook 事件消費者等)，由 FastAPI startup 呼叫"""
+        self.auto_save_settings.start()
+        self.journal_settings.start()
+        if self._consumers:
+            return
+        self._stop_consumers.clear()
+        for i in range(self.consumer_count):
+            thread = threading.Thread(target=self._consume_webhooks, name=f"webhook-consumer-{i}", daemon=True)
+            thread.start()
+            self._consumers.append(thread)
 
-    def _load_auto_save_settings(self):
-        if os.path.exists(self.auto_save_file):
-            with open(self.auto_save_file, 'r') as f:
-                self.auto_save_settings = json.load(f)
-        else:
-            self.auto_save_settings = {}
+    def shutdown(self):
+        """寫回尚未落地的狀態並停止背景工作"""
+        self._stop_consumers.set()
+        for thread in self._consumers:
+            thread.join(timeout=5)
+        self._consumers = []
+        self.auto_save_settings.close()
+        self.journal_settings.close()
+        if self.dispatcher:
+            self.dispatcher.shutdown(wait=False)
+        self.scheduler.shutdown(wait=False)
 
-    def save_auto_save_settings(self):
-        with open(self.auto_save_file, 'w') as f:
-            json.dump(self.auto_save_settings, f)
+    @property
+    def queue_count(self) -> int:
+        """本行程排隊中的自動備份任務數"""
+        return self._queue_count
+
+    def _adjust_queue_count(self, delta: int) -> int:
+        # 只存在記憶體中：行程結束時一併歸零，不會在共享狀態留下錯誤的計數
+        with self._queue_lock:
+            self._queue_count = max(0, self._queue_count + delta)
+            return self._queue_count
+
+    def verify_signature(self, body: str, signature: str):
+        if not self.signature_validator.validate(body, signature or ''):
+            raise InvalidSignatureError(f"Invalid signature. signature={signature}")
+
+    def ingest(self, body: str, signature: str):
+        """
+        Ingestion stage: verify the signature and enqueue the raw body.
+        The webhook can be acknowledged right after; processing happens
+        on the consumer threads and never blocks on Google or remote sites.
+        """
+        self.verify_signature(body, signature)
+        self.state.enqueue(WEBHOOK_QUEUE, body)
 
     def handle_request(self, body: str, signature: str):
-        # 預先解析原始 Payload 以提取 SDK 可能遺漏的欄位 (如 quotedMessageId)
+        """同步處理 (驗證後直接處理，不經佇列)"""
+        self.verify_signature(body, signature)
+        self.process_body(body)
+
+    def process_body(self, body: str):
+        """Processing stage: 處理已通過簽章驗證的 Payload"""
+        # Payload 只解析一次，事件物件直接交給訊息處理
+        payload = json.loads(body)
+        events = self.parse_events(payload)
+        if self.dispatcher is None or len(events) <= 1:
+            for event in events:
+                self._dispatch_once(event)
+            return
+        self._dispatch_parallel(events)
+
+    def _dispatch_parallel(self, events: List[MessageEvent]):
+        """
+        Fan events out by chat. Different chats run in parallel; events of
+        one chat run strictly in order. With parallel_media, consecutive
+        media events of a chat (album uploads, forwarded bursts) run
+        concurrently, still fenced by the events before and after them.
+        Returns once all events are processed.
+        """
+        futures = [
+            self.dispatcher.submit(
+                self.chat_id(event), self._dispatch_once, event,
+                concurrent=self.parallel_media and isinstance(event.message, PARALLEL_MEDIA_MESSAGES)
+            )
+            for event in events
+        ]
+        wait(futures)
+        errors = [f.exception() for f in futures if not f.cancelled() and f.exception()]
+        for e in errors[1:]:
+            print(f"❌ [Dispatch] 事件處理失敗: {e}", flush=True)
+        if errors:
+            raise errors[0]
+
+    def _consume_webhooks(self):
+        while not self._stop_consumers.is_set():
+            try:
+                claimed = self.state.claim(WEBHOOK_QUEUE, timeout=1, visibility=self.webhook_visibility)
+            except Exception as e:
+                print(f"⚠️ [Ingest] 讀取 Webhook 佇列失敗: {e}", flush=True)
+                self._stop_consumers.wait(1)
+                continue
+            if claimed is None:
+                continue
+            receipt, body = claimed
+            try:
+                self.process_body(body)
+            except Exception as e:
+                print(f"❌ [Ingest] 處理 Webhook 事件時發生錯誤: {e}", flush=True)
+            # 處理完 (含已記錄的錯誤) 才確認；程序在處理中途結束時，逾時後由其他消費者重新處理
+            try:
+                self.state.ack(WEBHOOK_QUEUE, receipt)
+            except Exception as e:
+                print(f"⚠️ [Ingest] 確認 Webhook 佇列項目失敗: {e}", flush=True)
+
+    def _dispatch_once(self, event: MessageEvent):
+        """同一事件 (LINE 逾時重送) 只處理一次；重複事件只需一次查表"""
+        event_key = event.webhook_event_id or event.message.id
+        if not self.deduplicator.claim(event_key):
+            print(f"♻️ [Dedup] 略過重複事件 {event_key} (isRedelivery={event.is_redelivery})", flush=True)
+            return
+        if event.is_redelivery:
+            print(f"🔁 [Dedup] 收到重送事件 {event_key}，先前未處理過，開始處理", flush=True)
         try:
-            payload = json.loads(body)
-            self._temp_quoted_ids = {} # msg_id -> quoted_msg_id
-            for event in payload.get('events', []):
-                if event.get('type') == 'message':
-                    msg = event.get('message', {})
-                    msg_id = msg.get('id')
-                    quoted_id = msg.get('quotedMessageId')
-                    if msg_id and quoted_id:
-                        self._temp_quoted_ids[msg_id] = quoted_id
-                        print(f"🔧 [Fix] 手動提取 Quoted ID: {quoted_id} for Msg {msg_id}", flush=True)
-        except Exception as e:
-            print(f"⚠️ [Fix] 預解析失敗: {e}", flush=True)
+            self._on_message(event)
+        except Exception:
+            # 處理失敗時釋放，讓下一次重送可以再試
+            self.deduplicator.release(event_key)
+            raise
 
-        self.handler.handle(body, signature)
-        
-        # 清理 (雖然 handle 是同步的，但為了保險起見)
-        self._temp_quoted_ids = {}
+    def parse_events(self, payload: dict) -> List[MessageEvent]:
+        """由已解析的 Payload 建立 SDK 事件，並補回 SDK 會丟棄的欄位 (如 quotedMessageId)"""
+        events = []
+        for raw_event in payload.get('events', []):
+            if raw_event.get('type') != 'message':
+                continue
+            event = MessageEvent.new_from_json_dict(raw_event)
+            if not isinstance(event.message, SUPPORTED_MESSAGES):
+                continue
+
+            # 欄位直接掛在該請求自己的事件物件上，不再共用 adapter 層級的暫存表
+            event.webhook_event_id = raw_event.get('webhookEventId')
+            event.is_redelivery = bool(raw_event.get('deliveryContext', {}).get('isRedelivery'))
+            msg = raw_event.get('message', {})
+            event.message.quote_token = msg.get('quoteToken')
+            event.message.quoted_message_id = msg.get('quotedMessageId')
+            if event.message.quoted_message_id:
+                print(f"🔧 [Fix] 手動提取 Quoted ID: {event.message.quoted_message_id} for Msg {event.message.id}", flush=True)
+                self.state.set(f"quote:{event.message.id}", event.message.quoted_message_id, ttl=QUOTED_ID_TTL)
+            events.append(event)
+        return events
 
     def _on_message(self, event: MessageEvent):
         user_id = event.source.user_id
         context = self.get_context_name(event)
+        self._record_recent(event)
         
         if isinstance(event.message, TextMessage):
             text = event.message.text.strip()
@@ -90,7 +292,7 @@ class LineAdapter:
         # 2. 處理自動備份 (僅限啟用了 auto_save 的 DM)
         user_id = event.source.user_id
         if event.source.type == 'user' and self.auto_save_settings.get(user_id):
-            self.queue_count += 1
+            queue_count = self._adjust_queue_count(1)
             
             # 立即回覆告知已進入隊列，並使用引用功能 (quoteToken)
             # 立即回覆告知已進入隊列，並使用引用功能 (quoteToken)
@@ -101,19 +303,66 @@ class LineAdapter:
             
             # 建立回傳訊息
             msg = TextSendMessage(
-                text=f"{queue_msg}{t('queue_info', count=self.queue_count)}",
+                text=f"{queue_msg}{t('queue_info', count=queue_count)}",
                 quote_token=quote_token
             )
             
-            self.line_bot_api.reply_message(event.reply_token, msg)
-            
-            # 使用執行緒池非同步處理
-            print(f"⏩ [Queue] 任務入隊 (Queue Size: {self.queue_count})", flush=True)
-            self.executor.submit(self._handle_auto_backup, event)
+            try:
+                self.line_bot_api.reply_message(event.reply_token, msg)
+
+                # 交給公平排程器非同步處理 (媒體走重量通道)
+                print(f"⏩ [Queue] 任務入隊 (Queue Size: {queue_count})", flush=True)
+                self._submit_when_ready(
+                    user_id, event.message.id, event.message.type,
+                    self._handle_auto_backup, event, heavy=isinstance(event.message, HEAVY_MESSAGES)
+                )
+            except Exception:
+                # 任務沒有排入，不會有對應的完成
+                self._adjust_queue_count(-1)
+                raise
             return
 
 
 
+    @staticmethod
+    def chat_id(event: MessageEvent) -> str:
+        source = event.source
+        return getattr(source, 'group_id', None) or getattr(source, 'room_id', None) or source.user_id
+
+    def saver(self, event: MessageEvent):
+        """依聊天設定選擇儲存方式：日誌模式附加至今日文件，否則建立新文件"""
+        chat_id = self.chat_id(event)
+        if self.journal_settings.get(chat_id):
+            return partial(self.save_service.process_journal_save, chat_id=chat_id)
+        return self.save_service.process_save
+
+    @staticmethod
+    def _describe(message) -> Optional[str]:
+        """不需下載即可儲存的訊息內容 (文字、貼圖、位置)"""
+        if isinstance(message, TextMessage):
+            return message.text
+        if isinstance(message, StickerMessage):
+            return f"Sticker ID: {message.sticker_id}"
+        if isinstance(message, LocationMessage):
+            return f"Location: {message.address}"
+        return None
+
+    def _record_recent(self, event: MessageEvent):
+        """記錄訊息參照供 /save_batch 使用 (指令本身不記錄)"""
+        message = event.message
+        if isinstance(message, TextMessage) and message.text.strip().startswith('/'):
+            return
+        try:
+            ref = {"id": message.id, "type": message.type}
+            text = self._describe(message)
+            if text:
+                ref["text"] = text
+            if isinstance(message, FileMessage):
+                ref["file_name"] = message.file_name
+            self.recent_messages.record(self.chat_id(event), ref)
+        except Exception as e:
+            print(f"⚠️ [Batch] 記錄最近訊息失敗: {e}", flush=True)
+
     def _handle_auto_backup(self, event: MessageEvent):
         chat_context = self.get_context_name(event)
         user_id = event.source.user_id
@@ -122,7 +371,7 @@ class LineAdapter:
             file_info = ""
             
             if isinstance(event.message, TextMessage):
-                doc_link = self.save_service.process_save(
+                doc_link = self.saver(event)(
                     platform="LINE",
                     context=chat_context,
                     content_type="text",
@@ -148,114 +397,154 @@ class LineAdapter:
                 TextSendMessage(text=t("backup_error"))
             )
         finally:
-            self.queue_count = max(0, self.queue_count - 1)
-            print(f"📉 [Queue] 任務完成 (Remaining: {self.queue_count})", flush=True)
+            remaining = self._adjust_queue_count(-1)
+            print(f"📉 [Queue] 任務完成 (Remaining: {remaining})", flush=True)
 
     def _process_media_message(self, event: MessageEvent, context: str, user_id: str, custom_title: str = None, msg_id: str = None) -> (str, str):
-        """統一處裡媒體內容的下載與儲存，支援直接訊息或回覆訊息"""
-        from linebot.models import StickerMessage, LocationMessage, AudioMessage, FileMessage, ImageMessage, VideoMessage
-        from tqdm import tqdm
-        
+        """
+        統一處理訊息內容的儲存，支援直接訊息或回覆訊息。
+        依 Payload 的訊息類型分派：文字/貼圖/位置直接儲存，不發出注定失敗的下載請求。
+        """
         target_msg_id = msg_id or event.message.id
-        msg_obj = event.message if not msg_id else None # 如果是回覆，則不知道對象類型
-        
-        print(f"📦 [Process] 正在處理內容 (ID: {target_msg_id})...", flush=True)
-        
-        content_bytes = None
-        content_type = "file"
-        text_content = custom_title
-        filename = f"auto_{target_msg_id}"
-        file_info = ""
-        # 1. 嘗試下載媒體內容
-        try:
-            resp = self.line_bot_api.get_message_content(target_msg_id)
-            
-            # 從 Header 偵測 Content-Type (用於解決回覆時不知道類型的問題)
-            content_header = ""
-            if hasattr(resp, 'headers'):
-                content_header = resp.headers.get('Content-Type', '').lower()
-            
-            if 'image' in content_header: content_type = "image"
-            elif 'video' in content_header: content_type = "video"
-            elif 'audio' in content_header: content_type = "audio"
-            
-            # 獲取檔案大小
-            total_size = None
-            if hasattr(resp, 'headers') and 'Content-Length' in resp.headers:
-                total_size = int(resp.headers['Content-Length'])
-            elif hasattr(resp, 'content_length'):
-                total_size = int(resp.content_length)
-            
-            if total_size:
-                size_mb = round(total_size / (1024 * 1024), 2)
-                file_info = f" (大小: {size_mb} MB)"
-            
-            content_bytes = bytearray()
-            pbar = tqdm(total=total_size, unit='B', unit_scale=True, desc=f"📥 Downloading {target_msg_id[:8]}")
-            
-            try:
-                if hasattr(resp, 'iter_content'):
-                    last_line_progress = 0
-                    downloaded = 0
-                    for chunk in resp.iter_content(chunk_size=128*1024):
-                        content_bytes.extend(chunk)
-                        downloaded += len(chunk)
-                        pbar.update(len(chunk))
-                        if total_size:
-                            progress = int((downloaded / total_size) * 100)
-                            if progress >= last_line_progress + 25 and progress < 100:
-                                last_line_progress = (progress // 25) * 25
-                                try: self.line_bot_api.push_message(user_id, TextSendMessage(text=t("download_progress", progress=last_line_progress)))
-                                except: pass
-                else:
-                    content_bytes = resp.content
-                    if total_size: pbar.update(total_size)
-            finally:
-                pbar.close()
-                if hasattr(resp, 'close'): resp.close()
-            
-            content_bytes = bytes(content_bytes)
-
-            # 判定類型 (優先使用 Header，如果有 msg_obj 則作為補強)
-            if msg_obj:
-                if isinstance(msg_obj, ImageMessage): content_type = "image"
-                elif isinstance(msg_obj, VideoMessage): content_type = "video"
-                elif isinstance(msg_obj, AudioMessage): content_type = "audio"
-                elif isinstance(msg_obj, FileMessage):
-                    content_type = "file"
-                    filename = getattr(msg_obj, 'file_name', filename)
-            elif content_type == "file" and 'image' not in content_header and 'video' not in content_header:
-                # 如果是回覆且沒偵測到特定類型，嘗試從 SDK 報錯中學習 (這裡通常已經下載完成)
-                pass 
-            
-        except Exception as e:
-            # 如果下載失敗且不是媒體訊息，可能是貼圖或位置
-            print(f"⚠️ [Process] 無法作為媒體下載: {e}", flush=True)
-            if msg_obj and isinstance(msg_obj, StickerMessage):
-                content_type = "sticker"
-                text_content = f"{custom_title + ': ' if custom_title else ''}Sticker ID: {msg_obj.sticker_id}"
-            elif msg_obj and isinstance(msg_obj, LocationMessage):
-                content_type = "location"
-                text_content = f"{custom_title + ': ' if custom_title else ''}Location: {msg_obj.address}"
-            else:
-                # 重要：如果既下載失敗又不是已知可處理對象，則不應建立空 Doc
-                raise Exception("該訊息類型不支援下載儲存 (或是內容已過期)。")
-        
-        # 2. 儲存至雲端 (確保有內容可用)
-        if not content_bytes and not text_content:
-             raise Exception("無效的儲存內容。")
-        doc_link = self.save_service.process_save(
+        message = event.message if not msg_id else None
+        # 回覆時從近期訊息紀錄查詢被引用訊息的類型 (查無紀錄則為未知類型，下載後判斷)
+        ref = None if message else self.recent_messages.find(self.chat_id(event), target_msg_id)
+        message_type = message.type if message else (ref or {}).get("type")
+
+        print(f"📦 [Process] 正在處理內容 (ID: {target_msg_id}, Type: {message_type or 'unknown'})...", flush=True)
+
+        if message_type in INLINE_MESSAGE_TYPES:
+            return self._save_inline(event, context, message_type, message, ref, custom_title), ""
+        return self._save_downloaded(event, context, user_id, target_msg_id, message_type, message, ref, custom_title)
+
+    def _save_inline(self, event: MessageEvent, context: str, message_type: str, message, ref: Optional[dict], custom_title: str = None) -> str:
+        """文字、貼圖、位置：內容已在 Payload (或近期紀錄) 中"""
+        text_content = self._describe(message) if message else (ref or {}).get("text")
+        if not text_content:
+            raise Exception("無效的儲存內容。")
+        if custom_title:
+            text_content = f"{custom_title}: {text_content}"
+        return self.saver(event)(
             platform="LINE",
             context=context,
-            content_type=content_type,
-            text=text_content,
-            file_content=content_bytes,
-            filename=filename
+            content_type=message_type,
+            text=text_content
         )
+
+    def _save_downloaded(self, event: MessageEvent, context: str, user_id: str, msg_id: str, message_type: Optional[str], message, ref: Optional[dict], custom_title: str = None) -> (str, str):
+        """媒體：下載至記憶體預算內的緩衝區後上傳 (類型未知時由前幾個 bytes 判斷)"""
+        filename = getattr(message, 'file_name', None) or (ref or {}).get("file_name")
+        with ExitStack() as stack:
+            try:
+                content_type, buffer, file_info, mime = self._download_content(msg_id, stack, user_id)
+            except Exception as e:
+                print(f"⚠️ [Process] 無法作為媒體下載: {e}", flush=True)
+                raise Exception("該訊息類型不支援下載儲存 (或是內容已過期)。")
+
+            # Payload 的類型優先，Header / 內容判斷作為補強
+            if message_type in MEDIA_MESSAGE_TYPES:
+                content_type = MEDIA_MESSAGE_TYPES[message_type]
+            if not filename:
+                filename = f"auto_{msg_id}{MIME_EXTENSION.get(mime, '')}"
+
+            # 緩衝區與記憶體預算保留到上傳完成
+            doc_link = self.saver(event)(
+                platform="LINE",
+                context=context,
+                content_type=content_type,
+                text=custom_title,
+                file_content=buffer,
+                filename=filename
+            )
         return doc_link, file_info
 
+    def _download_content(self, msg_id: str, stack: ExitStack, user_id: Optional[str] = None):
+        """
+        下載訊息內容至記憶體預算內的緩衝區 (生命週期綁定 stack)。
+        回傳 (content_type, buffer, file_info, mime)；有 user_id 時推播下載進度。
+        """
+        file_info = ""
+        download = ResumableDownload(
+            lambda start: self._open_content(msg_id, start),
+            chunk_size=self.download_chunk_size,
+            max_attempts=self.download_max_attempts,
+            label=msg_id[:8]
+        )
+        stack.callback(download.close)
+        download.open()
+        total_size = download.total_size
+        mime = download.content_type.split(';')[0].strip().lower() or None
+
+        # 獲取檔案大小
+        if total_size:
+            size_mb = round(total_size / (1024 * 1024), 2)
+            file_info = f" (大小: {size_mb} MB)"
+
+        # 先向記憶體預算申請，再開始緩衝 (大檔案改寫入磁碟暫存檔)
+        if self.memory_budget.is_large(total_size):
+            print(f"💽 [Memory] 大型檔案改用磁碟暫存 (ID: {msg_id})", flush=True)
+        buffer = stack.enter_context(self.memory_budget.buffer_for(total_size, blocking=False))
+        if buffer is None:
+            # 預算或大檔案名額不足：先關閉只讀了 Header 的串流，不在等待期間佔住 LINE 連線，
+            # 取得名額後 copy_to 會重新開啟
+            print(f"⏳ [Memory] 等待下載名額，暫時關閉連線 (ID: {msg_id})", flush=True)
+            download.close()
+            buffer = stack.enter_context(self.memory_budget.buffer_for(total_size))
+
+        pbar = tqdm(total=total_size, unit='B', unit_scale=True, desc=f"📥 Downloading {msg_id[:8]}")
+        last_line_progress = 0
+
+        def on_progress(downloaded: int, total: Optional[int]):
+            nonlocal last_line_progress
+            pbar.n = downloaded
+            pbar.refresh()
+            if total and user_id:
+                progress = int((downloaded / total) * 100)
+                if progress >= last_line_progress + 25 and progress < 100:
+                    last_line_progress = (progress // 25) * 25
+                    try: self.line_bot_api.push_message(user_id, TextSendMessage(text=t("download_progress", progress=last_line_progress)))
+                    except: pass
+
+        try:
+            download.copy_to(buffer, on_progress)
+        finally:
+            pbar.close()
+        print(f"✅ [Download] {msg_id[:8]} 完成 ({download.downloaded} bytes, sha256={download.checksum[:16]}…, 續傳 {download.resumes} 次)", flush=True)
+
+        # 由內容開頭判斷未知類型
+        buffer.seek(0)
+        mime = self._resolve_mime(mime, buffer.read(SNIFF_BYTES))
+        buffer.seek(0)
+        return content_type_for_mime(mime), buffer, file_info, mime
+
+    def _open_content(self, msg_id: str, start: int = 0):
+        """開啟內容串流；start > 0 時以 Range 續傳。讀取逾時即為每個 chunk 的逾時"""
+        timeout = (self.download_connect_timeout, self.download_chunk_timeout)
+        with self._track("line"):
+            if not start:
+                return self.line_bot_api.get_message_content(msg_id, timeout=timeout)
+            api = self.line_bot_api
+            return api._get(
+                f"/v2/bot/message/{msg_id}/content",
+                endpoint=api.data_endpoint,
+                headers={'Range': f"bytes={start}-"},
+                stream=True,
+                timeout=timeout
+            )
+
+    def _track(self, source: str):
+        """LINE API 的回應時間 (至 Header) 與錯誤回報給並行上限控制器"""
+        return self.limiter.track(source) if self.limiter else nullcontext()
+
+    @staticmethod
+    def _resolve_mime(header_mime: Optional[str], head: bytes) -> Optional[str]:
+        """Header 缺少或為通用類型時，以內容開頭的 magic bytes 判斷"""
+        if header_mime and header_mime != GENERIC_MIME:
+            return header_mime
+        return sniff_mime(head) or header_mime
+
     def handle_save_by_id(self, event: MessageEvent, msg_id: str, title: str, context: str):
-        # 使用執行緒池非同步處理
+        # 回覆模式只支援媒體，一律走重量通道
         user_id = event.source.user_id
         
         def task():
@@ -287,13 +576,102 @@ class LineAdapter:
                     TextSendMessage(text=t("manual_save_error"))
                 )
 
-        self.executor.submit(task)
+        ref = self.recent_messages.find(self.chat_id(event), msg_id)
+        self._submit_when_ready(user_id, msg_id, (ref or {}).get("type"), task, heavy=True)
+
+    def _submit_when_ready(self, user_id: str, msg_id: str, message_type: Optional[str], fn, *args, heavy: bool = True):
+        """影片/音訊 (或未知類型) 先確認 LINE 已完成轉檔再排程下載"""
+        if message_type in TRANSCODED_MESSAGE_TYPES:
+            self.scheduler.submit(user_id, self._run_when_ready, user_id, msg_id, fn, args, 0, heavy=heavy)
+        else:
+            self.scheduler.submit(user_id, fn, *args, heavy=heavy)
+
+    def _run_when_ready(self, user_id: str, msg_id: str, fn, args: tuple, attempt: int):
+        """
+        Readiness stage: one status call per attempt. While LINE is still
+        preparing the content the job is parked on the scheduler timer with
+        exponential backoff instead of sleeping on a worker thread.
+        """
+        try:
+            status = self._transcoding_status(msg_id)
+        except Exception as e:
+            # 非影片/音訊或查詢失敗: 直接嘗試下載
+            print(f"⚠️ [Transcode] 無法查詢轉檔狀態 (ID: {msg_id}): {e}", flush=True)
+            status = None
+
+        if status == "processing" and attempt < self.transcode_max_attempts:
+            delay = min(self.transcode_base_delay * (2 ** attempt), self.transcode_max_delay)
+            print(f"⏳ [Transcode] 內容準備中 (ID: {msg_id})，{delay:.0f}s 後再確認 (第 {attempt + 1} 次)", flush=True)
+            if attempt == 0:
+                try: self.line_bot_api.push_message(user_id, TextSendMessage(text=t("transcoding_wait")))
+                except Exception: pass
+            self.scheduler.submit_later(delay, user_id, self._run_when_ready, user_id, msg_id, fn, args, attempt + 1, heavy=True)
+            return None
+        if status == "failed":
+            print(f"⚠️ [Transcode] LINE 轉檔失敗 (ID: {msg_id})，仍嘗試下載", flush=True)
+        return fn(*args)
+
+    def _transcoding_status(self, msg_id: str) -> Optional[str]:
+        """GET /v2/bot/message/{id}/content/transcoding -> processing / succeeded / failed"""
+        api = self.line_bot_api
+        with self._track("line"):
+            resp = api._get(f"/v2/bot/message/{msg_id}/content/transcoding", endpoint=api.data_endpoint, timeout=10)
+        return resp.json.get("status")
+
+    def resolve_batch(self, event: MessageEvent, count: Optional[int] = None, msg_ids: Optional[List[str]] = None) -> List[dict]:
+        """依數量 (最近 N 則) 或 ID 清單取得訊息參照；未記錄的 ID 以未知類型下載"""
+        chat_id = self.chat_id(event)
+        if msg_ids:
+            known = {ref["id"]: ref for ref in self.recent_messages.latest(chat_id, self.recent_messages.limit)}
+            return [known.get(msg_id, {"id": msg_id}) for msg_id in msg_ids[:self.batch_max]]
+        return self.recent_messages.latest(chat_id, min(count or 0, self.batch_max))
+
+    def handle_batch_save(self, event: MessageEvent, refs: List[dict], title: str, context: str):
+        """批次儲存：平行下載並上傳媒體，最後只建立一份彙整 Doc"""
+        user_id = event.source.user_id
+
+        def task():
+            try:
+                doc_link, saved = self._save_batch(refs, title, context)
+                self.line_bot_api.push_message(
+                    user_id,
+                    TextSendMessage(text=t("batch_save_success", saved=saved, total=len(refs), link=doc_link))
+                )
+            except Exception as e:
+                print(f"❌ Batch save error: {e}", flush=True)
+                self.line_bot_api.push_message(user_id, TextSendMessage(text=t("batch_save_error")))
+
+        self.scheduler.submit(user_id, task, heavy=True, cost=max(1.0, float(len(refs))))
+
+    def _save_batch(self, refs: List[dict], title: str, context: str):
+        with ThreadPoolExecutor(max_workers=self.batch_workers, thread_name_prefix="batch-save") as pool:
+            entries = list(pool.map(lambda ref: self._collect_batch_item(ref, title), refs))
+        entries = [entry for entry in entries if entry]
+        if not entries:
+            raise Exception("批次中沒有可儲存的訊息。")
+        doc_link = self.save_service.process_batch_save("LINE", context, entries, title or None)
+        return doc_link, len(entries)
+
+    def _collect_batch_item(self, ref: dict, title: str) -> Optional[dict]:
+        """文字類直接使用記錄內容；媒體下載後立即上傳並釋放緩衝 (不會同時佔住所有大型檔案通道)"""
+        if ref.get("text"):
+            return {"type": ref.get("type", "text"), "text": ref["text"]}
+        try:
+            with ExitStack() as stack:
+                content_type, buffer, _, mime = self._download_content(ref["id"], stack)
+                filename = ref.get("file_name") or f"auto_{ref['id']}{MIME_EXTENSION.get(mime, '')}"
+                media_title = f"{self.save_service.generate_title(title or None, content_type)}_{ref['id']}"
+                link = self.save_service.upload_media(media_title, content_type, buffer, filename)
+            return {"type": content_type, "link": link}
+        except Exception as e:
+            print(f"⚠️ [Batch] 略過無法儲存的訊息 {ref.get('id')}: {e}", flush=True)
+            return None
 
     def reply_message(self, token, msg):
         self.line_bot_api.reply_message(token, msg)
 
     def get_manual_quoted_id(self, msg_id):
-        return self._temp_quoted_ids.get(msg_id)
+        return self.state.get(f"quote:{msg_id}")
 
     def get_context_name(self, event: MessageEvent) -> str:
         source_type = event.source.type
@@ -46,8 +46,7 @@ class LineAutoSaveCommand(Command):
         else:
             new_state = not current_state
 
-        adapter.auto_save_settings[user_id] = new_state
-        adapter.save_auto_save_settings()
+        adapter.auto_save_settings.set(user_id, new_state)
         
         status_key = "auto_save_on" if new_state else "auto_save_off"
         status_msg = t(status_key)
@@ -56,6 +55,32 @@ class LineAutoSaveCommand(Command):
             TextSendMessage(text=t("auto_save_status", status=status_msg))
         )
 
+class LineJournalCommand(Command):
+    def match(self, text: str) -> bool:
+        return text.startswith('/journal')
+
+    def execute(self, context: CommandContext) -> None:
+        event = context.event
+        adapter = context.adapter
+        chat_id = adapter.chat_id(event)
+        current_state = adapter.journal_settings.get(chat_id, False)
+
+        parts = context.message_text.split()
+        cmd = parts[1].lower() if len(parts) > 1 else ''
+        if cmd == 'on':
+            new_state = True
+        elif cmd == 'off':
+            new_state = False
+        else:
+            new_state = not current_state
+
+        adapter.journal_settings.set(chat_id, new_state)
+        status_msg = t("auto_save_on" if new_state else "auto_save_off")
+        adapter.reply_message(
+            event.reply_token,
+            TextSendMessage(text=t("journal_status", status=status_msg))
+        )
+
 class LineSaveCommand(Command):
     def match(self, text: str) -> bool:
         return text.startswith('/save')
@@ -71,30 +96,18 @@ class LineSaveCommand(Command):
         chat_context = adapter.get_context_name(event)
         
         try:
-            # 偵測回覆 (Refactored logic to use adapter methods if needed, but logic is mostly inspecting event)
+            # 偵測回覆: quotedMessageId 已在解析 Payload 時掛到訊息物件上
             quoted_msg_id = getattr(event.message, 'quoted_message_id', None)
-            
-            # 嘗試從 Manual Extraction 找 (accessing protected member via public property or friend class assumption)
-            # In python protected is just convention. We'll access it directly or via accessor.
-            # Assuming adapter has `get_quoted_msg_id` or exposes `_temp_quoted_ids`
             if not quoted_msg_id:
+                # 事件由其他 worker 解析時，從共享狀態查詢
                 quoted_msg_id = adapter.get_manual_quoted_id(event.message.id)
-            
-            if not quoted_msg_id:
-                if hasattr(event.message, 'as_json_dict'):
-                    quoted_msg_id = event.message.as_json_dict().get('quotedMessageId')
-            
-            if not quoted_msg_id:
-                if hasattr(event, 'as_json_dict'):
-                    evt_dict = event.as_json_dict()
-                    quoted_msg_id = evt_dict.get('message', {}).get('quotedMessageId')
 
             if quoted_msg_id:
                 print(f"🎯 [Manual-Save] 偵測到回覆儲存 (Quoted ID: {quoted_msg_id})", flush=True)
                 adapter.handle_save_by_id(event, quoted_msg_id, user_title, chat_context)
             else:
                 # 處理當前訊息內容 (純文字)
-                doc_link = adapter.save_service.process_save(
+                doc_link = adapter.saver(event)(
                     platform="LINE",
                     context=chat_context,
                     content_type="text",
@@ -110,3 +123,38 @@ class LineSaveCommand(Command):
                 event.reply_token,
                 TextSendMessage(text=t("save_error"))
             )
+
+class LineBatchSaveCommand(Command):
+    """
+    /save_batch <N | id1,id2,...> [title]
+    Saves the last N messages of this chat (or the given message IDs) into one Doc.
+    """
+    # 小數字視為數量；LINE 訊息 ID 為長數字字串
+    MAX_COUNT_DIGITS = 4
+
+    def match(self, text: str) -> bool:
+        return text.startswith('/save_batch')
+
+    def execute(self, context: CommandContext) -> None:
+        event = context.event
+        adapter = context.adapter
+        parts = context.message_text.split(maxsplit=2)
+        if len(parts) < 2:
+            adapter.reply_message(event.reply_token, TextSendMessage(text=t("batch_save_usage")))
+            return
+
+        target = parts[1]
+        user_title = parts[2].strip() if len(parts) > 2 else ""
+        if target.isdigit() and len(target) <= self.MAX_COUNT_DIGITS:
+            refs = adapter.resolve_batch(event, count=int(target))
+        else:
+            msg_ids = [msg_id for msg_id in re.split(r'[,\s]+', target) if msg_id]
+            refs = adapter.resolve_batch(event, msg_ids=msg_ids)
+
+        if not refs:
+            adapter.reply_message(event.reply_token, TextSendMessage(text=t("batch_save_empty")))
+            return
+
+        print(f"📚 [Batch-Save] 批次儲存 {len(refs)} 則訊息", flush=True)
+        adapter.reply_message(event.reply_token, TextSendMessage(text=t("batch_save_processing", count=len(refs))))
+        adapter.handle_batch_save(event, refs, user_title, adapter.get_context_name(event))
@@ -0,0 +1,195 @@
+import os
+import json
+import time
+import tempfile
+import datetime
+import threading
+from typing import List, Optional
+from google.oauth2 import service_account
+from google.oauth2.credentials import Credentials
+from google.auth.transport.requests import Request
+from ..state.backend import StateBackend
+
+SHARED_TOKEN_KEY = "google_token"
+REFRESH_LOCK_KEY = "google_token_refresh"
+REFRESH_LOCK_TTL = 30
+
+def _utcnow() -> datetime.datetime:
+    # google-auth 使用 naive UTC datetime
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+def _parse_expiry(value: Optional[str]) -> Optional[datetime.datetime]:
+    if not value:
+        return None
+    return datetime.datetime.fromisoformat(value.rstrip("Z"))
+
+class CredentialManager:
+    """
+    Owns the Google credentials used by GDriveClient.
+
+    - Refreshes the access token in a background thread `refresh_margin`
+      seconds before it expires, so no save request pays for the round trip.
+    - Shares refreshed tokens with other workers through the state backend
+      (only one worker refreshes at a time) and picks up tokens they refreshed.
+    - Writes refreshed user tokens back to token.json atomically, so a restart
+      does not need to refresh again.
+    """
+    def __init__(self,
+                 scopes: List[str],
+                 token_path: str = 'token.json',
+                 service_account_path: str = 'credentials.json',
+                 state: Optional[StateBackend] = None,
+                 refresh_margin: float = 300):
+        self.scopes = scopes
+        self.token_path = token_path
+        self.service_account_path = service_account_path
+        self.state = state
+        self.refresh_margin = refresh_margin
+
+        self._creds = None
+        self._token_mtime: Optional[float] = None
+        self._lock = threading.RLock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def credentials(self):
+        # 載入後不再上鎖，使用者請求永遠不會等待背景刷新
+        if self._creds is None:
+            with self._lock:
+                if self._creds is None:
+                    self._creds = self._load()
+        return self._creds
+
+    def _load(self):
+        if os.path.exists(self.token_path):
+            self._token_mtime = os.path.getmtime(self.token_path)
+            creds = Credentials.from_authorized_user_file(self.token_path, self.scopes)
+        else:
+            creds = service_account.Credentials.from_service_account_file(
+                self.service_account_path,
+                scopes=self.scopes
+            )
+        self._adopt_shared_token(creds)
+        return creds
+
+    def seconds_until_refresh(self) -> float:
+        creds = self.credentials
+        if not creds.token or not creds.expiry:
+            return 0
+        return (creds.expiry - _utcnow()).total_seconds() - self.refresh_margin
+
+    def refresh_if_needed(self) -> bool:
+        """必要時刷新憑證；回傳是否由本 worker 執行了刷新"""
+        creds = self.credentials
+        with self._lock:
+            self._adopt_shared_token(creds)
+            if self.seconds_until_refresh() > 0:
+                return False
+            owner = f"{os.getpid()}:{threading.get_ident()}"
+            claimed = self._claim_refresh(owner)
+
+        if not claimed:
+            # 其他 worker 正在刷新，等待其結果；等待期間不持有 _lock
+            for _ in range(REFRESH_LOCK_TTL):
+                time.sleep(1)
+                with self._lock:
+                    self._adopt_shared_token(creds)
+                    if self.seconds_until_refresh() > 0:
+                        return False
+                    # 持有者若中途退出，刷新鎖會在 TTL 後過期，由本 worker 重新搶鎖
+                    claimed = self._claim_refresh(owner)
+                if claimed:
+                    break
+            else:
+                print(f"⚠️ [Auth] 等待其他 worker 刷新憑證逾時，稍後再試", flush=True)
+                return False
+
+        with self._lock:
+            try:
+                # 等待鎖的期間可能已由同一程序的其他執行緒刷新
+                if self.seconds_until_refresh() > 0:
+                    return False
+                creds.refresh(Request())
+                print(f"🔑 [Auth] 已刷新 Google 憑證 (到期: {creds.expiry})", flush=True)
+                self._publish(creds)
+            finally:
+                self._release_refresh(owner)
+            return True
+
+    def _claim_refresh(self, owner: str) -> bool:
+        return not self.state or self.state.set_if_absent(REFRESH_LOCK_KEY, owner, ttl=REFRESH_LOCK_TTL)
+
+    def _release_refresh(self, owner: str):
+        # 只釋放自己持有的鎖；刷新超過 TTL 時鎖可能已被其他 worker 取得
+        if self.state and self.state.get(REFRESH_LOCK_KEY) == owner:
+            self.state.delete(REFRESH_LOCK_KEY)
+
+    def _adopt_shared_token(self, creds):
+        """採用其他 worker 已刷新、且較晚到期的 Token"""
+        records = []
+        if self.state:
+            raw = self.state.get(SHARED_TOKEN_KEY)
+            if raw:
+                records.append(json.loads(raw))
+        if self.token_path and os.path.exists(self.token_path) and isinstance(creds, Credentials):
+            mtime = os.path.getmtime(self.token_path)
+            if self._token_mtime is None or mtime > self._token_mtime:
+                self._token_mtime = mtime
+                with open(self.token_path, 'r') as f:
+                    records.append(json.load(f))
+
+        for record in records:
+            expiry = _parse_expiry(record.get('expiry'))
+            if record.get('token') and expiry and (creds.expiry is None or expiry > creds.expiry):
+                creds.token = record['token']
+                creds.expiry = expiry
+
+    def _publish(self, creds):
+        if self.state and creds.expiry:
+            ttl = (creds.expiry - _utcnow()).total_seconds()
+            if ttl > 0:
+                self.state.set(SHARED_TOKEN_KEY, json.dumps({
+                    'token': creds.token,
+                    'expiry': creds.expiry.isoformat() + "Z"
+                }), ttl=ttl)
+        if isinstance(creds, Credentials) and self.token_path:
+            self._write_token_file(creds)
+
+    def _write_token_file(self, creds: Credentials):
+        directory = os.path.dirname(os.path.abspath(self.token_path))
+        fd, tmp_path = tempfile.mkstemp(prefix=".token_", suffix=".tmp", dir=directory)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(creds.to_json())
+            os.replace(tmp_path, self.token_path)
+            self._token_mtime = os.path.getmtime(self.token_path)
+        except Exception as e:
+            print(f"⚠️ [Auth] token.json 寫入失敗: {e}", flush=True)
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def start(self):
+        """啟動背景刷新執行緒"""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="credential-refresher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _run(self):
+        while True:
+            try:
+                self.refresh_if_needed()
+                wait = min(max(self.seconds_until_refresh(), 5), 600)
+            except Exception as e:
+                print(f"⚠️ [Auth] 背景刷新憑證失敗，稍後重試: {e}", flush=True)
+                wait = 30
+            if self._stop.wait(wait):
+                return
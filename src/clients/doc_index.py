@@ -0,0 +1,173 @@
+import time
+import threading
+from typing import Dict, Optional
+
+DOC_MIME_TYPE = 'application/vnd.google-apps.document'
+
+
+def escape_query_value(value: str) -> str:
+    """跳脫 Drive 查詢字串中的單引號與反斜線"""
+    return value.replace('\\', '\\\\').replace("'", "\\'")
+
+
+class DocIndex:
+    """
+    In-memory name -> doc ID index for the target Drive folder.
+
+    Seeded by one paged listing of the folder, updated on every doc the
+    client creates, and kept current through the Drive changes API
+    (polled from a saved start page token at most every `sync_interval`
+    seconds). A failed seed is likewise retried at most every
+    `sync_interval` seconds. Lookups are dict reads; misses fall back to
+    one escaped files().list query.
+    """
+    def __init__(self, gdrive, sync_interval: float = 30.0):
+        self.gdrive = gdrive
+        self.sync_interval = sync_interval
+
+        self._by_name: Dict[str, str] = {}
+        self._by_id: Dict[str, str] = {}
+        self._page_token: Optional[str] = None
+        self._last_sync = 0.0
+        # 上次建立索引失敗的時間；退避期間查詢直接走 files().list
+        self._seed_failed_at: Optional[float] = None
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+
+    @property
+    def seeded(self) -> bool:
+        return self._page_token is not None
+
+    def _folder_clause(self) -> str:
+        folder_id = self.gdrive.folder_id
+        return f" and '{escape_query_value(folder_id)}' in parents" if folder_id else ""
+
+    def add(self, name: str, doc_id: str):
+        with self._lock:
+            old_name = self._by_id.pop(doc_id, None)
+            if old_name is not None and self._by_name.get(old_name) == doc_id:
+                del self._by_name[old_name]
+            self._by_name[name] = doc_id
+            self._by_id[doc_id] = name
+
+    def remove(self, doc_id: str):
+        with self._lock:
+            name = self._by_id.pop(doc_id, None)
+            if name is not None and self._by_name.get(name) == doc_id:
+                del self._by_name[name]
+
+    def seed(self):
+        """一次分頁列出資料夾內所有文件；先取得 start page token，列出期間的變更之後仍會套用"""
+        # 與 sync 互斥；預熱與第一次查詢同時觸發時，後到者等待並沿用同一份索引
+        with self._sync_lock:
+            if self.seeded:
+                return
+            try:
+                self._seed()
+            except Exception:
+                self._seed_failed_at = time.monotonic()
+                raise
+            self._seed_failed_at = None
+
+    def _seed(self):
+        drive = self.gdrive.drive_service
+        with self.gdrive._lock:
+            token = drive.changes().getStartPageToken().execute().get('startPageToken')
+
+        query = f"mimeType = '{DOC_MIME_TYPE}' and trashed = false" + self._folder_clause()
+        by_name: Dict[str, str] = {}
+        page_token = None
+        while True:
+            with self.gdrive._lock:
+                results = drive.files().list(
+                    q=query,
+                    spaces='drive',
+                    fields='nextPageToken, files(id, name)',
+                    pageSize=1000,
+                    pageToken=page_token
+                ).execute()
+            for f in results.get('files', []):
+                by_name.setdefault(f['name'], f['id'])
+            page_token = results.get('nextPageToken')
+            if not page_token:
+                break
+
+        with self._lock:
+            self._by_name = by_name
+            self._by_id = {doc_id: name for name, doc_id in by_name.items()}
+            self._page_token = token
+            self._last_sync = time.monotonic()
+        print(f"🗂️ [GDrive] 文件索引已建立 ({len(by_name)} 份)", flush=True)
+
+    def sync(self, force: bool = False):
+        """套用自上次 page token 以來的變更 (新增、改名、刪除、移出資料夾)"""
+        if not self.seeded:
+            failed_at = self._seed_failed_at
+            if failed_at is not None and time.monotonic() - failed_at < self.sync_interval:
+                return
+            self.seed()
+            return
+        if not force and time.monotonic() - self._last_sync < self.sync_interval:
+            return
+        # 其他執行緒正在同步時直接使用目前的索引
+        if not self._sync_lock.acquire(blocking=False):
+            return
+        try:
+            drive = self.gdrive.drive_service
+            token = self._page_token
+            while token:
+                with self.gdrive._lock:
+                    results = drive.changes().list(
+                        pageToken=token,
+                        spaces='drive',
+                        fields='nextPageToken, newStartPageToken, changes(fileId, removed, file(name, mimeType, trashed, parents))',
+                        pageSize=1000
+                    ).execute()
+                for change in results.get('changes', []):
+                    self._apply_change(change)
+                if results.get('newStartPageToken'):
+                    self._page_token = results['newStartPageToken']
+                token = results.get('nextPageToken')
+            self._last_sync = time.monotonic()
+        finally:
+            self._sync_lock.release()
+
+    def _apply_change(self, change: dict):
+        doc_id = change.get('fileId')
+        f = change.get('file') or {}
+        folder_id = self.gdrive.folder_id
+        in_folder = not folder_id or folder_id in (f.get('parents') or [])
+        if change.get('removed') or f.get('trashed') or f.get('mimeType') != DOC_MIME_TYPE or not in_folder:
+            self.remove(doc_id)
+        else:
+            self.add(f.get('name', ''), doc_id)
+
+    def lookup(self, name: str) -> Optional[str]:
+        try:
+            self.sync()
+        except Exception as e:
+            # 同步失敗時仍可使用現有索引與查詢
+            print(f"⚠️ [GDrive] 文件索引同步失敗: {e}", flush=True)
+
+        doc_id = self._by_name.get(name)
+        if doc_id:
+            return doc_id
+        return self._query(name)
+
+    def _query(self, name: str) -> Optional[str]:
+        query = (
+            f"name = '{escape_query_value(name)}' and mimeType = '{DOC_MIME_TYPE}' and trashed = false"
+            + self._folder_clause()
+        )
+        with self.gdrive._lock:
+            results = self.gdrive.drive_service.files().list(
+                q=query,
+                spaces='drive',
+                fields='files(id, name)'
+            ).execute()
+        files = results.get('files', [])
+        if not files:
+            return None
+        doc_id = str(files[0].get('id'))
+        self.add(name, doc_id)
+        return doc_id
@@ -1,44 +1,146 @@
 import os
+import re
 import json
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
+from googleapiclient.discovery import build, build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+from googleapiclient.errors import HttpError
 from googleapiclient.http import MediaInMemoryUpload, MediaIoBaseUpload
 import io
+import time
 import datetime
-from typing import Optional, List, Any
+import threading
+from tqdm import tqdm
+from typing import Optional, List, Any, Union, IO
+from .credentials_manager import CredentialManager
+from .doc_index import DocIndex
+from .http_transport import TransportFactory
+from ..workers.adaptive_limit import AdaptiveLimit, ObservedLock
+
+PUBLIC_IMAGE_URL = "https://drive.google.com/uc?export=view&id={}"
+# Drive 中「知道連結的任何人」權限的固定 ID
+ANYONE_PERMISSION_ID = "anyoneWithLink"
 
 class GDriveClient:
-    def __init__(self):
+    def __init__(self,
+                 credential_manager: Optional[CredentialManager] = None,
+                 limiter: Optional[AdaptiveLimit] = None,
+                 transport: Optional[TransportFactory] = None):
         self.creds_path = os.getenv('GOOGLE_APPLICATION_CREDENTIALS', 'credentials.json')
         self.folder_id = os.getenv('TARGET_DRIVE_FOLDER_ID')
         self.scopes = ['https://www.googleapis.com/auth/drive']
+        self.discovery_cache_dir = os.getenv('DISCOVERY_CACHE_DIR', '.discovery_cache')
+
+        # 憑證由 CredentialManager 管理 (背景刷新、跨 worker 共用)，首次使用時才讀檔
+        self.credential_manager = credential_manager or CredentialManager(
+            self.scopes,
+            service_account_path=self.creds_path
+        )
+
+        # 服務延遲到第一次使用 (或 warm_up) 時才建立，避免啟動時連網
+        self._drive_service = None
+        self._docs_service = None
+        self._init_lock = threading.RLock()
         
-        if os.path.exists('token.json'):
-            from google.oauth2.credentials import Credentials
-            self.creds = Credentials.from_authorized_user_file('token.json', self.scopes)
-        else:
-            self.creds = service_account.Credentials.from_service_account_file(
-                self.creds_path, 
-                scopes=self.scopes
-            )
-        
-        # 建立服務
-        self.drive_service = build('drive', 'v3', credentials=self.creds, cache_discovery=False)
-        self.docs_service = build('docs', 'v1', credentials=self.creds, cache_discovery=False)
-        
+        # HTTP 傳輸層 (預設 httplib2；GDRIVE_TRANSPORT=http2 改用 httpx 連線池多工)
+        self.transport = transport or TransportFactory.from_env()
+
         # Thread lock for API calls to prevent SSL race conditions
-        import threading
-        self._lock = threading.Lock()
+        # (每次持有即一次 API 呼叫，延遲與錯誤回報給並行上限控制器；執行緒安全的傳輸層只計時不互斥)
+        self._lock = ObservedLock(limiter, "gdrive", exclusive=not self.transport.thread_safe)
+
+        # 文件名稱 -> ID 索引 (取代每次 get_doc_by_name 的 files().list 查詢)
+        self.doc_index = DocIndex(self, sync_interval=float(os.getenv("DOC_INDEX_SYNC_INTERVAL", 30)))
+
+    @property
+    def creds(self):
+        return self.credential_manager.credentials
+
+    @property
+    def drive_service(self):
+        if self._drive_service is None:
+            with self._init_lock:
+                if self._drive_service is None:
+                    self._drive_service = self._build_service('drive', 'v3')
+        return self._drive_service
+
+    @property
+    def docs_service(self):
+        if self._docs_service is None:
+            with self._init_lock:
+                if self._docs_service is None:
+                    self._docs_service = self._build_service('docs', 'v1')
+        return self._docs_service
+
+    def _build_service(self, api: str, version: str):
+        """使用本地快取 / 套件內建的 Discovery 文件建立服務，不需每次啟動都連網抓取"""
+        doc = self._load_discovery_doc(api, version)
+        # 自訂傳輸層時傳入已授權的 http 物件 (不可與 credentials 同時指定)。
+        # 傳輸層與 API 鎖的互斥模式在 __init__ 就已決定 (缺少選用套件時 TransportFactory
+        # 建立時即退回 httplib2)；之後建立失敗直接拋出，不在使用中的 client 上切換鎖的模式
+        http = self.transport.authorized_http(self.creds)
+        auth = {'http': http} if http is not None else {'credentials': self.creds}
+        if doc:
+            return build_from_document(doc, **auth)
+
+        # 最後手段: 從網路取得 Discovery 文件並寫入快取供下次使用
+        service = build(api, version, cache_discovery=False, static_discovery=False, **auth)
+        self._write_discovery_cache(api, version, getattr(service, '_rootDesc', None))
+        return service
+
+    def _discovery_cache_path(self, api: str, version: str) -> str:
+        return os.path.join(self.discovery_cache_dir, f"{api}.{version}.json")
+
+    def _load_discovery_doc(self, api: str, version: str) -> Optional[str]:
+        path = self._discovery_cache_path(api, version)
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                return f.read()
+        return get_static_doc(api, version)
 
-    def upload_file(self, content: bytes, filename: str, mime_type: str) -> str:
-        from tqdm import tqdm
+    def _write_discovery_cache(self, api: str, version: str, root_desc: Optional[dict]):
+        if not root_desc:
+            return
+        try:
+            os.makedirs(self.discovery_cache_dir, exist_ok=True)
+            path = self._discovery_cache_path(api, version)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(root_desc, f)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            print(f"⚠️ [GDrive] Discovery 快取寫入失敗: {e}", flush=True)
+
+    def warm_up(self):
+        """
+        Startup warm-up: builds both services, refreshes the OAuth token
+        and opens the Drive connection so the first save does not pay for it.
+        """
+        start = time.perf_counter()
+        drive = self.drive_service
+        _ = self.docs_service
+        # 先啟動背景刷新：即使這次刷新失敗 (離線、Google 暫時性錯誤)，
+        # 之後仍由背景執行緒重試，存檔請求不必在 API 鎖內同步刷新
+        self.credential_manager.start()
+        self.credential_manager.refresh_if_needed()
+        with self._lock:
+            drive.about().get(fields='user').execute()
+        self.doc_index.sync()
+        print(f"🔥 [GDrive] 預熱完成 ({time.perf_counter() - start:.2f}s)", flush=True)
+
+    def upload_file(self, content: Union[bytes, IO[bytes]], filename: str, mime_type: str) -> str:
+        """上傳檔案；content 可為 bytes 或可 seek 的檔案物件 (記憶體或磁碟暫存)"""
         file_metadata = {
             'name': filename,
             'parents': [self.folder_id] if self.folder_id else []
         }
         
-        file_size = len(content)
-        fh = io.BytesIO(content)
+        if isinstance(content, (bytes, bytearray)):
+            fh = io.BytesIO(content)
+        else:
+            fh = content
+        fh.seek(0, io.SEEK_END)
+        file_size = fh.tell()
+        fh.seek(0)
         # 設定明確的 chunksize (1MB) 提高在大檔案上的穩定性
         media = MediaIoBaseUpload(fh, mimetype=mime_type, chunksize=1024*1024, resumable=True)
         
@@ -55,7 +157,7 @@ class GDriveClient:
         try:
             while response is None:
                 # 這裡可能發生 SSL 錯誤，加入重試機制
-                with self._lock:
+                with self._lock("gdrive-upload"):
                     status, response = request.next_chunk()
                 if status:
                     pbar.n = int(status.resumable_progress)
@@ -71,39 +173,103 @@ class GDriveClient:
             print(f"❌ [GDrive] 上傳失敗: {e}", flush=True)
             raise e
 
-    def create_doc(self, title: str, content_items: list, html_content: Optional[str] = None) -> str:
+    def upload_public_image(self, content: bytes, filename: str, mime_type: str) -> str:
+        """
+        上傳圖片並暫時開放連結讀取，回傳可供 Docs insertInlineImage 使用的網址。
+        create_doc 插入圖片後會收回公開權限 (Docs 已保存圖片副本)。
+        """
+        file_metadata = {
+            'name': filename,
+            'parents': [self.folder_id] if self.folder_id else []
+        }
+        media = MediaIoBaseUpload(io.BytesIO(content), mimetype=mime_type, resumable=False)
+        with self._lock("gdrive-upload"):
+            file = self.drive_service.files().create(
+                body=file_metadata,
+                media_body=media,
+                fields='id'
+            ).execute()
+        return self.publish_image(PUBLIC_IMAGE_URL.format(file['id']))
+
+    def publish_image(self, uri: str) -> str:
+        """(重新) 開放已轉存圖片的連結讀取，例如快取命中、權限已被收回時"""
+        file_id = self._image_file_id(uri)
+        with self._lock("gdrive-upload"):
+            self.drive_service.permissions().create(
+                fileId=file_id,
+                body={'type': 'anyone', 'role': 'reader'},
+                fields='id'
+            ).execute()
+        return uri
+
+    def _image_file_id(self, uri: str) -> Optional[str]:
+        """upload_public_image 產生的網址 -> Drive 檔案 ID；其他網址回傳 None"""
+        prefix = PUBLIC_IMAGE_URL.format("")
+        return uri[len(prefix):] if uri and uri.startswith(prefix) else None
+
+    def _revoke_public_images(self, uris: List[str]):
+        """收回插入後不再需要的公開權限；失敗只記錄，不影響文件建立"""
+        for uri in dict.fromkeys(uris):
+            file_id = self._image_file_id(uri)
+            if not file_id:
+                continue
+            try:
+                with self._lock:
+                    self.drive_service.permissions().delete(
+                        fileId=file_id,
+                        permissionId=ANYONE_PERMISSION_ID
+                    ).execute()
+            except HttpError as e:
+                print(f"⚠️ [GDrive] 收回圖片公開權限失敗 ({file_id}): {e}", flush=True)
+
+    def _failed_image_request(self, error: HttpError, requests: list) -> Optional[List[int]]:
+        """
+        從 batchUpdate 錯誤找出無法讀取的圖片 (錯誤訊息形如 "Invalid requests[3].insertInlineImage")。
+        回傳要移除的請求索引；無法判斷是哪一張時移除全部圖片，沒有圖片則回傳 None。
+        """
+        images = [i for i, r in enumerate(requests) if 'insertInlineImage' in r]
+        if not images:
+            return None
+        match = re.search(r"requests\[(\d+)\]\.insertInlineImage", str(error))
+        if match and int(match.group(1)) in images:
+            return [int(match.group(1))]
+        return images
+
+    def create_doc(self, title: str, content_items: list, html_content: Optional[Union[str, IO[bytes]]] = None) -> str:
         """
         Create a new Google Doc with mixed content.
-        If html_content is provided, it creates the doc from that HTML (converted),
+        If html_content is provided (a string or a binary stream), it creates the doc
+        from that HTML (converted) with a chunked resumable upload,
         and then prepends the content_items.
         """
+        file_metadata = {
+            'name': title,
+            'mimeType': 'application/vnd.google-apps.document',
+            'parents': [self.folder_id] if self.folder_id else []
+        }
         # Create a new Google Doc
-        with self._lock:
-            if html_content:
-                file_metadata = {
-                    'name': title,
-                    'mimeType': 'application/vnd.google-apps.document',
-                    'parents': [self.folder_id] if self.folder_id else []
-                }
-                fh = io.BytesIO(html_content.encode('utf-8'))
-                media = MediaIoBaseUpload(fh, mimetype='text/html', resumable=True)
-                
+        if html_content:
+            fh = io.BytesIO(html_content.encode('utf-8')) if isinstance(html_content, str) else html_content
+            media = MediaIoBaseUpload(fh, mimetype='text/html', chunksize=1024*1024, resumable=True)
+            request = self.drive_service.files().create(
+                body=file_metadata,
+                media_body=media,
+                fields='id'
+            )
+            doc = None
+            while doc is None:
+                # 每個 chunk 個別持有鎖，讓其他上傳可以交錯進行
+                with self._lock("gdrive-upload"):
+                    _, doc = request.next_chunk()
+        else:
+            with self._lock:
                 doc = self.drive_service.files().create(
                     body=file_metadata,
-                    media_body=media,
-                    fields='id'
-                ).execute()
-            else:
-                doc = self.drive_service.files().create(
-                    body={
-                        'name': title,
-                        'mimeType': 'application/vnd.google-apps.document',
-                        'parents': [self.folder_id] if self.folder_id else []
-                    },
                     fields='id'
                 ).execute()
         
         doc_id = doc.get('id')
+        self.doc_index.add(title, doc_id)
         
         requests = []
         # We process items in reverse order to insert at index 1 effectively, keeping the order correct in the doc.
@@ -227,18 +393,47 @@ class GDriveClient:
                             }
                         })
 
-        if requests:
-            with self._lock:
-                self.docs_service.documents().batchUpdate(
-                    documentId=doc_id,
-                    body={'requests': requests}
-                ).execute()
+        image_uris = [r['insertInlineImage']['uri'] for r in requests if 'insertInlineImage' in r]
+        try:
+            while requests:
+                try:
+                    with self._lock("gdocs"):
+                        self.docs_service.documents().batchUpdate(
+                            documentId=doc_id,
+                            body={'requests': requests}
+                        ).execute()
+                    break
+                except HttpError as e:
+                    # 一張圖片無法讀取會讓整個 batchUpdate 失敗；只移除該張圖片後重試，保住其他內容
+                    failed = self._failed_image_request(e, requests)
+                    if failed is None:
+                        raise
+                    print(f"⚠️ [GDrive] 插入圖片失敗，略過 {len(failed)} 張後重試: {e}", flush=True)
+                    requests = [r for i, r in enumerate(requests) if i not in failed]
+        finally:
+            # Docs 插入時已複製圖片，來源檔不必再公開
+            self._revoke_public_images(image_uris)
         
         # Get the link
         with self._lock:
             file = self.drive_service.files().get(fileId=doc_id, fields='webViewLink').execute()
         return file.get('webViewLink')
 
+    def create_blank_doc(self, title: str) -> dict:
+        """建立空白 Google Doc，回傳 {'id', 'webViewLink'}"""
+        file_metadata = {
+            'name': title,
+            'mimeType': 'application/vnd.google-apps.document',
+            'parents': [self.folder_id] if self.folder_id else []
+        }
+        with self._lock:
+            doc = self.drive_service.files().create(
+                body=file_metadata,
+                fields='id, webViewLink'
+            ).execute()
+        self.doc_index.add(title, doc['id'])
+        return doc
+
     def append_to_doc(self, doc_id: str, content_blocks: list):
         full_text = "\n" + "\n".join(content_blocks)
         requests = [{
@@ -247,23 +442,12 @@ class GDriveClient:
                 'text': full_text
             }
         }]
-        with self._lock:
+        with self._lock("gdocs"):
             self.docs_service.documents().batchUpdate(
                 documentId=doc_id,
                 body={'requests': requests}
             ).execute()
 
     def get_doc_by_name(self, name: str) -> Optional[str]:
-        query = f"name = '{name}' and mimeType = 'application/vnd.google-apps.document' and trashed = false"
-        if self.folder_id:
-            query += f" and '{self.folder_id}' in parents"
-        
-        results = self.drive_service.files().list(
-            q=query,
-            spaces='drive',
-            fields='files(id, name)'
-        ).execute()
-        
-        files = results.get('files', [])
-        return str(files[0].get('id')) if files else None
-
+        """以名稱查詢資料夾內的 Google Doc (記憶體索引，未命中時才查詢 Drive)"""
+        return self.doc_index.lookup(name)
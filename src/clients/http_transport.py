@@ -0,0 +1,128 @@
+import os
+import socket
+import importlib.util
+import threading
+from typing import Optional
+
+import httplib2
+
+# 由 httpx 自動解壓縮，與 httplib2 相同改名以免呼叫端重複處理
+_DECODED_HEADERS = ("content-encoding",)
+
+
+class HttpxHttp:
+    """
+    httplib2.Http-compatible transport over a pooled httpx client.
+
+    googleapiclient only calls `request()` and reads `(response, content)`,
+    so this can sit behind build_from_document(http=AuthorizedHttp(...)).
+    With http2=True, concurrent Drive uploads and Docs batchUpdates are
+    multiplexed over a few connections, and unlike httplib2.Http the client
+    is safe to share across threads. Redirects are not followed, so the
+    308 of resumable uploads reaches googleapiclient as it expects.
+    """
+    thread_safe = True
+
+    def __init__(self, http2: bool = True, max_connections: int = 10, timeout: Optional[float] = 60.0, client=None):
+        try:
+            import httpx
+        except ImportError:
+            raise RuntimeError("GDRIVE_TRANSPORT=http2 需要安裝 httpx (pip install 'httpx[http2]')")
+        self._httpx = httpx
+        self.http2 = http2
+        self.timeout = timeout
+        # AuthorizedHttp 會讀寫這些 httplib2 屬性
+        self.connections = {}
+        self.redirect_codes = frozenset()
+        self.follow_redirects = False
+        self.client = client or httpx.Client(
+            http2=http2,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            timeout=timeout,
+            follow_redirects=False
+        )
+
+    def request(self, uri, method="GET", body=None, headers=None, redirections=None, connection_type=None, **kwargs):
+        if hasattr(body, "read"):
+            body = body.read()
+        httpx = self._httpx
+        try:
+            resp = self.client.request(method, uri, content=body, headers=headers, timeout=self.timeout)
+        except httpx.TimeoutException as e:
+            # 轉成 googleapiclient 的重試邏輯認得的例外
+            raise socket.timeout(str(e)) from e
+        except httpx.TransportError as e:
+            raise ConnectionError(str(e)) from e
+
+        info = {}
+        for key, value in resp.headers.multi_items():
+            key = key.lower()
+            if key in _DECODED_HEADERS:
+                key = "-" + key
+            info[key] = f"{info[key]}, {value}" if key in info else value
+        info["status"] = str(resp.status_code)
+        response = httplib2.Response(info)
+        response.reason = resp.reason_phrase
+        response.version = 20 if resp.http_version == "HTTP/2" else 11
+        return response, resp.content
+
+    def close(self):
+        self.client.close()
+
+
+class TransportFactory:
+    """
+    Builds the `http` object behind drive_service / docs_service.
+
+    GDRIVE_TRANSPORT=httplib2 (default) keeps googleapiclient's own
+    transport; GDRIVE_TRANSPORT=http2 (or http1, pooled HTTP/1.1 over
+    httpx) shares one HttpxHttp pool between both services.
+    """
+    def __init__(self, kind: str = "httplib2", max_connections: int = 10, timeout: float = 60.0):
+        self.kind = self._available(kind)
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self._shared: Optional[HttpxHttp] = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "TransportFactory":
+        return cls(
+            kind=os.getenv("GDRIVE_TRANSPORT", "httplib2").lower(),
+            max_connections=int(os.getenv("GDRIVE_MAX_CONNECTIONS", 10)),
+            timeout=float(os.getenv("GDRIVE_HTTP_TIMEOUT", 60))
+        )
+
+    @staticmethod
+    def _available(kind: str) -> str:
+        """缺少選用套件時退回可用的傳輸層 (並行與否在建立 GDriveClient 時即決定，不能等到第一次呼叫)"""
+        if kind not in ("http2", "http1"):
+            return kind
+        if importlib.util.find_spec("httpx") is None:
+            print(f"⚠️ [GDrive] GDRIVE_TRANSPORT={kind} 需要 httpx (pip install -r requirements-optional.txt)，改用 httplib2", flush=True)
+            return "httplib2"
+        if kind == "http2" and importlib.util.find_spec("h2") is None:
+            print("⚠️ [GDrive] 未安裝 h2 (pip install 'httpx[http2]')，改用 HTTP/1.1 連線池", flush=True)
+            return "http1"
+        return kind
+
+    @property
+    def thread_safe(self) -> bool:
+        """是否可不經 API 鎖並行呼叫 (httplib2.Http 非執行緒安全)"""
+        return self.kind in ("http2", "http1")
+
+    def authorized_http(self, credentials):
+        """回傳已授權的 http 物件；httplib2 模式回傳 None 交由 googleapiclient 自行建立"""
+        if not self.thread_safe:
+            return None
+        import google_auth_httplib2
+        with self._lock:
+            if self._shared is None:
+                self._shared = HttpxHttp(http2=self.kind == "http2", max_connections=self.max_connections, timeout=self.timeout)
+        return google_auth_httplib2.AuthorizedHttp(credentials, http=self._shared)
+
+    def close(self):
+        with self._lock:
+            shared, self._shared = self._shared, None
+        if shared is not None:
+            shared.close()
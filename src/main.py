@@ -1,21 +1,25 @@
 import os
-from fastapi import FastAPI, Request, Header, HTTPException
-from dotenv import load_dotenv
+import time
+import threading
+from typing import Optional
+from fastapi import FastAPI, Request, Header, HTTPException, Depends
+from fastapi.responses import PlainTextResponse
+from fastapi.concurrency import run_in_threadpool
 
-# Load environment variables
-load_dotenv()
+def load_environment():
+    """讀取 .env 並排除系統代理 (在任何重量級子系統載入前呼叫)"""
+    from dotenv import load_dotenv
 
-# 強專禁用系統代理設定，避免 Windows 環境下的 [SSL: WRONG_VERSION_NUMBER] 錯誤
-os.environ.pop('HTTP_PROXY', None)
-os.environ.pop('HTTPS_PROXY', None)
-os.environ.pop('http_proxy', None)
-os.environ.pop('https_proxy', None)
+    # Load environment variables
+    load_dotenv()
 
-print(f"🛠️ [Init] 環境變數已讀取，已排除系統代理干擾，當前目錄: {os.getcwd()}", flush=True)
+    # 強專禁用系統代理設定，避免 Windows 環境下的 [SSL: WRONG_VERSION_NUMBER] 錯誤
+    os.environ.pop('HTTP_PROXY', None)
+    os.environ.pop('HTTPS_PROXY', None)
+    os.environ.pop('http_proxy', None)
+    os.environ.pop('https_proxy', None)
 
-from .adapters.line_adapter import LineAdapter
-from .services.save_service import SaveService
-from .clients.gdrive_client import GDriveClient
+    print(f"🛠️ [Init] 環境變數已讀取，已排除系統代理干擾，當前目錄: {os.getcwd()}", flush=True)
 
 def setup_ngrok():
     """啟動 ngrok 並自動更新 LINE Webhook (僅用於本地開發)"""
@@ -51,40 +55,263 @@ def setup_ngrok():
         print(f"⚠️ [Dev] 自動啟動 ngrok 或更新 Webhook 失敗: {e}", flush=True)
         print("💡 提示：您可以手動在 LINE Developers Console 設定 Webhook。", flush=True)
 
-app = FastAPI()
-
-@app.on_event("startup")
-async def startup_event():
-    # 在啟動時嘗試啟動隧道 (僅用於本地開發)
-    setup_ngrok()
-
-# Initialize components
-gdrive_client = GDriveClient()
-save_service = SaveService(gdrive_client)
-line_adapter = LineAdapter(save_service)
-
-@app.post("/webhook/line")
-async def line_webhook(request: Request, x_line_signature: str = Header(None)):
-    body = await request.body()
-    body_decoded = body.decode('utf-8')
-    print(f"📩 收到 Webhook 請求! Signature: {x_line_signature}", flush=True)
-    print(f"🔍 [Debug Raw Body]: {body_decoded}", flush=True)
-    
-    if not x_line_signature:
-        print("⚠️ 錯誤：找不到 X-Line-Signature Header", flush=True)
-    
-    try:
-        line_adapter.handle_request(body_decoded, x_line_signature)
-        print("✅ 請求處理完成", flush=True)
-    except Exception as e:
-        print(f"❌ 處理 Webhook 時發生錯誤: {e}", flush=True)
-        raise HTTPException(status_code=500, detail="Internal Server Error")
-    
-    return {"status": "ok"}
-
-@app.get("/")
-def health_check():
-    return {"status": "active", "service": "Chat-to-Google-Drive Save Bot"}
+class BotRuntime:
+    """
+    Lazily constructed subsystems (state backend, Google clients, LINE adapter).
+    Nothing heavy is imported or built until first use, so importing
+    `src.main` stays cheap for scale-to-zero cold starts.
+    """
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._state_backend = None
+        self._limiter = None
+        self._limiter_built = False
+        self._gdrive_client = None
+        self._save_service = None
+        self._line_adapter = None
+
+    @property
+    def state_backend(self):
+        with self._lock:
+            if self._state_backend is None:
+                from .state.backend import create_state_backend
+                self._state_backend = create_state_backend()
+            return self._state_backend
+
+    @property
+    def limiter(self):
+        """Google 與 LINE 共用的並行上限控制器 (ADAPTIVE_CONCURRENCY=false 時為 None)"""
+        with self._lock:
+            if not self._limiter_built:
+                from .workers.adaptive_limit import AdaptiveLimit
+                self._limiter = AdaptiveLimit.from_env(int(os.getenv("BACKUP_WORKERS", 10)))
+                self._limiter_built = True
+            return self._limiter
+
+    @property
+    def gdrive_client(self):
+        with self._lock:
+            if self._gdrive_client is None:
+                from .clients.gdrive_client import GDriveClient
+                from .clients.credentials_manager import CredentialManager
+                credential_manager = CredentialManager(
+                    ['https://www.googleapis.com/auth/drive'],
+                    service_account_path=os.getenv('GOOGLE_APPLICATION_CREDENTIALS', 'credentials.json'),
+                    state=self.state_backend
+                )
+                self._gdrive_client = GDriveClient(credential_manager, limiter=self.limiter)
+            return self._gdrive_client
+
+    @property
+    def save_service(self):
+        with self._lock:
+            if self._save_service is None:
+                from .services.save_service import SaveService
+                from .services.image_stage import ImageStage
+                from .services.journal import DailyJournal
+                from .services.link_health import LinkHealth
+                image_stage = ImageStage(self.gdrive_client, self.state_backend)
+                journal = DailyJournal(
+                    self.gdrive_client,
+                    self.state_backend,
+                    flush_interval=float(os.getenv("JOURNAL_FLUSH_INTERVAL", 5))
+                )
+                journal.start()
+                self._save_service = SaveService(
+                    self.gdrive_client, image_stage, journal,
+                    link_health=LinkHealth.from_env(self.state_backend)
+                )
+            return self._save_service
+
+    @property
+    def line_adapter(self):
+        with self._lock:
+            if self._line_adapter is None:
+                from .adapters.line_adapter import LineAdapter
+                self._line_adapter = LineAdapter(self.save_service, self.state_backend, limiter=self.limiter)
+                self._line_adapter.start()
+            return self._line_adapter
+
+    def warm_up(self):
+        """在背景建立所有子系統並預熱 Google API"""
+        try:
+            _ = self.line_adapter
+            self.gdrive_client.warm_up()
+        except Exception as e:
+            print(f"⚠️ [Init] 預熱失敗，將於第一次使用時再建立: {e}", flush=True)
+
+    def metrics(self) -> dict:
+        """目前的並行上限與排程狀態 (不會為此建立尚未啟動的子系統)"""
+        metrics = {"concurrency_limit": None, "scheduler": None}
+        if self._limiter is not None:
+            metrics["concurrency_limit"] = self._limiter.snapshot()
+        if self._line_adapter is not None:
+            metrics["scheduler"] = self._line_adapter.scheduler.stats()
+            metrics["queue_count"] = self._line_adapter.queue_count
+        return metrics
+
+    def shutdown(self):
+        if self._line_adapter is not None:
+            self._line_adapter.shutdown()
+        if self._save_service is not None:
+            self._save_service.journal.close()
+            self._save_service.html_parser.shutdown()
+            self._save_service.image_stage.shutdown()
+        if self._gdrive_client is not None:
+            self._gdrive_client.credential_manager.stop()
+            self._gdrive_client.transport.close()
+
+def register_debug_routes(app: FastAPI):
+    """
+    Admin-only diagnostics under /debug. Disabled (404) unless
+    DEBUG_ADMIN_TOKEN is set; requests must send it as a Bearer token.
+    Nothing runs until an endpoint is called: the profiler samples only
+    for the requested seconds and tracemalloc stays off until started.
+    """
+    import hmac
+    from .services.diagnostics import SamplingProfiler, MemoryTracer
+
+    profiler = SamplingProfiler(max_seconds=float(os.getenv("DEBUG_PROFILE_MAX_SECONDS", 60)))
+    tracer = MemoryTracer()
+
+    def require_admin(authorization: str = Header(None)):
+        token = os.getenv("DEBUG_ADMIN_TOKEN")
+        if not token:
+            raise HTTPException(status_code=404, detail="Not Found")
+        scheme, _, supplied = (authorization or "").partition(" ")
+        if scheme.lower() != "bearer" or not hmac.compare_digest(supplied.encode(), token.encode()):
+            raise HTTPException(status_code=401, detail="Unauthorized")
+
+    admin = [Depends(require_admin)]
+
+    @app.get("/debug/profile", dependencies=admin, response_class=PlainTextResponse)
+    def debug_profile(seconds: float = 5.0, interval: float = 0.01, idle: bool = False):
+        """取樣所有執行緒 N 秒，回傳 flamegraph 用的 collapsed stacks"""
+        try:
+            result = profiler.profile(seconds, interval, include_idle=idle)
+        except RuntimeError as e:
+            raise HTTPException(status_code=409, detail=str(e))
+        print(f"🔬 [Debug] 取樣完成: {result['samples']} 次 / {result['seconds']} s", flush=True)
+        return PlainTextResponse(
+            SamplingProfiler.collapsed(result["stacks"]),
+            headers={"X-Profile-Samples": str(result["samples"]), "X-Profile-Seconds": str(result["seconds"])}
+        )
+
+    @app.post("/debug/tracemalloc/start", dependencies=admin)
+    def debug_tracemalloc_start(frames: int = 25):
+        return tracer.start(frames)
+
+    @app.post("/debug/tracemalloc/stop", dependencies=admin)
+    def debug_tracemalloc_stop():
+        return tracer.stop()
+
+    @app.post("/debug/tracemalloc/snapshot", dependencies=admin)
+    def debug_tracemalloc_snapshot(name: Optional[str] = None, key: str = "lineno", limit: int = 20, match: Optional[str] = None):
+        """拍攝快照並回傳佔用最多的位置；match 例如 */src/* 只看專案程式碼"""
+        try:
+            name = tracer.snapshot(name)
+            return {"snapshot": name, "status": tracer.status(), "top": tracer.top(name, key, limit, match)}
+        except RuntimeError as e:
+            raise HTTPException(status_code=409, detail=str(e))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    @app.get("/debug/tracemalloc/diff", dependencies=admin)
+    def debug_tracemalloc_diff(base: str, target: Optional[str] = None, key: str = "lineno", limit: int = 20, match: Optional[str] = None):
+        """比較兩個快照 (未指定 target 時現在拍攝一個)，依增加量排序"""
+        try:
+            target = target or tracer.snapshot()
+            return {"base": base, "target": target, "diff": tracer.diff(base, target, key, limit, match)}
+        except RuntimeError as e:
+            raise HTTPException(status_code=409, detail=str(e))
+        except KeyError as e:
+            raise HTTPException(status_code=404, detail=f"找不到快照 {e}")
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+def create_app(runtime: Optional[BotRuntime] = None) -> FastAPI:
+    """App factory: 只註冊路由，子系統由 BotRuntime 延遲建立"""
+    load_environment()
+    runtime = runtime or BotRuntime()
+    app = FastAPI()
+    app.state.runtime = runtime
+
+    @app.on_event("startup")
+    async def startup_event():
+        # 在啟動時嘗試啟動隧道 (僅用於本地開發)
+        setup_ngrok()
+        # 背景預熱 (不阻塞啟動；離線時只記錄警告)
+        threading.Thread(target=runtime.warm_up, name="runtime-warm-up", daemon=True).start()
+
+    @app.on_event("shutdown")
+    async def shutdown_event():
+        runtime.shutdown()
+        if recorder:
+            recorder.close()
+
+    # WEBHOOK_ASYNC=true: 驗證簽章後排入佇列立即回應，由背景消費者處理
+    async_webhook = os.getenv("WEBHOOK_ASYNC", "true").lower() == "true"
+    ack_budget_ms = float(os.getenv("WEBHOOK_ACK_BUDGET_MS", 200))
+
+    # WEBHOOK_RECORD_PATH: 錄製通過驗證的 Webhook (去識別化) 供 scripts/replay_webhooks.py 重播壓測
+    from .services.webhook_recorder import WebhookRecorder
+    recorder = WebhookRecorder.from_env()
+    app.state.recorder = recorder
+
+    @app.post("/webhook/line")
+    async def line_webhook(request: Request, x_line_signature: str = Header(None)):
+        started = time.perf_counter()
+        received_at = time.time()
+        body = await request.body()
+        body_decoded = body.decode('utf-8')
+        print(f"📩 收到 Webhook 請求! Signature: {x_line_signature}", flush=True)
+        print(f"🔍 [Debug Raw Body]: {body_decoded}", flush=True)
+        
+        if not x_line_signature:
+            print("⚠️ 錯誤：找不到 X-Line-Signature Header", flush=True)
+
+        # 延遲載入: LINE SDK 在第一次請求時才匯入
+        from linebot.exceptions import InvalidSignatureError
+        
+        try:
+            # 第一次請求可能需在鎖內建立整個 runtime (狀態後端、LINE SDK、GDrive)，
+            # 在執行緒池中進行以免阻塞事件迴圈
+            if async_webhook:
+                await run_in_threadpool(lambda: runtime.line_adapter.ingest(body_decoded, x_line_signature))
+                print("✅ 請求已排入佇列", flush=True)
+            else:
+                await run_in_threadpool(lambda: runtime.line_adapter.handle_request(body_decoded, x_line_signature))
+                print("✅ 請求處理完成", flush=True)
+        except InvalidSignatureError:
+            print("⚠️ 簽章驗證失敗，拒絕請求", flush=True)
+            raise HTTPException(status_code=400, detail="Invalid signature")
+        except Exception as e:
+            print(f"❌ 處理 Webhook 時發生錯誤: {e}", flush=True)
+            raise HTTPException(status_code=500, detail="Internal Server Error")
+
+        if recorder:
+            # 遮罩與寫檔在執行緒池中進行，不阻塞事件迴圈
+            await run_in_threadpool(recorder.record, body_decoded, received_at)
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        if elapsed_ms > ack_budget_ms:
+            print(f"🐢 [Ingest] Webhook 回應耗時 {elapsed_ms:.0f} ms，超過預算 {ack_budget_ms:.0f} ms", flush=True)
+        
+        return {"status": "ok"}
+
+    @app.get("/")
+    def health_check():
+        return {"status": "active", "service": "Chat-to-Google-Drive Save Bot"}
+
+    @app.get("/metrics")
+    def metrics():
+        return runtime.metrics()
+
+    register_debug_routes(app)
+
+    return app
+
+app = create_app()
 
 if __name__ == "__main__":
     import uvicorn
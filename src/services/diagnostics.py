@@ -0,0 +1,186 @@
+import os
+import re
+import sys
+import time
+import threading
+import tracemalloc
+from collections import Counter, OrderedDict
+from typing import Dict, List, Optional
+
+# 等待中的執行緒 (鎖、佇列、select) 的最內層函式；預設不列入取樣
+IDLE_LEAVES = {
+    ("threading.py", "wait"), ("threading.py", "_wait_for_tstate_lock"),
+    ("queue.py", "get"), ("selectors.py", "select"), ("socket.py", "accept"),
+    ("base_events.py", "_run_once"), ("socketserver.py", "serve_forever"),
+}
+_THREAD_SUFFIX = re.compile(r"[-_]\d+(_\d+)?$")
+_SRC_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _short_path(filename: str) -> str:
+    """專案內的檔案顯示 src/ 之後的路徑，第三方套件只顯示檔名"""
+    if filename.startswith(_SRC_ROOT):
+        return "src/" + os.path.relpath(filename, _SRC_ROOT).replace(os.sep, "/")
+    return os.path.basename(filename)
+
+
+class SamplingProfiler:
+    """
+    Wall-clock sampling profiler over sys._current_frames().
+
+    Every `interval` seconds it walks the current stack of every thread
+    (except its own) and counts the collapsed stacks, grouped by thread
+    name with worker numbers removed (backup-worker-3 -> backup-worker).
+    Nothing is hooked into the interpreter, so the cost is one stack walk
+    per thread per sample and only while a profile is running. Output
+    lines are "thread;frame;...;leaf count" for flamegraph.pl / speedscope.
+    """
+    def __init__(self, max_seconds: float = 60.0):
+        self.max_seconds = max_seconds
+        self._running = threading.Lock()
+
+    @property
+    def busy(self) -> bool:
+        return self._running.locked()
+
+    def profile(self, seconds: float, interval: float = 0.01, include_idle: bool = False) -> Dict[str, object]:
+        if not self._running.acquire(blocking=False):
+            raise RuntimeError("已有取樣正在進行")
+        try:
+            return self._sample(min(seconds, self.max_seconds), max(interval, 0.001), include_idle)
+        finally:
+            self._running.release()
+
+    def _sample(self, seconds: float, interval: float, include_idle: bool) -> Dict[str, object]:
+        stacks: Counter = Counter()
+        me = threading.get_ident()
+        samples = 0
+        started = time.monotonic()
+        deadline = started + seconds
+        while time.monotonic() < deadline:
+            names = {t.ident: t.name for t in threading.enumerate()}
+            frames = sys._current_frames()
+            for ident, frame in frames.items():
+                if ident == me:
+                    continue
+                leaf = (os.path.basename(frame.f_code.co_filename), frame.f_code.co_name)
+                if not include_idle and leaf in IDLE_LEAVES:
+                    continue
+                stacks[self._collapse(names.get(ident, f"thread-{ident}"), frame)] += 1
+            # 不保留 frame 參照，避免延長區域變數的生命週期
+            del frames
+            samples += 1
+            time.sleep(interval)
+        return {
+            "seconds": round(time.monotonic() - started, 3),
+            "samples": samples,
+            "stacks": stacks,
+        }
+
+    @staticmethod
+    def _collapse(thread_name: str, frame) -> str:
+        parts: List[str] = []
+        while frame is not None:
+            code = frame.f_code
+            parts.append(f"{_short_path(code.co_filename)}:{getattr(code, 'co_qualname', code.co_name)}")
+            frame = frame.f_back
+        parts.append(_THREAD_SUFFIX.sub("", thread_name))
+        # flamegraph 以分號分隔、最後一個空白分隔次數
+        return ";".join(reversed(parts)).replace(" ", "_")
+
+    @staticmethod
+    def collapsed(stacks: Counter) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+class MemoryTracer:
+    """
+    tracemalloc snapshots and diffs, started on demand.
+
+    Tracing slows every allocation while it is on, so it stays off until
+    start() and stop() clears it again. Snapshots are kept by name (the
+    oldest is dropped beyond `max_snapshots`), and stats can be grouped
+    by line, file or whole traceback and restricted to frames matching a
+    filename pattern (e.g. "*/src/*") to see which stage holds memory.
+    """
+    def __init__(self, max_snapshots: int = 5):
+        self.max_snapshots = max_snapshots
+        self._snapshots: "OrderedDict[str, tracemalloc.Snapshot]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def tracing(self) -> bool:
+        return tracemalloc.is_tracing()
+
+    def start(self, frames: int = 25) -> dict:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+            print(f"🔬 [Debug] tracemalloc 已啟動 (frames={frames})", flush=True)
+        return self.status()
+
+    def stop(self) -> dict:
+        with self._lock:
+            self._snapshots.clear()
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+            print("🔬 [Debug] tracemalloc 已停止", flush=True)
+        return self.status()
+
+    def status(self) -> dict:
+        current, peak = tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else (0, 0)
+        return {
+            "tracing": tracemalloc.is_tracing(),
+            "traced_kb": current // 1024,
+            "peak_kb": peak // 1024,
+            "overhead_kb": tracemalloc.get_tracemalloc_memory() // 1024,
+            "snapshots": list(self._snapshots),
+        }
+
+    def snapshot(self, name: Optional[str] = None) -> str:
+        if not tracemalloc.is_tracing():
+            raise RuntimeError("tracemalloc 尚未啟動")
+        snap = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+        ])
+        with self._lock:
+            name = name or f"s{int(time.time())}"
+            self._snapshots.pop(name, None)
+            self._snapshots[name] = snap
+            while len(self._snapshots) > self.max_snapshots:
+                self._snapshots.popitem(last=False)
+        return name
+
+    def _get(self, name: str) -> tracemalloc.Snapshot:
+        with self._lock:
+            if name not in self._snapshots:
+                raise KeyError(name)
+            return self._snapshots[name]
+
+    @staticmethod
+    def _filtered(snap: tracemalloc.Snapshot, match: Optional[str]) -> tracemalloc.Snapshot:
+        if not match:
+            return snap
+        return snap.filter_traces([tracemalloc.Filter(True, match, all_frames=True)])
+
+    def top(self, name: str, key: str = "lineno", limit: int = 20, match: Optional[str] = None) -> List[dict]:
+        stats = self._filtered(self._get(name), match).statistics(key)
+        return [self._format(stat) for stat in stats[:limit]]
+
+    def diff(self, base: str, target: str, key: str = "lineno", limit: int = 20, match: Optional[str] = None) -> List[dict]:
+        old = self._filtered(self._get(base), match)
+        new = self._filtered(self._get(target), match)
+        return [self._format(stat) for stat in new.compare_to(old, key)[:limit]]
+
+    @staticmethod
+    def _format(stat) -> dict:
+        entry = {
+            "size_kb": round(stat.size / 1024, 1),
+            "count": stat.count,
+            # 最內層的 frame 在前
+            "where": [f"{_short_path(frame.filename)}:{frame.lineno}" for frame in reversed(stat.traceback)],
+        }
+        if hasattr(stat, "size_diff"):
+            entry["size_diff_kb"] = round(stat.size_diff / 1024, 1)
+            entry["count_diff"] = stat.count_diff
+        return entry
@@ -0,0 +1,146 @@
+import signal
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, Optional
+from urllib.parse import urljoin
+from bs4 import BeautifulSoup
+
+# 轉換前移除的標籤
+STRIP_TAGS = ["script", "style", "nav", "footer", "header", "noscript", "iframe", "aside"]
+# 子行程逾時中斷後，等待其回報結果的額外時間 (秒)
+PARSE_GRACE_SECONDS = 5.0
+
+
+def parse_page(raw: bytes, url: str) -> Dict[str, Any]:
+    """
+    Parse + sanitize one page: raw bytes in, metadata and cleaned HTML out.
+    Module-level and side-effect free so it can run in a worker process.
+    """
+    summary = {"title": "", "description": "", "image": "", "html_content": ""}
+    # 由 bs4 偵測編碼 (meta charset / BOM / 內容推測)
+    soup = BeautifulSoup(raw, 'html.parser')
+
+    # Title
+    og_title = soup.find("meta", property="og:title")
+    summary["title"] = og_title["content"] if og_title else (soup.title.string.strip() if soup.title and soup.title.string else "")
+
+    # Description
+    og_desc = soup.find("meta", property="og:description")
+    summary["description"] = og_desc["content"] if og_desc else ""
+
+    # Image
+    og_image = soup.find("meta", property="og:image")
+    content = og_image.get("content") if og_image else ""
+    if content and not content.startswith("http"):
+        content = urljoin(url, content)
+    summary["image"] = content
+
+    # Cleanup for HTML Conversion
+    # We want to keep formatting (tables, bold, etc) but remove junk.
+    for tag in soup(STRIP_TAGS):
+        tag.decompose()
+
+    # Isolate Main Content
+    main_content = soup.find('main') or soup.find('article') or soup.body
+
+    if main_content:
+        for tag in [main_content, *main_content.find_all(True)]:
+            # Remove event handlers
+            for attr in [attr for attr in tag.attrs if attr.startswith('on')]:
+                del tag.attrs[attr]
+        summary["html_content"] = str(main_content)
+    else:
+        summary["html_content"] = "<div>No main content found</div>"
+    return summary
+
+
+class ParseTimeout(Exception):
+    """解析超過時限 (在解析行程內觸發)"""
+
+
+def _raise_parse_timeout(signum, frame):
+    raise ParseTimeout()
+
+
+def run_with_deadline(func, timeout: float, *args):
+    """
+    在解析行程內執行 func，超過 timeout 秒時以 SIGALRM 中斷並拋出 ParseTimeout。
+    只中斷這一頁，行程本身繼續處理下一頁；不支援 SIGALRM 的平台不設時限。
+    """
+    use_alarm = hasattr(signal, "setitimer") and threading.current_thread() is threading.main_thread()
+    if use_alarm:
+        previous = signal.signal(signal.SIGALRM, _raise_parse_timeout)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        return func(*args)
+    finally:
+        if use_alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, previous)
+
+
+class HtmlParsePool:
+    """
+    Runs parse_page in a process pool so large pages do not hold the GIL
+    while upload and webhook threads are running.
+
+    Workers are recycled after `max_tasks_per_child` pages to cap their
+    memory. Pages smaller than `inline_bytes` (or all pages when
+    workers=0) are parsed in the calling thread, where IPC would cost
+    more than it saves. A page that takes longer than `timeout` is
+    interrupted inside its worker, so one pathological page never takes
+    down the other workers.
+    """
+    def __init__(self, workers: int = 2, max_tasks_per_child: int = 50, inline_bytes: int = 64 * 1024, timeout: float = 30.0):
+        self.workers = workers
+        self.max_tasks_per_child = max_tasks_per_child
+        self.inline_bytes = inline_bytes
+        self.timeout = timeout
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # spawn: 不複製父行程的執行緒與鎖，且支援 max_tasks_per_child
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    max_tasks_per_child=self.max_tasks_per_child
+                )
+            return self._executor
+
+    def parse(self, raw: bytes, url: str) -> Dict[str, Any]:
+        if self.workers <= 0 or len(raw) < self.inline_bytes:
+            return parse_page(raw, url)
+        empty = {"title": "", "description": "", "image": "", "html_content": ""}
+        try:
+            future = self._get_executor().submit(run_with_deadline, parse_page, self.timeout, raw, url)
+            # 時限由子行程自行執行；這裡多等一段時間，只處理子行程完全沒有回應的情況
+            return future.result(timeout=self.timeout + PARSE_GRACE_SECONDS)
+        except BrokenProcessPool as e:
+            # 子行程異常結束 (例如 OOM)；重建 pool 並改在本執行緒處理這一頁
+            print(f"⚠️ [Parse] HTML 解析行程異常，改為同步解析: {e}", flush=True)
+            self._reset()
+            return parse_page(raw, url)
+        except ParseTimeout:
+            # 同步重試同樣會卡住，這一頁只保留空白摘要
+            print(f"⚠️ [Parse] HTML 解析逾時 ({self.timeout:.0f}s)，略過: {url[:60]}", flush=True)
+            return empty
+        except TimeoutError:
+            # 子行程卡在無法中斷的程式碼 (或平台不支援 SIGALRM)；改用新的 pool，
+            # 後續頁面不會排在卡住的頁面之後
+            print(f"⚠️ [Parse] HTML 解析行程無回應，改用新的解析行程: {url[:60]}", flush=True)
+            self._reset()
+            return empty
+
+    def _reset(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self):
+        self._reset()
@@ -0,0 +1,128 @@
+import io
+import hashlib
+import threading
+import requests
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+from ..clients.gdrive_client import GDriveClient
+from ..state.backend import StateBackend
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow 未安裝時不縮圖，只做大小限制
+    Image = None
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+
+class ImageStage:
+    """
+    Re-hosts og:images on Drive before they are inserted into a Doc.
+
+    Images are fetched in parallel, downscaled to `max_dimension`, uploaded
+    once and cached by source URL. The Doc then references the Drive copy,
+    so batchUpdate no longer depends on slow or huge remote images.
+    Each image degrades independently: a failed image is simply left out.
+    Drive copies are public only while a Doc inserts them; cached copies are
+    re-published on reuse.
+    """
+    CACHE_TTL = 30 * 24 * 3600
+
+    def __init__(self,
+                 gdrive: GDriveClient,
+                 state: Optional[StateBackend] = None,
+                 max_dimension: int = 800,
+                 max_source_bytes: int = 10 * 1024 * 1024,
+                 workers: int = 4,
+                 timeout: float = 10):
+        self.gdrive = gdrive
+        self.state = state
+        self.max_dimension = max_dimension
+        self.max_source_bytes = max_source_bytes
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="image-stage")
+        # 沒有共享狀態時使用行程內的 LRU 快取
+        self._local_cache: "OrderedDict[str, str]" = OrderedDict()
+        self._local_cache_size = 512
+        self._cache_lock = threading.Lock()
+
+    def rehost(self, urls: List[str]) -> Dict[str, Optional[str]]:
+        """平行處理多張圖片，回傳 來源網址 -> Drive 圖片網址 (失敗為 None)"""
+        unique = list(dict.fromkeys(u for u in urls if u))
+        futures = {url: self._executor.submit(self._rehost_one, url) for url in unique}
+        results = {}
+        for url, future in futures.items():
+            try:
+                results[url] = future.result()
+            except Exception as e:
+                print(f"⚠️ [Image] 圖片處理失敗，略過: {url[:60]} ({e})", flush=True)
+                results[url] = None
+        return results
+
+    def _cache_key(self, url: str) -> str:
+        return "image:" + hashlib.sha1(url.encode('utf-8')).hexdigest()
+
+    def _cache_get(self, url: str) -> Optional[str]:
+        key = self._cache_key(url)
+        if self.state:
+            return self.state.get(key)
+        with self._cache_lock:
+            value = self._local_cache.get(key)
+            if value:
+                self._local_cache.move_to_end(key)
+            return value
+
+    def _cache_set(self, url: str, hosted: str):
+        key = self._cache_key(url)
+        if self.state:
+            self.state.set(key, hosted, ttl=self.CACHE_TTL)
+            return
+        with self._cache_lock:
+            self._local_cache[key] = hosted
+            while len(self._local_cache) > self._local_cache_size:
+                self._local_cache.popitem(last=False)
+
+    def _rehost_one(self, url: str) -> Optional[str]:
+        cached = self._cache_get(url)
+        if cached:
+            # 插入文件後公開權限會被收回，重用前重新開放
+            try:
+                return self.gdrive.publish_image(cached)
+            except Exception as e:
+                print(f"⚠️ [Image] 快取圖片無法重新開放，改為重新上傳: {e}", flush=True)
+        data, mime_type = self._fetch(url)
+        data, mime_type = self._downscale(data, mime_type)
+        name = f"thumb_{hashlib.sha1(url.encode('utf-8')).hexdigest()[:12]}.{mime_type.split('/')[-1]}"
+        hosted = self.gdrive.upload_public_image(data, name, mime_type)
+        self._cache_set(url, hosted)
+        print(f"🖼️ [Image] 已轉存圖片: {url[:40]}... -> Drive", flush=True)
+        return hosted
+
+    def _fetch(self, url: str) -> Tuple[bytes, str]:
+        with requests.get(url, headers={'User-Agent': USER_AGENT}, timeout=self.timeout, stream=True) as resp:
+            resp.raise_for_status()
+            mime_type = resp.headers.get('Content-Type', 'image/jpeg').split(';')[0].strip().lower()
+            if not mime_type.startswith('image/'):
+                raise ValueError(f"非圖片內容: {mime_type}")
+            buffer = bytearray()
+            for chunk in resp.iter_content(chunk_size=64 * 1024):
+                buffer.extend(chunk)
+                if len(buffer) > self.max_source_bytes:
+                    raise ValueError("圖片過大")
+        return bytes(buffer), mime_type
+
+    def _downscale(self, data: bytes, mime_type: str) -> Tuple[bytes, str]:
+        if Image is None:
+            return data, mime_type
+        with Image.open(io.BytesIO(data)) as img:
+            if max(img.size) <= self.max_dimension and mime_type in ('image/jpeg', 'image/png'):
+                return data, mime_type
+            img.thumbnail((self.max_dimension, self.max_dimension))
+            if img.mode not in ('RGB', 'L'):
+                img = img.convert('RGB')
+            out = io.BytesIO()
+            img.save(out, format='JPEG', quality=85, optimize=True)
+        return out.getvalue(), 'image/jpeg'
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
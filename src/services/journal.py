@@ -0,0 +1,222 @@
+import os
+import re
+import json
+import time
+import datetime
+import threading
+from typing import Dict, List, Optional, Tuple
+from ..clients.gdrive_client import GDriveClient
+from ..workers.adaptive_limit import error_status
+from ..state.backend import StateBackend
+
+# 每日文件 ID 只需要存活到隔天
+JOURNAL_DOC_TTL = 2 * 24 * 3600
+
+
+class DailyJournal:
+    """
+    One rolling Google Doc per chat per day.
+
+    Entries are buffered in memory and appended by a background thread,
+    one batchUpdate per document per flush. The doc ID for (chat, day) is
+    cached locally and in the shared state backend, so Drive is searched
+    at most once per chat per day instead of once per message; creation is
+    claimed through the backend so two workers never both create the doc.
+    A doc that was deleted or lost its permissions (404/403) is recreated,
+    and other failed appends are retried up to `max_attempts` flushes.
+    """
+    def __init__(self,
+                 gdrive: GDriveClient,
+                 state: Optional[StateBackend] = None,
+                 flush_interval: float = 5.0,
+                 max_pending: int = 100,
+                 max_attempts: int = 5,
+                 create_wait: float = 30.0):
+        self.gdrive = gdrive
+        self.state = state
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.max_attempts = max_attempts
+        self.create_wait = create_wait
+
+        self._docs: Dict[str, dict] = {}
+        self._pending: Dict[str, List[str]] = {}
+        # 文件 ID -> (chat:day, day, context)，文件失效時用來重新建立
+        self._doc_keys: Dict[str, Tuple[str, str, str]] = {}
+        # 文件 ID -> 連續寫入失敗次數
+        self._failures: Dict[str, int] = {}
+        # _lock 保護 _pending / _doc_keys / _failures；_flush_lock 讓同一時間只有一個 flush，
+        # 避免呼叫端與背景執行緒同時寫入同一份文件而打亂順序
+        self._lock = threading.Lock()
+        self._doc_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @staticmethod
+    def _today() -> str:
+        return datetime.date.today().isoformat()
+
+    @staticmethod
+    def doc_title(day: str, context: str) -> str:
+        clean_context = re.sub(r'[\\/*?:"\'<>|]', "", context).strip()[:30]
+        return f"{day.replace('-', '')}_Journal_{clean_context}"
+
+    def doc_for(self, chat_id: str, context: str) -> dict:
+        """取得 (建立) 今日的日誌文件，回傳 {'id', 'link'}"""
+        day = self._today()
+        key = f"{chat_id}:{day}"
+        doc = self._docs.get(key)
+        if doc:
+            return doc
+        return self._resolve(key, day, context)
+
+    def _resolve(self, key: str, day: str, context: str, exclude: Optional[str] = None, carry: List[str] = ()) -> dict:
+        """
+        查詢或建立 (chat, day) 的文件。exclude 為已失效的文件 ID (不再沿用)，
+        carry 為要移到新文件、接在標題之後的內容。
+        """
+        # 同一程序內只有一個執行緒查詢/建立；跨 worker 由共享狀態的建立權決定
+        with self._doc_lock:
+            doc = self._docs.get(key)
+            header = None
+            if not doc or doc["id"] == exclude:
+                doc, header = self._shared_doc(key, day, context, exclude)
+            self._docs = {k: v for k, v in self._docs.items() if k.endswith(self._today())}
+            self._docs[key] = doc
+            with self._lock:
+                self._doc_keys[doc["id"]] = (key, day, context)
+        if header or carry:
+            with self._lock:
+                self._pending.setdefault(doc["id"], [])[0:0] = ([header] if header else []) + list(carry)
+        return doc
+
+    def _shared_doc(self, key: str, day: str, context: str, exclude: Optional[str]):
+        """回傳 (doc, 標題區塊)；只有實際建立文件的 worker 會取得標題區塊"""
+        if not self.state:
+            return self._find_or_create(day, context, exclude)
+
+        state_key = f"journal:{key}"
+        deadline = time.monotonic() + self.create_wait
+        while True:
+            cached = self.state.get(state_key)
+            if cached and json.loads(cached)["id"] != exclude:
+                return json.loads(cached), None
+            # 取得建立權的 worker 才查詢/建立，其他 worker 等待並沿用其結果
+            if self.state.set_if_absent(f"{state_key}:creating", str(os.getpid()), ttl=self.create_wait):
+                break
+            if time.monotonic() >= deadline:
+                # 建立者逾時未完成，改由自己處理 (仍會先以名稱查詢)
+                break
+            time.sleep(0.2)
+
+        try:
+            doc, header = self._find_or_create(day, context, exclude)
+            self.state.set(state_key, json.dumps(doc), ttl=JOURNAL_DOC_TTL)
+        finally:
+            self.state.delete(f"{state_key}:creating")
+        return doc, header
+
+    def _find_or_create(self, day: str, context: str, exclude: Optional[str] = None):
+        title = self.doc_title(day, context)
+        doc_id = self.gdrive.get_doc_by_name(title)
+        if doc_id and doc_id != exclude:
+            print(f"📓 [Journal] 沿用今日日誌: {title}", flush=True)
+            return {"id": doc_id, "link": f"https://docs.google.com/document/d/{doc_id}/edit"}, None
+
+        created = self.gdrive.create_blank_doc(title)
+        print(f"📓 [Journal] 建立今日日誌: {title}", flush=True)
+        doc = {"id": created["id"], "link": created.get("webViewLink") or f"https://docs.google.com/document/d/{created['id']}/edit"}
+        return doc, f"Title: {title}\nChat Context: {context}\n"
+
+    def append(self, chat_id: str, context: str, block: str) -> str:
+        """將一段內容排入今日日誌，回傳文件連結 (實際寫入由背景批次處理)"""
+        doc = self.doc_for(chat_id, context)
+        with self._lock:
+            entries = self._pending.setdefault(doc["id"], [])
+            entries.append(block)
+            overflow = len(entries) >= self.max_pending
+        if self._thread is None:
+            # 未啟動背景執行緒 (腳本或測試) 時直接寫入
+            self.flush()
+        elif overflow:
+            # 累積過多時喚醒背景執行緒提早寫入，不在呼叫端執行緒送出
+            self._wake.set()
+        return doc["link"]
+
+    def flush(self):
+        """每份文件一次 batchUpdate"""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            for doc_id, blocks in pending.items():
+                self._flush_doc(doc_id, blocks)
+
+    def _flush_doc(self, doc_id: str, blocks: List[str]):
+        try:
+            self.gdrive.append_to_doc(doc_id, blocks)
+            with self._lock:
+                self._failures.pop(doc_id, None)
+            return
+        except Exception as e:
+            print(f"⚠️ [Journal] 寫入日誌失敗 ({len(blocks)} 筆): {e}", flush=True)
+            with self._lock:
+                gone = error_status(e) in (403, 404) and doc_id in self._doc_keys
+        if gone and self._replace(doc_id, blocks):
+            return
+
+        with self._lock:
+            attempts = self._failures.get(doc_id, 0) + 1
+            if attempts >= self.max_attempts:
+                self._failures.pop(doc_id, None)
+                print(f"❌ [Journal] 連續 {attempts} 次寫入失敗，捨棄 {len(blocks)} 筆內容 (doc={doc_id})", flush=True)
+                return
+            self._failures[doc_id] = attempts
+            # 失敗時放回佇列前端，下次再試 (保持順序)
+            self._pending[doc_id] = blocks + self._pending.get(doc_id, [])
+
+    def _replace(self, doc_id: str, blocks: List[str]) -> bool:
+        """文件已刪除或失去權限：作廢快取的 ID，改寫入重新建立的文件"""
+        print(f"📓 [Journal] 日誌文件已無法存取，重新建立 (doc={doc_id})", flush=True)
+        with self._lock:
+            key, day, context = self._doc_keys[doc_id]
+            # 失效文件上尚未送出的新內容一併搬移
+            blocks = blocks + self._pending.pop(doc_id, [])
+        try:
+            self._resolve(key, day, context, exclude=doc_id, carry=blocks)
+        except Exception as e:
+            print(f"⚠️ [Journal] 重新建立日誌失敗: {e}", flush=True)
+            with self._lock:
+                self._pending[doc_id] = blocks + self._pending.get(doc_id, [])
+            return False
+        with self._lock:
+            self._doc_keys.pop(doc_id, None)
+            self._failures.pop(doc_id, None)
+        return True
+
+    def start(self):
+        """啟動批次寫入背景執行緒"""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._wake.clear()
+        self._thread = threading.Thread(target=self._run, name="journal-flusher", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """停止背景執行緒，並寫入尚未送出的內容"""
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self.flush()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+            self.flush()
@@ -0,0 +1,158 @@
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict, deque
+from typing import Deque, Optional, Tuple
+from urllib.parse import urlsplit
+from ..state.backend import StateBackend
+
+# 僅與該網址有關的狀態 (不計入網域失敗)
+URL_ONLY_STATUS = (400, 404, 410)
+
+
+class _DomainHealth:
+    def __init__(self, samples: int):
+        self.latencies: Deque[float] = deque(maxlen=samples)
+        self.failures = 0
+        self.open_until = 0.0
+        self.probing = False
+
+
+class LinkHealth:
+    """
+    Per-domain health for link previews.
+
+    - Circuit breaker: after `failure_threshold` consecutive failures or
+      timeouts the domain is skipped for `cooldown` seconds, then a single
+      probe request decides whether it closes again.
+    - Negative cache: failed URLs are not fetched again for `negative_ttl`
+      seconds (shared through the state backend when available).
+    - Adaptive timeout: once a domain has enough samples, its timeout is
+      `headroom` x its p95 latency, clamped to [min_timeout, max_timeout].
+    - Per-domain state is kept for the `max_domains` most recently used domains.
+    """
+    def __init__(self,
+                 state: Optional[StateBackend] = None,
+                 failure_threshold: int = 3,
+                 cooldown: float = 300,
+                 negative_ttl: float = 600,
+                 min_timeout: float = 2.0,
+                 max_timeout: float = 15.0,
+                 headroom: float = 3.0,
+                 min_samples: int = 5,
+                 samples: int = 50,
+                 max_domains: int = 1024):
+        self.state = state
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.negative_ttl = negative_ttl
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.headroom = headroom
+        self.min_samples = min_samples
+        self.samples = samples
+        self.max_domains = max_domains
+
+        # 網域來自使用者貼上的網址：以 LRU 保持有界，最久未使用的網域先移除
+        self._domains: "OrderedDict[str, _DomainHealth]" = OrderedDict()
+        self._lock = threading.Lock()
+        # 沒有共享狀態時使用行程內的負面快取
+        self._negative: "OrderedDict[str, float]" = OrderedDict()
+        self._negative_size = 2048
+
+    @classmethod
+    def from_env(cls, state: Optional[StateBackend] = None) -> "LinkHealth":
+        return cls(
+            state,
+            failure_threshold=int(os.getenv("LINK_FAILURE_THRESHOLD", 3)),
+            cooldown=float(os.getenv("LINK_CIRCUIT_COOLDOWN", 300)),
+            negative_ttl=float(os.getenv("LINK_NEGATIVE_TTL", 600)),
+            max_timeout=float(os.getenv("LINK_TIMEOUT_MAX", 15))
+        )
+
+    @staticmethod
+    def domain_of(url: str) -> str:
+        return (urlsplit(url).hostname or "").lower()
+
+    def _domain(self, domain: str) -> _DomainHealth:
+        health = self._domains.get(domain)
+        if health is None:
+            health = self._domains[domain] = _DomainHealth(self.samples)
+            while len(self._domains) > self.max_domains:
+                self._domains.popitem(last=False)
+        else:
+            self._domains.move_to_end(domain)
+        return health
+
+    def _negative_key(self, url: str) -> str:
+        return "deadlink:" + hashlib.sha1(url.encode('utf-8')).hexdigest()
+
+    def _is_negative(self, url: str) -> bool:
+        key = self._negative_key(url)
+        if self.state:
+            return self.state.get(key) is not None
+        with self._lock:
+            expires_at = self._negative.get(key)
+            if expires_at is None:
+                return False
+            if expires_at <= time.monotonic():
+                del self._negative[key]
+                return False
+            return True
+
+    def _mark_negative(self, url: str):
+        key = self._negative_key(url)
+        if self.state:
+            self.state.set(key, "1", ttl=self.negative_ttl)
+            return
+        with self._lock:
+            self._negative[key] = time.monotonic() + self.negative_ttl
+            self._negative.move_to_end(key)
+            while len(self._negative) > self._negative_size:
+                self._negative.popitem(last=False)
+
+    def allow(self, url: str) -> Tuple[bool, str]:
+        """是否應該抓取此網址；不抓取時附上原因"""
+        if self._is_negative(url):
+            return False, "recently failed"
+        with self._lock:
+            health = self._domain(self.domain_of(url))
+            if health.failures < self.failure_threshold:
+                return True, ""
+            if time.monotonic() < health.open_until or health.probing:
+                return False, "circuit open"
+            # 冷卻結束 (half-open)：只放行一個探測請求
+            health.probing = True
+            return True, ""
+
+    def timeout_for(self, url: str) -> float:
+        with self._lock:
+            latencies = sorted(self._domain(self.domain_of(url)).latencies)
+        if len(latencies) < self.min_samples:
+            return self.max_timeout
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        return max(self.min_timeout, min(self.max_timeout, p95 * self.headroom))
+
+    def record_success(self, url: str, latency: float):
+        with self._lock:
+            health = self._domain(self.domain_of(url))
+            health.latencies.append(latency)
+            if health.failures >= self.failure_threshold:
+                print(f"🟢 [Link] {self.domain_of(url)} 已恢復", flush=True)
+            health.failures = 0
+            health.probing = False
+
+    def record_failure(self, url: str, status: Optional[int] = None):
+        """失敗 (逾時、連線錯誤或非 200)；僅與網址有關的狀態碼不影響網域"""
+        self._mark_negative(url)
+        if status in URL_ONLY_STATUS:
+            return
+        domain = self.domain_of(url)
+        with self._lock:
+            health = self._domain(domain)
+            health.failures += 1
+            health.probing = False
+            if health.failures >= self.failure_threshold:
+                health.open_until = time.monotonic() + self.cooldown
+                print(f"🔴 [Link] {domain} 連續失敗 {health.failures} 次，暫停抓取 {self.cooldown:.0f}s", flush=True)
@@ -0,0 +1,120 @@
+from typing import Optional
+
+# 副檔名 -> MIME
+EXTENSION_MIME = {
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".png": "image/png",
+    ".gif": "image/gif",
+    ".webp": "image/webp",
+    ".heic": "image/heic",
+    ".bmp": "image/bmp",
+    ".svg": "image/svg+xml",
+    ".mp4": "video/mp4",
+    ".mov": "video/quicktime",
+    ".webm": "video/webm",
+    ".3gp": "video/3gpp",
+    ".avi": "video/x-msvideo",
+    ".m4a": "audio/mp4",
+    ".aac": "audio/aac",
+    ".mp3": "audio/mpeg",
+    ".wav": "audio/wav",
+    ".ogg": "audio/ogg",
+    ".flac": "audio/flac",
+    ".pdf": "application/pdf",
+    ".zip": "application/zip",
+    ".7z": "application/x-7z-compressed",
+    ".rar": "application/vnd.rar",
+    ".txt": "text/plain",
+    ".csv": "text/csv",
+    ".json": "application/json",
+    ".html": "text/html",
+    ".doc": "application/msword",
+    ".docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    ".xls": "application/vnd.ms-excel",
+    ".xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    ".ppt": "application/vnd.ms-powerpoint",
+    ".pptx": "application/vnd.openxmlformats-officedocument.presentationml.presentation",
+}
+
+# MIME -> 慣用副檔名 (同一 MIME 有多個副檔名時取第一個)
+MIME_EXTENSION = {}
+for _ext, _mime in EXTENSION_MIME.items():
+    MIME_EXTENSION.setdefault(_mime, _ext)
+# LINE 的音訊 Content-Type 為 audio/x-m4a
+MIME_EXTENSION["audio/x-m4a"] = ".m4a"
+
+# LINE 轉檔後的預設格式
+CONTENT_TYPE_DEFAULT_MIME = {
+    "image": "image/jpeg",
+    "video": "video/mp4",
+    "audio": "audio/mp4",
+}
+
+GENERIC_MIME = "application/octet-stream"
+
+# ISO base media (ftyp) brand -> MIME
+FTYP_BRANDS = {
+    b"heic": "image/heic", b"heix": "image/heic", b"mif1": "image/heic", b"msf1": "image/heic",
+    b"M4A ": "audio/mp4", b"M4B ": "audio/mp4",
+    b"qt  ": "video/quicktime",
+    b"3gp4": "video/3gpp", b"3gp5": "video/3gpp", b"3g2a": "video/3gpp",
+}
+
+
+def sniff_mime(head: bytes) -> Optional[str]:
+    """由檔案開頭的 magic bytes 判斷 MIME (需至少 16 bytes 才能辨識 ftyp / RIFF 容器)"""
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if head.startswith((b"GIF87a", b"GIF89a")):
+        return "image/gif"
+    if head.startswith(b"RIFF") and len(head) >= 12:
+        return {b"WEBP": "image/webp", b"WAVE": "audio/wav", b"AVI ": "video/x-msvideo"}.get(head[8:12])
+    if head[4:8] == b"ftyp":
+        return FTYP_BRANDS.get(head[8:12], "video/mp4")
+    if head.startswith(b"\x1a\x45\xdf\xa3"):
+        return "video/webm"
+    if head.startswith(b"ID3") or head[:2] in (b"\xff\xfb", b"\xff\xf3", b"\xff\xf2"):
+        return "audio/mpeg"
+    if head[:2] in (b"\xff\xf1", b"\xff\xf9"):
+        return "audio/aac"
+    if head.startswith(b"OggS"):
+        return "audio/ogg"
+    if head.startswith(b"fLaC"):
+        return "audio/flac"
+    if head.startswith(b"%PDF"):
+        return "application/pdf"
+    if head.startswith(b"PK\x03\x04"):
+        return "application/zip"
+    if head.startswith(b"7z\xbc\xaf\x27\x1c"):
+        return "application/x-7z-compressed"
+    if head.startswith(b"Rar!"):
+        return "application/vnd.rar"
+    return None
+
+
+def content_type_for_mime(mime: Optional[str]) -> str:
+    """MIME -> 儲存分類 (image / video / audio / file)"""
+    major = (mime or "").split("/")[0]
+    return major if major in ("image", "video", "audio") else "file"
+
+
+def extension_of(filename: Optional[str]) -> str:
+    if filename and "." in filename:
+        return "." + filename.rsplit(".", 1)[-1].lower()
+    return ""
+
+
+def guess_mime(content_type: str, filename: Optional[str] = None) -> str:
+    """優先依副檔名，其次依儲存分類的預設格式"""
+    mime = EXTENSION_MIME.get(extension_of(filename))
+    return mime or CONTENT_TYPE_DEFAULT_MIME.get(content_type, GENERIC_MIME)
+
+
+def guess_extension(content_type: str, filename: Optional[str] = None) -> str:
+    """保留原檔名的副檔名，否則使用儲存分類的預設副檔名"""
+    if filename and "." in filename:
+        return "." + filename.rsplit(".", 1)[-1]
+    return MIME_EXTENSION.get(CONTENT_TYPE_DEFAULT_MIME.get(content_type, ""), "")
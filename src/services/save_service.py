@@ -1,13 +1,54 @@
+import os
+import time
 import datetime
+import tempfile
 import requests
 import re
-from bs4 import BeautifulSoup
-from typing import Optional, List, Dict, Any, Union
+from typing import Optional, List, Dict, Any, Union, IO, Iterator
 from ..clients.gdrive_client import GDriveClient
+from .image_stage import ImageStage
+from .journal import DailyJournal
+from .html_parser import HtmlParsePool
+from .media_types import guess_extension, guess_mime
+from .link_health import LinkHealth
+
+HTML_HEADER = b"<html><body>"
+HTML_FOOTER = b"</body></html>"
+HTML_TRUNCATED_NOTE = "<hr><p><em>[Backup truncated: content exceeded {limit_mb} MB]</em></p>"
+# 組合後的 HTML 小於此大小時留在記憶體，否則寫入磁碟暫存
+HTML_SPOOL_BYTES = 1024 * 1024
+FETCH_CHUNK_BYTES = 64 * 1024
+
+
+def _utf8_prefix(data: bytes, limit: int) -> memoryview:
+    """取 data 前 limit bytes；切點落在多位元組字元中間時退回該字元的起始位元組 (只檢查尾端)"""
+    view = memoryview(data)
+    if limit >= len(data):
+        return view
+    cut = limit
+    # 續位元組為 10xxxxxx；UTF-8 字元最長 4 bytes，最多往回 3 個
+    while cut > 0 and limit - cut < 3 and (data[cut] & 0xC0) == 0x80:
+        cut -= 1
+    return view[:cut]
 
 class SaveService:
-    def __init__(self, gdrive_client: GDriveClient):
+    def __init__(self,
+                 gdrive_client: GDriveClient,
+                 image_stage: Optional[ImageStage] = None,
+                 journal: Optional[DailyJournal] = None,
+                 html_parser: Optional[HtmlParsePool] = None,
+                 link_health: Optional[LinkHealth] = None):
         self.gdrive = gdrive_client
+        self.image_stage = image_stage or ImageStage(gdrive_client)
+        self.journal = journal or DailyJournal(gdrive_client)
+        self.html_parser = html_parser or HtmlParsePool(
+            workers=int(os.getenv("HTML_PARSE_WORKERS", 2)),
+            max_tasks_per_child=int(os.getenv("HTML_PARSE_MAX_TASKS", 50)),
+            inline_bytes=int(os.getenv("HTML_PARSE_INLINE_KB", 64)) * 1024
+        )
+        self.link_health = link_health or LinkHealth.from_env()
+        self.max_html_bytes = int(os.getenv("MAX_HTML_BACKUP_MB", 8)) * 1024 * 1024
+        self.max_fetch_bytes = int(os.getenv("MAX_HTML_FETCH_MB", 16)) * 1024 * 1024
 
     def generate_title(self, user_text: Optional[str], content_type: str) -> str:
         now = datetime.datetime.now()
@@ -32,7 +73,7 @@ class SaveService:
                     context: str, 
                     content_type: str, 
                     text: Optional[str] = None, 
-                    file_content: Optional[bytes] = None, 
+                    file_content: Optional[Union[bytes, IO[bytes]]] = None, 
                     filename: Optional[str] = None) -> str:
         
         print(f"💾 [Service] 正在處理儲存請求: Type={content_type}, Context={context}", flush=True)
@@ -85,58 +126,20 @@ class SaveService:
         if text:
             content_items.append("- Original Content: ")
             
-            # Smart Split for Mixed Content
-            # We want to reconstruct the text but make URLs clickable.
-            # Split by URLs capturing the delimiter
-            parts = re.split(r'(https?://[^\s]+)', text)
-            
-            # We need to construct a list of items that form the paragraph.
-            # GDriveClient processes items in REVERSE order and inserts at index 1.
-            # So to get "A Link B", we must append [A, Link, B] to content_items in that order?
-            # Wait, my GDriveClient iterates REVERSE.
-            # List: [Item1, Item2, Item3]
-            # Iteration: Item3 -> Insert at 1. Doc: [Item3]
-            # Item2 -> Insert at 1. Doc: [Item2, Item3]
-            # Item1 -> Insert at 1. Doc: [Item1, Item2, Item3]
-            # So I should append items in READING ORDER.
-            
-            # HOWEVER, each item usually forces a newline in current GDriveClient.
-            # I need to modify GDriveClient to support inline. 
-            # Im saving that for step 2 of this request. 
-            # For now, I will use a safe fallback: List them as blocks if possible, or just one block if not.
-            # Actually, to support "Multiple Links", I will just list them.
-            # But the requirement is "Original Content" has links.
-            
-            # For this step, I will assume GDriveClient will be updated to support 'newline': False.
-            
-            paragraph_items = []
-            for part in parts:
-                if not part: continue
-                if part in urls:
-                    paragraph_items.append({"type": "link", "text": part, "url": part, "newline": False})
-                else:
-                    paragraph_items.append({"type": "text", "text": part, "newline": False})
-            
-            # Add a newline at the end of the paragraph
-            if paragraph_items:
-                paragraph_items[-1]['newline'] = True
-                
-            content_items.extend(paragraph_items)
+            content_items.extend(self._paragraph_items(text, urls))
 
         # 3. Aggregation Strategy: HTML vs Standard
-        combined_html = ""
+        combined_html = None
         has_html_backup = False
         
         # Check if we have HTML content to use
         html_chunks = [meta['html_content'] for meta in url_backups if meta.get('html_content')]
         if html_chunks:
             has_html_backup = True
-            # Build a simple HTML wrapper
-            combined_html = "<html><body>"
-            for i, chunk in enumerate(html_chunks):
-                if i > 0: combined_html += "<br><hr><br>" # Separator
-                combined_html += chunk
-            combined_html += "</body></html>"
+            # 以串流方式組合 HTML 至 Spooled 緩衝區 (超過上限時截斷)，避免多份完整副本
+            combined_html = self._compose_html(html_chunks)
+            for meta in url_backups:
+                meta.pop('html_content', None)
         
         # If we have HTML backup, we don't need to append backup text to content_items
         # But we still want to append Metadata and Link context at the TOP (which content_items does via create_doc)
@@ -144,6 +147,9 @@ class SaveService:
         if not has_html_backup and url_backups:
              # Fallback to appending details if no HTML (or if failed)
             content_items.append("\n[Comprehensive Content Backup]\n")
+
+            # 平行轉存所有 og:image 至 Drive；單張失敗只會略過該圖片
+            hosted_images = self.image_stage.rehost([meta.get("image") for meta in url_backups])
             
             for meta in url_backups:
                 # Title as Link
@@ -155,26 +161,15 @@ class SaveService:
                 
                 content_items.append(details)
                 
-                if meta.get("image"):
-                    content_items.append({"type": "image", "uri": meta["image"]})
+                if hosted_images.get(meta.get("image")):
+                    content_items.append({"type": "image", "uri": hosted_images[meta["image"]]})
                 
                 content_items.append("\n") # Spacer between backups
 
         file_link = None
-        if file_content:
-            # 使用產生的 title 作為檔案名稱的主體，並保留副檔名
-            ext = ""
-            if filename and "." in filename:
-                ext = "." + filename.split(".")[-1]
-            elif content_type == "image": ext = ".jpg"
-            elif content_type == "video": ext = ".mp4"
-            elif content_type == "audio": ext = ".m4a"
-            
-            target_filename = f"{title}{ext}"
-            
+        if file_content is not None:
             # Upload media file first
-            mime_type = self._get_mime_type(content_type, filename)
-            file_link = self.gdrive.upload_file(file_content, target_filename, mime_type)
+            file_link = self.upload_media(title, content_type, file_content, filename)
             content_items.append(f"- GDrive File Link: {file_link}")
 
         # 優化：如果是純媒體檔案（沒有額外描述），直接回傳檔案連結，不建立 Doc
@@ -184,67 +179,162 @@ class SaveService:
 
         # Determine strategy: New Doc
         # Pass html_content if available
-        doc_link = self.gdrive.create_doc(title, content_items, html_content=combined_html if has_html_backup else None)
+        try:
+            doc_link = self.gdrive.create_doc(title, content_items, html_content=combined_html)
+        finally:
+            if combined_html is not None:
+                combined_html.close()
         return doc_link
 
+    def process_journal_save(self,
+                             platform: str,
+                             context: str,
+                             content_type: str,
+                             text: Optional[str] = None,
+                             file_content: Optional[Union[bytes, IO[bytes]]] = None,
+                             filename: Optional[str] = None,
+                             chat_id: Optional[str] = None) -> str:
+        """
+        Journal mode: append the entry to the chat's rolling Doc for today
+        instead of creating a new Doc. Media is still uploaded as its own file.
+        """
+        print(f"📓 [Service] 寫入日誌: Type={content_type}, Context={context}", flush=True)
+        lines = [f"[{datetime.datetime.now().strftime('%H:%M:%S')}] {platform} {content_type.capitalize()}"]
+        if text:
+            lines.append(text)
+        if file_content is not None:
+            title = self.generate_title(text, content_type)
+            lines.append(f"- GDrive File Link: {self.upload_media(title, content_type, file_content, filename)}")
+        return self.journal.append(chat_id or context, context, "\n".join(lines))
+
+    def upload_media(self,
+                     title: str,
+                     content_type: str,
+                     file_content: Union[bytes, IO[bytes]],
+                     filename: Optional[str] = None) -> str:
+        """上傳媒體檔案，使用 title 作為檔名主體並保留副檔名"""
+        target_filename = f"{title}{guess_extension(content_type, filename)}"
+        mime_type = self._get_mime_type(content_type, filename)
+        return self.gdrive.upload_file(file_content, target_filename, mime_type)
+
+    def process_batch_save(self,
+                           platform: str,
+                           context: str,
+                           entries: List[Dict[str, Any]],
+                           user_title: Optional[str] = None) -> str:
+        """
+        Builds one aggregated Doc for a batch of messages.
+        Each entry is {"type", "text"} or {"type", "link"} (media already uploaded).
+        """
+        print(f"💾 [Service] 正在建立批次備份: {len(entries)} 則訊息, Context={context}", flush=True)
+        title = self.generate_title(user_title or f"{len(entries)} messages", "batch")
+        timestamp = datetime.datetime.now().isoformat()
+
+        content_items: List[Union[str, Dict[str, Any]]] = [(
+            f"Title: {title}\n\n"
+            f"Source:\n"
+            f"- Platform: {platform}\n"
+            f"- Chat Context: {context}\n"
+            f"- Timestamp: {timestamp}\n"
+            f"- Messages: {len(entries)}\n\n"
+            f"Content:"
+        )]
+        for i, entry in enumerate(entries, start=1):
+            content_items.append(f"[{i}] {entry['type'].capitalize()}")
+            if entry.get("link"):
+                content_items.append(f"- GDrive File Link: {entry['link']}")
+            elif entry.get("text"):
+                urls = list(dict.fromkeys(re.findall(r'https?://[^\s]+', entry["text"])))
+                content_items.extend(self._paragraph_items(entry["text"], urls))
+
+        return self.gdrive.create_doc(title, content_items)
+
+    def _paragraph_items(self, text: str, urls: List[str]) -> List[Dict[str, Any]]:
+        """
+        重建段落並讓 URL 可點擊。GDriveClient 以閱讀順序接收 inline 項目
+        ('newline': False)，段落最後一項才換行。
+        """
+        paragraph_items = []
+        for part in re.split(r'(https?://[^\s]+)', text):
+            if not part: continue
+            if part in urls:
+                paragraph_items.append({"type": "link", "text": part, "url": part, "newline": False})
+            else:
+                paragraph_items.append({"type": "text", "text": part, "newline": False})
+
+        # Add a newline at the end of the paragraph
+        if paragraph_items:
+            paragraph_items[-1]['newline'] = True
+        return paragraph_items
+
+    def _iter_html_parts(self, html_chunks: List[str]) -> Iterator[str]:
+        """依序產生要寫入的 HTML 片段 (包含外層標籤與分隔線)"""
+        for i, chunk in enumerate(html_chunks):
+            if i > 0:
+                yield "<br><hr><br>" # Separator
+            yield chunk
+
+    def _compose_html(self, html_chunks: List[str]) -> IO[bytes]:
+        """
+        將 HTML 片段逐一編碼寫入 SpooledTemporaryFile (小的留在記憶體，大的落地磁碟)。
+        總大小超過 max_html_bytes 時截斷，並附上說明。
+        """
+        buffer = tempfile.SpooledTemporaryFile(max_size=HTML_SPOOL_BYTES)
+        buffer.write(HTML_HEADER)
+        budget = self.max_html_bytes - len(HTML_HEADER) - len(HTML_FOOTER)
+        for part in self._iter_html_parts(html_chunks):
+            data = part.encode('utf-8')
+            if len(data) > budget:
+                # 在 UTF-8 字元邊界截斷
+                buffer.write(_utf8_prefix(data, budget))
+                buffer.write(HTML_TRUNCATED_NOTE.format(limit_mb=round(self.max_html_bytes / (1024 * 1024), 1)).encode('utf-8'))
+                print(f"✂️ [Service] HTML 備份超過 {self.max_html_bytes} bytes，已截斷", flush=True)
+                break
+            buffer.write(data)
+            budget -= len(data)
+        buffer.write(HTML_FOOTER)
+        buffer.seek(0)
+        return buffer
+
     def _fetch_url_content(self, url: str) -> Dict[str, Any]:
         """嘗試抓取網址的 Title, Description, Image 以及完整的 HTML 內容 (用於原生轉換)"""
         summary = {"title": "", "description": "", "image": "", "html_content": ""}
+        # 網域斷路中或網址最近失敗過：直接略過，不再等待逾時
+        allowed, reason = self.link_health.allow(url)
+        if not allowed:
+            print(f"⏭️ [Service] 略過網址備份 ({reason}): {url[:60]}", flush=True)
+            return summary
+
         try:
             headers = {
                 'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
             }
-            response = requests.get(url, headers=headers, timeout=15)
-            response.encoding = response.apparent_encoding
-            
-            if response.status_code == 200:
-                soup = BeautifulSoup(response.text, 'html.parser')
-                
-                # Title
-                og_title = soup.find("meta", property="og:title")
-                summary["title"] = og_title["content"] if og_title else (soup.title.string.strip() if soup.title else "")
-                
-                # Description
-                og_desc = soup.find("meta", property="og:description")
-                summary["description"] = og_desc["content"] if og_desc else ""
-                
-                # Image
-                og_image = soup.find("meta", property="og:image")
-                content = og_image.get("content") if og_image else ""
-                if content and not content.startswith("http"):
-                    from urllib.parse import urljoin
-                    content = urljoin(url, content)
-                summary["image"] = content
-                
-                # Cleanup for HTML Conversion
-                # We want to keep formatting (tables, bold, etc) but remove junk.
-                for tag in soup(["script", "style", "nav", "footer", "header", "noscript", "iframe", "aside"]):
-                    tag.decompose()
-                
-                # Isolate Main Content
-                main_content = soup.find('main') or soup.find('article') or soup.body
-                
-                if main_content:
-                    # Simplify some attributes to avoid import errors or weird formatting
-                    for tag in main_content.find_all(True):
-                        # Remove event handlers
-                        attrs = dict(tag.attrs)
-                        for attr in attrs:
-                            if attr.startswith('on'):
-                                del tag.attrs[attr]
-                                
-                    summary["html_content"] = str(main_content)
-                else:
-                    summary["html_content"] = "<div>No main content found</div>"
-                
-                return summary
+            start = time.monotonic()
+            # 串流讀取並限制大小，超大頁面不會整份載入記憶體
+            with requests.get(url, headers=headers, timeout=self.link_health.timeout_for(url), stream=True) as response:
+                if response.status_code != 200:
+                    self.link_health.record_failure(url, status=response.status_code)
+                    print(f"⚠️ [Service] 抓取網址備份失敗: HTTP {response.status_code}", flush=True)
+                    return summary
+                raw = bytearray()
+                for chunk in response.iter_content(chunk_size=FETCH_CHUNK_BYTES):
+                    raw.extend(chunk)
+                    if len(raw) >= self.max_fetch_bytes:
+                        del raw[self.max_fetch_bytes:]
+                        print(f"✂️ [Service] 網頁超過 {self.max_fetch_bytes} bytes，只解析前段: {url[:60]}", flush=True)
+                        break
+            self.link_health.record_success(url, time.monotonic() - start)
         except Exception as e:
+            self.link_health.record_failure(url)
             print(f"⚠️ [Service] 抓取網址備份失敗: {e}", flush=True)
+            return summary
+
+        try:
+            # 解析與清理交給 HTML 解析行程 (小頁面直接在本執行緒處理)
+            return self.html_parser.parse(bytes(raw), url)
+        except Exception as e:
+            print(f"⚠️ [Service] 解析網址內容失敗: {e}", flush=True)
         return summary
 
     def _get_mime_type(self, content_type: str, filename: Optional[str]) -> str:
-        if content_type == "image":
-            return "image/jpeg"
-        if content_type == "video":
-            return "video/mp4"
-        return "application/octet-stream"
+        return guess_mime(content_type, filename)
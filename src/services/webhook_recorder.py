@@ -0,0 +1,124 @@
+import os
+import hmac
+import json
+import hashlib
+import secrets
+import threading
+from typing import Any, Iterable, Iterator, Optional, Tuple
+
+# 預設遮蔽的欄位 (訊息內容、檔名、地址、一次性 token)
+DEFAULT_MASK_FIELDS = ("text", "fileName", "title", "address", "replyToken", "quoteToken")
+# 預設雜湊的 ID 欄位 (同一錄製檔內對應一致，重播時仍保留每個聊天的流量形狀)
+DEFAULT_HASH_FIELDS = ("userId", "groupId", "roomId")
+
+
+def _env_fields(name: str, default: Tuple[str, ...]) -> Tuple[str, ...]:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    if value.strip().lower() in ("", "none"):
+        return ()
+    return tuple(field.strip() for field in value.split(",") if field.strip())
+
+
+class WebhookRecorder:
+    """
+    Append-only recorder of verified webhook bodies for load replay.
+
+    Each line is one compact JSON record: {"t": receive time (unix seconds),
+    "b": the redacted payload}. Masked fields keep their length (and a
+    leading /command, so replays still exercise commands); hashed ID
+    fields map to stable pseudonyms so per-chat ordering survives.
+    Recording stops once the file reaches `max_bytes`.
+    """
+    def __init__(self,
+                 path: str,
+                 mask_fields: Iterable[str] = DEFAULT_MASK_FIELDS,
+                 hash_fields: Iterable[str] = DEFAULT_HASH_FIELDS,
+                 salt: Optional[str] = None,
+                 max_bytes: int = 512 * 1024 * 1024):
+        self.path = path
+        self.mask_fields = frozenset(mask_fields)
+        self.hash_fields = frozenset(hash_fields)
+        self.max_bytes = max_bytes
+        self._salt = (salt or secrets.token_hex(16)).encode()
+        self._lock = threading.Lock()
+        self._file = open(path, "a", encoding="utf-8")
+        self._size = self._file.tell()
+        self.recorded = 0
+        print(f"🎙️ [Record] Webhook 錄製中: {path}", flush=True)
+
+    @classmethod
+    def from_env(cls) -> Optional["WebhookRecorder"]:
+        """WEBHOOK_RECORD_PATH 未設定時不錄製 (回傳 None)"""
+        path = os.getenv("WEBHOOK_RECORD_PATH")
+        if not path:
+            return None
+        return cls(
+            path,
+            mask_fields=_env_fields("WEBHOOK_RECORD_REDACT", DEFAULT_MASK_FIELDS),
+            hash_fields=_env_fields("WEBHOOK_RECORD_HASH", DEFAULT_HASH_FIELDS),
+            salt=os.getenv("WEBHOOK_RECORD_SALT") or None,
+            max_bytes=int(float(os.getenv("WEBHOOK_RECORD_MAX_MB", 512)) * 1024 * 1024)
+        )
+
+    def record(self, body: str, received_at: float):
+        """錄製失敗只記錄警告，不影響 Webhook 回應"""
+        try:
+            line = json.dumps(
+                {"t": round(received_at, 3), "b": self.redact(json.loads(body))},
+                ensure_ascii=False, separators=(",", ":")
+            ) + "\n"
+        except Exception as e:
+            print(f"⚠️ [Record] 無法錄製 Webhook: {e}", flush=True)
+            return
+        with self._lock:
+            if self._file.closed:
+                return
+            size = len(line.encode("utf-8"))
+            if self._size + size > self.max_bytes:
+                print(f"🛑 [Record] 錄製檔已達上限 {self.max_bytes // (1024 * 1024)} MB，停止錄製", flush=True)
+                self._file.close()
+                return
+            self._file.write(line)
+            self._file.flush()
+            self._size += size
+            self.recorded += 1
+
+    def redact(self, value: Any, key: Optional[str] = None) -> Any:
+        if isinstance(value, dict):
+            return {k: self.redact(v, k) for k, v in value.items()}
+        if isinstance(value, list):
+            return [self.redact(v, key) for v in value]
+        if key in self.hash_fields and isinstance(value, str):
+            digest = hmac.new(self._salt, value.encode(), hashlib.sha256).hexdigest()[:32]
+            return f"{value[:1]}{digest}"
+        if key in self.mask_fields:
+            return self._mask(value)
+        return value
+
+    @staticmethod
+    def _mask(value: Any) -> Any:
+        if not isinstance(value, str):
+            return None if not isinstance(value, (int, float)) else 0
+        # 保留指令名稱 (例如 /save)，其餘以等長的 x 取代
+        if value.startswith("/"):
+            command, sep, rest = value.partition(" ")
+            return command + sep + "x" * len(rest)
+        return "x" * len(value)
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+
+def iter_recording(path: str) -> Iterator[Tuple[float, dict]]:
+    """依序讀出 (接收時間, Payload)；略過寫到一半的最後一行"""
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            yield record["t"], record["b"]
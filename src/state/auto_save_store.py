@@ -0,0 +1,164 @@
+import os
+import json
+import tempfile
+import threading
+from typing import Dict, Optional
+from .backend import StateBackend
+
+
+def snapshot_path_from_env() -> str:
+    """AUTO_SAVE_SNAPSHOT_PATH；未設定時放在 SQLite 狀態檔 (STATE_DB_PATH) 旁"""
+    path = os.getenv("AUTO_SAVE_SNAPSHOT_PATH")
+    if path:
+        return path
+    state_dir = os.path.dirname(os.getenv("STATE_DB_PATH", "bot_state.db"))
+    return os.path.join(state_dir, "auto_save_settings.json")
+
+
+class AutoSaveSettings:
+    """
+    Per-user auto-save flags kept in the shared state backend,
+    so every worker process sees the same /auto_save toggle.
+
+    Reads are served from an in-memory map (checked on every message).
+    Toggles update memory immediately and are written behind in batches
+    by a background thread, which also refreshes the map from the backend
+    and writes an atomic JSON snapshot for backup / migration.
+    """
+    HASH_NAME = "auto_save"
+
+    def __init__(self,
+                 backend: StateBackend,
+                 legacy_file: Optional[str] = None,
+                 flush_interval: float = 1.0,
+                 refresh_interval: float = 5.0,
+                 snapshot_interval: float = 60.0):
+        self.backend = backend
+        self.snapshot_file = legacy_file
+        self.flush_interval = flush_interval
+        self.refresh_interval = refresh_interval
+        self.snapshot_interval = snapshot_interval
+
+        self._lock = threading.Lock()
+        self._pending: Dict[str, str] = {}
+        self._snapshot_dirty = False
+        self._import_legacy_file(legacy_file)
+        self._cache: Dict[str, str] = self.backend.hgetall(self.HASH_NAME)
+
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _import_legacy_file(self, legacy_file: Optional[str]):
+        # 舊版設定存在本地 JSON，首次啟動時匯入一次
+        if not legacy_file or not os.path.exists(legacy_file):
+            return
+        if self.backend.hgetall(self.HASH_NAME):
+            return
+        try:
+            with open(legacy_file, 'r') as f:
+                legacy = json.load(f)
+            self.backend.hset_many(self.HASH_NAME, {
+                user_id: "1" if enabled else "0" for user_id, enabled in legacy.items()
+            })
+            print(f"🗄️ [State] 已匯入舊版 auto_save 設定 ({len(legacy)} 筆)", flush=True)
+        except Exception as e:
+            print(f"⚠️ [State] 匯入舊版 auto_save 設定失敗: {e}", flush=True)
+
+    def get(self, user_id: str, default: bool = False) -> bool:
+        value = self._cache.get(user_id)
+        if value is None:
+            return default
+        return value == "1"
+
+    def set(self, user_id: str, enabled: bool) -> None:
+        value = "1" if enabled else "0"
+        with self._lock:
+            self._cache[user_id] = value
+            self._pending[user_id] = value
+        if self._thread is None:
+            # 未啟動背景執行緒時 (例如腳本或測試) 直接寫入
+            self.flush()
+
+    def start(self):
+        """啟動 write-behind 背景執行緒"""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="auto-save-flusher", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """停止背景執行緒，並確保所有變更都已寫入"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self.flush()
+        self.write_snapshot()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        try:
+            self.backend.hset_many(self.HASH_NAME, pending)
+            self._snapshot_dirty = True
+        except Exception as e:
+            # 寫入失敗時放回待寫入佇列，下次再試 (較新的變更優先)
+            print(f"⚠️ [State] auto_save 設定寫入失敗: {e}", flush=True)
+            with self._lock:
+                self._pending = {**pending, **self._pending}
+
+    def refresh(self):
+        """從共享後端重新載入 (取得其他 worker 的變更)"""
+        latest = self.backend.hgetall(self.HASH_NAME)
+        with self._lock:
+            latest.update(self._pending)
+            self._cache = latest
+
+    def write_snapshot(self):
+        """以暫存檔 + os.replace 原子性地輸出 JSON 快照"""
+        if not self.snapshot_file or not self._snapshot_dirty:
+            return
+        self._snapshot_dirty = False
+        with self._lock:
+            data = {user_id: value == "1" for user_id, value in self._cache.items()}
+        directory = os.path.dirname(os.path.abspath(self.snapshot_file))
+        fd, tmp_path = tempfile.mkstemp(prefix=".auto_save_", suffix=".tmp", dir=directory)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(data, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.snapshot_file)
+        except Exception as e:
+            print(f"⚠️ [State] auto_save 快照寫入失敗: {e}", flush=True)
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _run(self):
+        since_refresh = 0.0
+        since_snapshot = 0.0
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+            since_refresh += self.flush_interval
+            since_snapshot += self.flush_interval
+            try:
+                if since_refresh >= self.refresh_interval:
+                    since_refresh = 0.0
+                    self.refresh()
+                if since_snapshot >= self.snapshot_interval:
+                    since_snapshot = 0.0
+                    self.write_snapshot()
+            except Exception as e:
+                print(f"⚠️ [State] auto_save 背景同步失敗: {e}", flush=True)
+
+
+class JournalSettings(AutoSaveSettings):
+    """Per-chat /journal flags (same write-behind store, separate hash)."""
+    HASH_NAME = "journal"
+
+    def __init__(self, backend: StateBackend, **kwargs):
+        kwargs.setdefault("legacy_file", None)
+        super().__init__(backend, **kwargs)
@@ -0,0 +1,526 @@
+import os
+import re
+import time
+import uuid
+import sqlite3
+import hashlib
+import threading
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class StateBackend(ABC):
+    """
+    Abstract shared-state store.
+    Everything that must be consistent across uvicorn workers / replicas
+    (auto-save flags, quoted message IDs, dedup keys, job queues) goes through here.
+    All values are plain strings; callers encode structured data themselves.
+    """
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[str]:
+        pass
+
+    @abstractmethod
+    def set(self, key: str, value: str, ttl: Optional[float] = None) -> None:
+        pass
+
+    @abstractmethod
+    def set_if_absent(self, key: str, value: str, ttl: Optional[float] = None) -> bool:
+        """
+        Atomically stores the key only if it does not exist yet.
+        Returns True if this caller created the key.
+        """
+        pass
+
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        pass
+
+    @abstractmethod
+    def incr(self, key: str, amount: int = 1) -> int:
+        pass
+
+    @abstractmethod
+    def hget(self, name: str, field: str) -> Optional[str]:
+        pass
+
+    @abstractmethod
+    def hset(self, name: str, field: str, value: str) -> None:
+        pass
+
+    @abstractmethod
+    def hgetall(self, name: str) -> Dict[str, str]:
+        pass
+
+    @abstractmethod
+    def hset_many(self, name: str, mapping: Dict[str, str]) -> None:
+        """
+        Writes several fields of a hash in one round trip / transaction.
+        """
+        pass
+
+    @abstractmethod
+    def enqueue(self, queue: str, item: str) -> None:
+        pass
+
+    @abstractmethod
+    def dequeue(self, queue: str, timeout: float = 0) -> Optional[str]:
+        """
+        Pops the oldest item of the queue, waiting up to `timeout` seconds.
+        Returns None if the queue stayed empty.
+        """
+        pass
+
+    @abstractmethod
+    def claim(self, queue: str, timeout: float = 0, visibility: float = 300) -> Optional[Tuple[str, str]]:
+        """
+        Takes the oldest item of the queue without removing it, waiting up
+        to `timeout` seconds. Returns (receipt, item), or None if the queue
+        stayed empty. Until ack(queue, receipt) the item is hidden from
+        other consumers; if it is not acknowledged within `visibility`
+        seconds (e.g. the worker crashed) it is delivered again.
+        """
+        pass
+
+    @abstractmethod
+    def ack(self, queue: str, receipt: str) -> None:
+        """Removes a claimed item for good."""
+        pass
+
+    @abstractmethod
+    def queue_length(self, queue: str) -> int:
+        """Number of items waiting (claimed items are not counted)."""
+        pass
+
+    @abstractmethod
+    def append_capped(self, name: str, item: str, maxlen: int, ttl: Optional[float] = None) -> None:
+        """
+        Appends to a bounded list, dropping the oldest items beyond `maxlen`.
+        `ttl` (if given) refreshes the expiry of the whole list.
+        """
+        pass
+
+    @abstractmethod
+    def tail(self, name: str, count: int) -> List[str]:
+        """
+        Returns the newest `count` items of a list, oldest first.
+        """
+        pass
+
+    def close(self) -> None:
+        """釋放連線 (預設無動作)"""
+        pass
+
+
+class SQLiteStateBackend(StateBackend):
+    """
+    Single-node backend. One SQLite file in WAL mode is shared by every
+    worker process on the same machine.
+    """
+    _POLL_INTERVAL = 0.1
+    # 每寫入幾次 TTL key 就清除一次過期資料，讓 kv 表維持有界
+    _PURGE_EVERY = 500
+
+    def __init__(self, path: str = "bot_state.db"):
+        self.path = path
+        self._lock = threading.Lock()
+        self._ttl_writes = 0
+        # 多進程同時寫入時等待鎖而不是直接報錯
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS kv (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                expires_at REAL
+            );
+            CREATE TABLE IF NOT EXISTS hashes (
+                name TEXT NOT NULL,
+                field TEXT NOT NULL,
+                value TEXT NOT NULL,
+                PRIMARY KEY (name, field)
+            );
+            CREATE TABLE IF NOT EXISTS queues (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                value TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_queues_name ON queues (name, id);
+            CREATE TABLE IF NOT EXISTS lists (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                value TEXT NOT NULL,
+                expires_at REAL
+            );
+            CREATE INDEX IF NOT EXISTS idx_lists_name ON lists (name, id);
+        """)
+        # 舊版資料庫沒有 claimed_until 欄位 (claim/ack 的可見性逾時)
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(queues)")}
+        if "claimed_until" not in columns:
+            self._conn.execute("ALTER TABLE queues ADD COLUMN claimed_until REAL")
+
+    def _expiry(self, ttl: Optional[float]) -> Optional[float]:
+        if not ttl:
+            return None
+        self._ttl_writes += 1
+        if self._ttl_writes % self._PURGE_EVERY == 0:
+            self.purge_expired()
+        return time.time() + ttl
+
+    def purge_expired(self) -> int:
+        """刪除已過期的 key 與清單，回傳刪除筆數"""
+        now = time.time()
+        with self._lock:
+            cur = self._conn.execute("DELETE FROM kv WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))
+            removed = cur.rowcount
+            cur = self._conn.execute("DELETE FROM lists WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))
+        return removed + cur.rowcount
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM kv WHERE key = ?", (key,)
+            ).fetchone()
+        if not row:
+            return None
+        value, expires_at = row
+        if expires_at is not None and expires_at <= time.time():
+            return None
+        return value
+
+    def set(self, key: str, value: str, ttl: Optional[float] = None) -> None:
+        expires_at = self._expiry(ttl)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, expires_at)
+            )
+
+    def set_if_absent(self, key: str, value: str, ttl: Optional[float] = None) -> bool:
+        expires_at = self._expiry(ttl)
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                # 過期的 key 視為不存在
+                self._conn.execute(
+                    "DELETE FROM kv WHERE key = ? AND expires_at IS NOT NULL AND expires_at <= ?",
+                    (key, now)
+                )
+                cur = self._conn.execute(
+                    "INSERT OR IGNORE INTO kv (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, value, expires_at)
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return cur.rowcount == 1
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM kv WHERE key = ?", (key,))
+
+    def incr(self, key: str, amount: int = 1) -> int:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute("SELECT value FROM kv WHERE key = ?", (key,)).fetchone()
+                value = int(row[0]) + amount if row else amount
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, NULL)",
+                    (key, str(value))
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return value
+
+    def hget(self, name: str, field: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM hashes WHERE name = ? AND field = ?", (name, field)
+            ).fetchone()
+        return row[0] if row else None
+
+    def hset(self, name: str, field: str, value: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO hashes (name, field, value) VALUES (?, ?, ?)",
+                (name, field, value)
+            )
+
+    def hgetall(self, name: str) -> Dict[str, str]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT field, value FROM hashes WHERE name = ?", (name,)
+            ).fetchall()
+        return dict(rows)
+
+    def hset_many(self, name: str, mapping: Dict[str, str]) -> None:
+        if not mapping:
+            return
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO hashes (name, field, value) VALUES (?, ?, ?)",
+                    [(name, field, value) for field, value in mapping.items()]
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def enqueue(self, queue: str, item: str) -> None:
+        with self._lock:
+            self._conn.execute("INSERT INTO queues (name, value) VALUES (?, ?)", (queue, item))
+
+    def _pop(self, queue: str, visibility: Optional[float] = None) -> Optional[Tuple[int, str]]:
+        """取出最舊且未被領取 (或領取已逾時) 的項目；visibility 為 None 時直接刪除"""
+        now = time.time()
+        select = (
+            "SELECT id, value FROM queues WHERE name = ? AND (claimed_until IS NULL OR claimed_until <= ?) "
+            "ORDER BY id LIMIT 1"
+        )
+        with self._lock:
+            # 先以一般讀取確認有候選項目；佇列空著時輪詢不必搶 SQLite 的寫入鎖
+            if self._conn.execute(select, (queue, now)).fetchone() is None:
+                return None
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                # 取得寫入鎖後重新查詢，候選項目可能已被其他 worker 取走
+                row = self._conn.execute(select, (queue, now)).fetchone()
+                if row and visibility is None:
+                    self._conn.execute("DELETE FROM queues WHERE id = ?", (row[0],))
+                elif row:
+                    self._conn.execute("UPDATE queues SET claimed_until = ? WHERE id = ?", (now + visibility, row[0]))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return row
+
+    def _poll(self, queue: str, timeout: float, visibility: Optional[float]) -> Optional[Tuple[int, str]]:
+        deadline = time.monotonic() + timeout
+        while True:
+            row = self._pop(queue, visibility)
+            if row is not None or time.monotonic() >= deadline:
+                return row
+            time.sleep(self._POLL_INTERVAL)
+
+    def dequeue(self, queue: str, timeout: float = 0) -> Optional[str]:
+        row = self._poll(queue, timeout, None)
+        return row[1] if row else None
+
+    def claim(self, queue: str, timeout: float = 0, visibility: float = 300) -> Optional[Tuple[str, str]]:
+        row = self._poll(queue, timeout, visibility)
+        return (str(row[0]), row[1]) if row else None
+
+    def ack(self, queue: str, receipt: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM queues WHERE id = ? AND name = ?", (int(receipt), queue))
+
+    def queue_length(self, queue: str) -> int:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT COUNT(*) FROM queues WHERE name = ? AND (claimed_until IS NULL OR claimed_until <= ?)",
+                (queue, time.time())
+            ).fetchone()
+        return row[0]
+
+    def append_capped(self, name: str, item: str, maxlen: int, ttl: Optional[float] = None) -> None:
+        expires_at = self._expiry(ttl)
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "INSERT INTO lists (name, value, expires_at) VALUES (?, ?, ?)", (name, item, expires_at)
+                )
+                self._conn.execute("UPDATE lists SET expires_at = ? WHERE name = ?", (expires_at, name))
+                self._conn.execute(
+                    "DELETE FROM lists WHERE name = ? AND id NOT IN "
+                    "(SELECT id FROM lists WHERE name = ? ORDER BY id DESC LIMIT ?)",
+                    (name, name, maxlen)
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def tail(self, name: str, count: int) -> List[str]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT value FROM lists WHERE name = ? AND (expires_at IS NULL OR expires_at > ?) "
+                "ORDER BY id DESC LIMIT ?",
+                (name, time.time(), count)
+            ).fetchall()
+        return [row[0] for row in reversed(rows)]
+
+    def close(self) -> None:
+        # 取得鎖後再關閉，避免其他執行緒仍在使用連線
+        with self._lock:
+            self._conn.close()
+
+
+class RedisStateBackend(StateBackend):
+    """
+    Multi-node backend on top of any redis-py compatible client
+    (redis.Redis, fakeredis, or a local stand-in in tests).
+    """
+
+    # 檢查領取逾時項目的最短間隔 (秒)
+    REQUEUE_INTERVAL = 5.0
+    # 佇列項目的外層格式: "<32 位 hex ID>:<內容>"
+    _ENVELOPE = re.compile(r"^([0-9a-f]{32}):", re.DOTALL)
+
+    def __init__(self, client: Any, prefix: str = "chatsave:"):
+        self.client = client
+        self.prefix = prefix
+        self._last_requeue: Dict[str, float] = {}
+
+    @classmethod
+    def from_url(cls, url: str, prefix: str = "chatsave:") -> "RedisStateBackend":
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("STATE_BACKEND=redis 需要安裝 redis 套件 (pip install redis)")
+        return cls(redis.Redis.from_url(url), prefix=prefix)
+
+    def _k(self, key: str) -> str:
+        return self.prefix + key
+
+    @staticmethod
+    def _decode(value: Any) -> Optional[str]:
+        if value is None:
+            return None
+        return value.decode('utf-8') if isinstance(value, bytes) else str(value)
+
+    @staticmethod
+    def _px(ttl: Optional[float]) -> Optional[int]:
+        return max(1, int(ttl * 1000)) if ttl else None
+
+    def get(self, key: str) -> Optional[str]:
+        return self._decode(self.client.get(self._k(key)))
+
+    def set(self, key: str, value: str, ttl: Optional[float] = None) -> None:
+        self.client.set(self._k(key), value, px=self._px(ttl))
+
+    def set_if_absent(self, key: str, value: str, ttl: Optional[float] = None) -> bool:
+        return bool(self.client.set(self._k(key), value, nx=True, px=self._px(ttl)))
+
+    def delete(self, key: str) -> None:
+        self.client.delete(self._k(key))
+
+    def incr(self, key: str, amount: int = 1) -> int:
+        return int(self.client.incrby(self._k(key), amount))
+
+    def hget(self, name: str, field: str) -> Optional[str]:
+        return self._decode(self.client.hget(self._k(name), field))
+
+    def hset(self, name: str, field: str, value: str) -> None:
+        self.client.hset(self._k(name), field, value)
+
+    def hgetall(self, name: str) -> Dict[str, str]:
+        raw = self.client.hgetall(self._k(name)) or {}
+        return {self._decode(k): self._decode(v) for k, v in raw.items()}
+
+    def hset_many(self, name: str, mapping: Dict[str, str]) -> None:
+        if mapping:
+            self.client.hset(self._k(name), mapping=mapping)
+
+    def enqueue(self, queue: str, item: str) -> None:
+        # 每個項目加上唯一 ID，內容相同的項目也能個別領取 / 確認
+        self.client.rpush(self._k(queue), f"{uuid.uuid4().hex}:{item}")
+
+    @classmethod
+    def _unwrap(cls, envelope: str) -> Tuple[str, str]:
+        """外層格式 -> (ID, 內容)；舊版沒有 ID 的項目以內容雜湊當 ID"""
+        match = cls._ENVELOPE.match(envelope)
+        if match:
+            return match.group(1), envelope[match.end():]
+        return hashlib.sha1(envelope.encode('utf-8')).hexdigest(), envelope
+
+    def dequeue(self, queue: str, timeout: float = 0) -> Optional[str]:
+        if timeout <= 0:
+            envelope = self._decode(self.client.lpop(self._k(queue)))
+        else:
+            # BLPOP 的 timeout 為 0 代表永久等待，所以至少給 1 秒
+            result = self.client.blpop([self._k(queue)], timeout=max(1, int(timeout)))
+            envelope = self._decode(result[1]) if result else None
+        return self._unwrap(envelope)[1] if envelope is not None else None
+
+    def claim(self, queue: str, timeout: float = 0, visibility: float = 300) -> Optional[Tuple[str, str]]:
+        """
+        Reliable-queue pattern: the item is moved atomically to a
+        "<queue>:processing" list and a lease key expiring after
+        `visibility` is set. Items whose lease is gone (worker crashed,
+        or died between the move and the lease) are pushed back.
+        """
+        self._requeue_expired(queue)
+        source, processing = self._k(queue), self._k(f"{queue}:processing")
+        if timeout <= 0:
+            item = self.client.lmove(source, processing, "LEFT", "RIGHT")
+        else:
+            item = self.client.blmove(source, processing, max(1, int(timeout)), "LEFT", "RIGHT")
+        envelope = self._decode(item)
+        if envelope is None:
+            return None
+        item_id, item = self._unwrap(envelope)
+        self.client.set(self._lease_key(queue, item_id), "1", px=self._px(visibility))
+        # receipt 為帶 ID 的完整項目：LREM 只會移除這一筆
+        return envelope, item
+
+    def ack(self, queue: str, receipt: str) -> None:
+        self.client.lrem(self._k(f"{queue}:processing"), 1, receipt)
+        self.client.delete(self._lease_key(queue, self._unwrap(receipt)[0]))
+
+    def _lease_key(self, queue: str, item_id: str) -> str:
+        return self._k(f"{queue}:lease:{item_id}")
+
+    def _requeue_expired(self, queue: str):
+        now = time.monotonic()
+        if now - self._last_requeue.get(queue, 0.0) < self.REQUEUE_INTERVAL:
+            return
+        self._last_requeue[queue] = now
+        processing = self._k(f"{queue}:processing")
+        for raw in self.client.lrange(processing, 0, -1):
+            envelope = self._decode(raw)
+            if self.client.get(self._lease_key(queue, self._unwrap(envelope)[0])) is not None:
+                continue
+            # LREM 成功的 worker 才放回佇列，避免多個 worker 重複放回
+            if self.client.lrem(processing, 1, envelope):
+                print(f"🔁 [State] 佇列 {queue} 的項目領取逾時，重新排入", flush=True)
+                self.client.lpush(self._k(queue), envelope)
+
+    def queue_length(self, queue: str) -> int:
+        return int(self.client.llen(self._k(queue)))
+
+    def append_capped(self, name: str, item: str, maxlen: int, ttl: Optional[float] = None) -> None:
+        key = self._k(name)
+        self.client.rpush(key, item)
+        self.client.ltrim(key, -maxlen, -1)
+        if ttl:
+            self.client.pexpire(key, self._px(ttl))
+
+    def tail(self, name: str, count: int) -> List[str]:
+        return [self._decode(v) for v in self.client.lrange(self._k(name), -count, -1)]
+
+    def close(self) -> None:
+        if hasattr(self.client, 'close'):
+            self.client.close()
+
+
+def create_state_backend() -> StateBackend:
+    """依環境變數建立共享狀態後端 (STATE_BACKEND=sqlite|redis)"""
+    kind = os.getenv("STATE_BACKEND", "sqlite").lower()
+    if kind == "redis":
+        url = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+        print(f"🗄️ [State] 使用 Redis 共享狀態: {url}", flush=True)
+        return RedisStateBackend.from_url(url)
+    path = os.getenv("STATE_DB_PATH", "bot_state.db")
+    print(f"🗄️ [State] 使用 SQLite 共享狀態: {path}", flush=True)
+    return SQLiteStateBackend(path)
@@ -0,0 +1,51 @@
+import time
+import threading
+from collections import OrderedDict
+from .backend import StateBackend
+
+
+class EventDeduplicator:
+    """
+    Claim-once index for webhook events (keyed on webhookEventId / message id).
+
+    A bounded in-process TTL map answers repeats from this worker with a dict
+    lookup; the shared backend (set_if_absent with TTL) catches repeats that
+    land on another worker or node.
+    """
+    def __init__(self, backend: StateBackend, ttl: float = 24 * 3600, local_size: int = 10000):
+        self.backend = backend
+        self.ttl = ttl
+        self.local_size = local_size
+        self._seen: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _seen_locally(self, event_id: str) -> bool:
+        with self._lock:
+            expires_at = self._seen.get(event_id)
+            if expires_at is None:
+                return False
+            if expires_at <= time.monotonic():
+                del self._seen[event_id]
+                return False
+            return True
+
+    def _remember(self, event_id: str):
+        with self._lock:
+            self._seen[event_id] = time.monotonic() + self.ttl
+            self._seen.move_to_end(event_id)
+            while len(self._seen) > self.local_size:
+                self._seen.popitem(last=False)
+
+    def claim(self, event_id: str) -> bool:
+        """第一次看到此事件時回傳 True；重複 (或已被其他 worker 處理) 回傳 False"""
+        if self._seen_locally(event_id):
+            return False
+        claimed = self.backend.set_if_absent(f"event:{event_id}", "1", ttl=self.ttl)
+        self._remember(event_id)
+        return claimed
+
+    def release(self, event_id: str):
+        """處理失敗時釋放，讓 LINE 重送時可以再處理一次"""
+        with self._lock:
+            self._seen.pop(event_id, None)
+        self.backend.delete(f"event:{event_id}")
@@ -0,0 +1,39 @@
+import json
+from typing import Any, Dict, List, Optional
+from .backend import StateBackend
+
+
+class RecentMessages:
+    """
+    Short-lived, bounded log of message references per chat, used by
+    /save_batch (the Messaging API has no history endpoint).
+
+    Only what cannot be fetched later is kept: the message id and type,
+    plus the text / sticker / location payload. Media bytes are re-downloaded
+    by id when a batch is saved. Entries expire after `ttl` seconds.
+    """
+    def __init__(self, backend: StateBackend, limit: int = 50, ttl: float = 3600):
+        self.backend = backend
+        self.limit = limit
+        self.ttl = ttl
+
+    @staticmethod
+    def _key(chat_id: str) -> str:
+        return f"recent:{chat_id}"
+
+    def record(self, chat_id: str, ref: Dict[str, Any]):
+        if self.limit <= 0 or not chat_id:
+            return
+        self.backend.append_capped(self._key(chat_id), json.dumps(ref, ensure_ascii=False), self.limit, ttl=self.ttl)
+
+    def latest(self, chat_id: str, count: int) -> List[Dict[str, Any]]:
+        """最近 count 則訊息 (由舊到新)"""
+        if self.limit <= 0 or count <= 0:
+            return []
+        return [json.loads(item) for item in self.backend.tail(self._key(chat_id), min(count, self.limit))]
+
+    def find(self, chat_id: str, msg_id: str) -> Optional[Dict[str, Any]]:
+        for ref in self.latest(chat_id, self.limit):
+            if ref.get("id") == msg_id:
+                return ref
+        return None
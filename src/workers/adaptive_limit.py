@@ -0,0 +1,216 @@
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+
+# 視為過載的狀態碼 (限流與暫時性伺服器錯誤)
+OVERLOAD_STATUS = (429, 500, 502, 503, 504)
+# Google 以 403 回報的限流原因
+RATE_LIMIT_REASONS = ("rateLimitExceeded", "userRateLimitExceeded")
+
+
+def error_status(error: BaseException) -> Optional[int]:
+    """取得 HttpError (resp.status) 或 LineBotApiError (status_code) 的狀態碼"""
+    status = getattr(error, 'status_code', None)
+    if not isinstance(status, int):
+        status = getattr(getattr(error, 'resp', None), 'status', None)
+    try:
+        return int(status) if status is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def is_overload(error: BaseException) -> bool:
+    """限流、暫時性 5xx 與逾時代表下游已飽和；404 等一般錯誤不影響並行數"""
+    status = error_status(error)
+    if status in OVERLOAD_STATUS:
+        return True
+    if status == 403 and any(reason in str(error) for reason in RATE_LIMIT_REASONS):
+        return True
+    return isinstance(error, (TimeoutError, socket.timeout)) or "Timeout" in type(error).__name__
+
+
+class _SourceStats:
+    def __init__(self):
+        self.baseline: Optional[float] = None
+        self.latency: Optional[float] = None
+        self.samples = 0
+        self.errors = 0
+        self.overloads = 0
+
+
+class AdaptiveLimit:
+    """
+    AIMD limit on the number of backup jobs in flight.
+
+    Every Google Drive API call and LINE content request reports its
+    latency (or error) here, per source. The limit grows by 1/limit per
+    healthy sample while the pool is actually using it, and is multiplied
+    by `backoff` when a source is overloaded: 429 / 5xx / timeouts, or a
+    smoothed latency above `tolerance` x that source's no-load baseline.
+    Decreases are spaced by `cooldown` seconds so one burst of failing
+    requests counts as one congestion signal.
+    """
+    def __init__(self,
+                 min_limit: int = 2,
+                 max_limit: int = 10,
+                 initial: Optional[int] = None,
+                 backoff: float = 0.7,
+                 tolerance: float = 2.0,
+                 smoothing: float = 0.2,
+                 cooldown: float = 2.0):
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.backoff = backoff
+        self.tolerance = tolerance
+        self.smoothing = smoothing
+        self.cooldown = cooldown
+
+        start = initial if initial is not None else (self.min_limit + self.max_limit) // 2
+        self._limit = float(min(self.max_limit, max(self.min_limit, start)))
+        self._sources: Dict[str, _SourceStats] = {}
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+        # 目前執行中的任務數 (由排程器提供)；未用滿時不再調高上限
+        self.in_flight: Optional[Callable[[], int]] = None
+        # 上限改變時通知 (例如喚醒排程器的 worker)
+        self.listeners: List[Callable[[int], None]] = []
+
+    @classmethod
+    def from_env(cls, max_limit: int) -> Optional["AdaptiveLimit"]:
+        """ADAPTIVE_CONCURRENCY=false 時回傳 None (固定使用 max_limit)"""
+        if os.getenv("ADAPTIVE_CONCURRENCY", "true").lower() != "true":
+            return None
+        return cls(
+            min_limit=int(os.getenv("BACKUP_WORKERS_MIN", 2)),
+            max_limit=max_limit,
+            initial=int(os.getenv("BACKUP_WORKERS_INITIAL")) if os.getenv("BACKUP_WORKERS_INITIAL") else None
+        )
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    def record(self, source: str, latency: float, error: Optional[BaseException] = None):
+        old = self.limit
+        with self._lock:
+            stats = self._sources.setdefault(source, _SourceStats())
+            if error is not None:
+                stats.errors += 1
+                if is_overload(error):
+                    stats.overloads += 1
+                    self._decrease(source, f"{type(error).__name__} (status={error_status(error)})")
+            else:
+                self._observe_latency(source, stats, latency)
+        new = self.limit
+        if new != old:
+            for listener in self.listeners:
+                listener(new)
+
+    @contextmanager
+    def track(self, source: str):
+        """將區塊的耗時 (或例外) 記錄為一個樣本"""
+        started = time.monotonic()
+        try:
+            yield
+        except Exception as e:
+            self.record(source, time.monotonic() - started, e)
+            raise
+        self.record(source, time.monotonic() - started)
+
+    def _observe_latency(self, source: str, stats: _SourceStats, latency: float):
+        stats.samples += 1
+        if stats.baseline is None:
+            stats.baseline = stats.latency = latency
+            return
+        # 基準取近期最小值，並緩慢上移以適應下游本身變慢
+        stats.baseline = latency if latency < stats.baseline else stats.baseline + (latency - stats.baseline) * 0.01
+        stats.latency += (latency - stats.latency) * self.smoothing
+        if stats.latency > stats.baseline * self.tolerance:
+            self._decrease(source, f"latency {stats.latency * 1000:.0f} ms > {self.tolerance:g}x baseline {stats.baseline * 1000:.0f} ms")
+        elif self.in_flight is None or self.in_flight() * 2 >= self._limit:
+            self._limit = min(self.max_limit, self._limit + 1 / self._limit)
+
+    def _decrease(self, source: str, reason: str):
+        now = time.monotonic()
+        if now - self._last_decrease < self.cooldown:
+            return
+        self._last_decrease = now
+        old = self.limit
+        self._limit = max(self.min_limit, self._limit * self.backoff)
+        if self.limit != old:
+            print(f"📉 [Concurrency] {source}: {reason}，並行上限 {old} -> {self.limit}", flush=True)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "limit": self.limit,
+                "min": self.min_limit,
+                "max": self.max_limit,
+                "sources": {
+                    name: {
+                        "samples": s.samples,
+                        "errors": s.errors,
+                        "overloads": s.overloads,
+                        "latency_ms": round(s.latency * 1000, 1) if s.latency is not None else None,
+                        "baseline_ms": round(s.baseline * 1000, 1) if s.baseline is not None else None,
+                    }
+                    for name, s in self._sources.items()
+                },
+            }
+
+
+class ObservedLock:
+    """
+    The GDriveClient API lock, timed: each `with` block wraps exactly one
+    Google API call (or upload chunk), so its hold time and exception are
+    reported to the limiter as one sample. `with lock("gdrive-upload"):`
+    reports under a separate source for calls whose latency is on a
+    different scale than metadata requests. With exclusive=False (a
+    thread-safe transport) calls are only timed, not serialized.
+    """
+    def __init__(self, limiter: Optional[AdaptiveLimit] = None, source: str = "gdrive", exclusive: bool = True):
+        self.limiter = limiter
+        self.source = source
+        self.exclusive = exclusive
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def __call__(self, source: str) -> "_LockSample":
+        return _LockSample(self, source)
+
+    def __enter__(self):
+        self._acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._release(self.source, exc)
+        return False
+
+    def _acquire(self):
+        if self.exclusive:
+            self._lock.acquire()
+        self._local.started = time.monotonic()
+
+    def _release(self, source: str, exc: Optional[BaseException]):
+        latency = time.monotonic() - self._local.started
+        if self.exclusive:
+            self._lock.release()
+        if self.limiter is not None and (exc is None or isinstance(exc, Exception)):
+            self.limiter.record(source, latency, exc)
+
+
+class _LockSample:
+    def __init__(self, lock: ObservedLock, source: str):
+        self.lock = lock
+        self.source = source
+
+    def __enter__(self):
+        self.lock._acquire()
+        return self.lock
+
+    def __exit__(self, exc_type, exc, tb):
+        self.lock._release(self.source, exc)
+        return False
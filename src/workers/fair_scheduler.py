@@ -0,0 +1,275 @@
+import heapq
+import itertools
+import math
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Callable, Deque, Dict, List, Optional
+from .adaptive_limit import AdaptiveLimit
+
+LANE_LIGHT = "light"
+LANE_HEAVY = "heavy"
+
+
+class _Job:
+    def __init__(self, user_id: str, fn: Callable, args: tuple, kwargs: dict, cost: float):
+        self.user_id = user_id
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.cost = cost
+        self.future: Future = Future()
+
+
+class _Lane:
+    """
+    Per-user queues served with deficit round-robin.
+    Each visit credits the user `quantum * weight`; a job runs once the
+    user's deficit covers its cost, so one heavy uploader cannot monopolize the lane.
+    """
+    def __init__(self, quantum: float = 1.0):
+        self.quantum = quantum
+        self.queues: Dict[str, Deque[_Job]] = {}
+        self.deficit: Dict[str, float] = {}
+        self.active: Deque[str] = deque()
+
+    def __len__(self):
+        return sum(len(q) for q in self.queues.values())
+
+    def push(self, job: _Job):
+        if job.user_id not in self.queues:
+            self.queues[job.user_id] = deque()
+            self.deficit[job.user_id] = 0.0
+            self.active.append(job.user_id)
+        self.queues[job.user_id].append(job)
+
+    def pop(self, weight: Callable[[str], float], eligible: Callable[[str], bool]) -> Optional[_Job]:
+        if not self.active:
+            return None
+        job = self._scan(weight, eligible)
+        if job or not self.active:
+            return job
+        # 繞一圈仍無人額度足夠 (任務成本遠大於 quantum)：
+        # 一次補足所需的輪數，不必逐圈空轉，也不會因圈數上限而卡住
+        rounds = self._rounds_needed(weight, eligible)
+        if rounds is None:
+            return None
+        for user_id in self.active:
+            if eligible(user_id):
+                self.deficit[user_id] += self.quantum * weight(user_id) * (rounds - 1)
+        return self._scan(weight, eligible)
+
+    def _scan(self, weight: Callable[[str], float], eligible: Callable[[str], bool]) -> Optional[_Job]:
+        """依序拜訪每位使用者一次，每次補一個 quantum"""
+        for _ in range(len(self.active)):
+            user_id = self.active[0]
+            queue = self.queues[user_id]
+            if not eligible(user_id):
+                self.active.rotate(-1)
+                continue
+            job = queue[0]
+            if self.deficit[user_id] < job.cost:
+                self.deficit[user_id] += self.quantum * weight(user_id)
+                if self.deficit[user_id] < job.cost:
+                    self.active.rotate(-1)
+                    continue
+            queue.popleft()
+            self.deficit[user_id] -= job.cost
+            if not queue:
+                self.active.popleft()
+                del self.queues[user_id]
+                del self.deficit[user_id]
+            elif self.deficit[user_id] < queue[0].cost:
+                # 額度用完，換下一位使用者
+                self.active.rotate(-1)
+            return job
+        return None
+
+    def _rounds_needed(self, weight: Callable[[str], float], eligible: Callable[[str], bool]) -> Optional[int]:
+        """最快可執行的使用者還需要幾輪 quantum；沒有可執行的使用者時回傳 None"""
+        rounds = None
+        for user_id in self.active:
+            if not eligible(user_id):
+                continue
+            missing = self.queues[user_id][0].cost - self.deficit[user_id]
+            need = max(1, math.ceil(missing / (self.quantum * weight(user_id))))
+            rounds = need if rounds is None else min(rounds, need)
+        return rounds
+
+
+class FairScheduler:
+    """
+    Fair front-end for the backup worker pool.
+
+    - Per-user queues with deficit round-robin, so one user forwarding
+      hundreds of videos does not delay everyone else.
+    - Separate lanes: cheap text/link saves (light) and media downloads (heavy).
+      Light jobs are served first in a weighted pattern and some workers are
+      reserved for them, so their latency stays flat under heavy load.
+    - Each user may only run `heavy_per_user` heavy jobs at a time.
+    - submit_later() parks jobs on a single timer thread until they are due,
+      so waiting (e.g. for LINE to finish transcoding) never holds a worker.
+    - With a `limiter`, only `limiter.limit` jobs run at once (max_workers
+      threads are the upper bound); the limit follows Google/LINE health.
+    """
+    def __init__(self,
+                 max_workers: int = 10,
+                 heavy_per_user: int = 2,
+                 light_reserved: int = 2,
+                 light_weight: int = 3,
+                 user_weights: Optional[Dict[str, float]] = None,
+                 limiter: Optional[AdaptiveLimit] = None):
+        self.max_workers = max_workers
+        self.heavy_per_user = heavy_per_user
+        self.light_reserved = light_reserved
+        self.limiter = limiter
+        self.user_weights = user_weights or {}
+        self.lanes = {LANE_LIGHT: _Lane(), LANE_HEAVY: _Lane()}
+        # 加權輪替: 每 light_weight 次輕量任務後輪到一次重量任務
+        self._lane_pattern: List[str] = [LANE_LIGHT] * light_weight + [LANE_HEAVY]
+        self._lane_cursor = 0
+
+        lock = threading.RLock()
+        self._cond = threading.Condition(lock)
+        # 計時執行緒使用同一把鎖的另一個 Condition，避免 submit 的 notify 喚醒到它
+        self._timer_cond = threading.Condition(lock)
+        self._heavy_running: Dict[str, int] = {}
+        self._heavy_total = 0
+        self._running = 0
+        self._shutdown = False
+        self._threads = []
+        # 延遲任務: (到期時間, 序號, 參數) 的 heap，由單一計時執行緒在到期時送入佇列
+        self._delayed: List[tuple] = []
+        self._delayed_seq = itertools.count()
+        self._timer: Optional[threading.Thread] = None
+        if limiter is not None:
+            limiter.in_flight = lambda: self._running
+            limiter.listeners.append(self._on_limit_change)
+        for i in range(max_workers):
+            thread = threading.Thread(target=self._worker, name=f"backup-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, user_id: str, fn: Callable, *args: Any, heavy: bool = False, cost: float = 1.0, **kwargs: Any) -> Future:
+        job = _Job(user_id, fn, args, kwargs, cost)
+        lane = LANE_HEAVY if heavy else LANE_LIGHT
+        with self._cond:
+            if self._shutdown:
+                raise RuntimeError("FairScheduler 已關閉")
+            self.lanes[lane].push(job)
+            self._cond.notify()
+        return job.future
+
+    def submit_later(self, delay: float, user_id: str, fn: Callable, *args: Any, heavy: bool = False, cost: float = 1.0, **kwargs: Any) -> None:
+        """delay 秒後才將任務排入佇列；等待期間不佔用 worker"""
+        with self._cond:
+            if self._shutdown:
+                raise RuntimeError("FairScheduler 已關閉")
+            heapq.heappush(self._delayed, (time.monotonic() + delay, next(self._delayed_seq), user_id, fn, args, kwargs, heavy, cost))
+            if self._timer is None:
+                self._timer = threading.Thread(target=self._run_timer, name="backup-scheduler-timer", daemon=True)
+                self._timer.start()
+            self._timer_cond.notify()
+
+    def pending(self) -> Dict[str, int]:
+        with self._cond:
+            counts = {name: len(lane) for name, lane in self.lanes.items()}
+            counts["delayed"] = len(self._delayed)
+            return counts
+
+    @property
+    def limit(self) -> int:
+        """目前允許同時執行的任務數"""
+        return min(self.max_workers, self.limiter.limit) if self.limiter else self.max_workers
+
+    @property
+    def heavy_limit(self) -> int:
+        return max(1, self.limit - self.light_reserved)
+
+    def stats(self) -> Dict[str, int]:
+        counts = self.pending()
+        counts.update(running=self._running, limit=self.limit, max_workers=self.max_workers)
+        return counts
+
+    def _on_limit_change(self, limit: int):
+        # 上限調高時喚醒等待中的 worker
+        with self._cond:
+            self._cond.notify_all()
+
+    def _run_timer(self):
+        while True:
+            with self._cond:
+                while not self._shutdown and (not self._delayed or self._delayed[0][0] > time.monotonic()):
+                    timeout = self._delayed[0][0] - time.monotonic() if self._delayed else None
+                    self._timer_cond.wait(timeout)
+                if self._shutdown:
+                    return
+                _, _, user_id, fn, args, kwargs, heavy, cost = heapq.heappop(self._delayed)
+                self.lanes[LANE_HEAVY if heavy else LANE_LIGHT].push(_Job(user_id, fn, args, kwargs, cost))
+                self._cond.notify()
+
+    def shutdown(self, wait: bool = True):
+        with self._cond:
+            self._shutdown = True
+            self._cond.notify_all()
+            self._timer_cond.notify_all()
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+    def _weight(self, user_id: str) -> float:
+        return self.user_weights.get(user_id, 1.0)
+
+    def _heavy_allowed(self, user_id: str) -> bool:
+        return self._heavy_running.get(user_id, 0) < self.heavy_per_user
+
+    def _next_job(self):
+        """在持有 _cond 的情況下挑選下一個任務，回傳 (lane, job)"""
+        if self._running >= self.limit:
+            return None, None
+        for offset in range(len(self._lane_pattern)):
+            lane_name = self._lane_pattern[(self._lane_cursor + offset) % len(self._lane_pattern)]
+            if lane_name == LANE_HEAVY:
+                if self._heavy_total >= self.heavy_limit:
+                    continue
+                job = self.lanes[LANE_HEAVY].pop(self._weight, self._heavy_allowed)
+            else:
+                job = self.lanes[LANE_LIGHT].pop(self._weight, lambda _: True)
+            if job:
+                self._lane_cursor = (self._lane_cursor + offset + 1) % len(self._lane_pattern)
+                return lane_name, job
+        return None, None
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while True:
+                    lane_name, job = self._next_job()
+                    if job or self._shutdown:
+                        break
+                    self._cond.wait()
+                if not job:
+                    return
+                self._running += 1
+                if lane_name == LANE_HEAVY:
+                    self._heavy_total += 1
+                    self._heavy_running[job.user_id] = self._heavy_running.get(job.user_id, 0) + 1
+
+            try:
+                if job.future.set_running_or_notify_cancel():
+                    try:
+                        job.future.set_result(job.fn(*job.args, **job.kwargs))
+                    except BaseException as e:
+                        print(f"❌ [Scheduler] 任務執行失敗: {e}", flush=True)
+                        job.future.set_exception(e)
+            finally:
+                with self._cond:
+                    self._running -= 1
+                    if lane_name == LANE_HEAVY:
+                        self._heavy_total -= 1
+                        self._heavy_running[job.user_id] -= 1
+                        if not self._heavy_running[job.user_id]:
+                            del self._heavy_running[job.user_id]
+                    # 重量任務結束可能解除其他任務的限制
+                    self._cond.notify_all()
@@ -0,0 +1,96 @@
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, Hashable
+
+
+class _Task:
+    def __init__(self, fn: Callable, args: tuple, kwargs: dict, concurrent: bool):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.concurrent = concurrent
+        self.future: Future = Future()
+
+
+class _KeyState:
+    def __init__(self):
+        self.queue: Deque[_Task] = deque()
+        self.running = 0
+        self.exclusive = False
+
+
+class KeyedExecutor:
+    """
+    Keyed serial executors on top of one shared thread pool.
+
+    Tasks with the same key run one at a time in submission order; tasks
+    with different keys run in parallel. A run of consecutive tasks
+    submitted with concurrent=True (e.g. the images of one album) may
+    overlap each other, but still start after everything submitted before
+    them and finish before anything submitted after them.
+    """
+    def __init__(self, max_workers: int = 8, thread_name_prefix: str = "event-dispatch"):
+        self.max_workers = max_workers
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=thread_name_prefix)
+        self._keys: Dict[Hashable, _KeyState] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, key: Hashable, fn: Callable, *args: Any, concurrent: bool = False, **kwargs: Any) -> Future:
+        task = _Task(fn, args, kwargs, concurrent)
+        with self._lock:
+            state = self._keys.setdefault(key, _KeyState())
+            state.queue.append(task)
+            ready = self._take_ready(state)
+        self._start(key, ready)
+        return task.future
+
+    def pending(self) -> int:
+        """尚未開始的任務數"""
+        with self._lock:
+            return sum(len(state.queue) for state in self._keys.values())
+
+    def _take_ready(self, state: _KeyState):
+        """取出此 key 現在可以開始的任務 (呼叫端需持有 _lock)"""
+        ready = []
+        while state.queue and not state.exclusive:
+            task = state.queue[0]
+            if not task.concurrent:
+                if state.running:
+                    break
+                state.exclusive = True
+            state.queue.popleft()
+            state.running += 1
+            ready.append(task)
+        return ready
+
+    def _start(self, key: Hashable, tasks):
+        for task in tasks:
+            try:
+                self._pool.submit(self._run, key, task)
+            except RuntimeError:
+                # 已關閉：取消任務，避免等待者永遠卡住
+                task.future.cancel()
+                self._finish(key, task)
+
+    def _run(self, key: Hashable, task: _Task):
+        if task.future.set_running_or_notify_cancel():
+            try:
+                task.future.set_result(task.fn(*task.args, **task.kwargs))
+            except BaseException as e:
+                task.future.set_exception(e)
+        self._finish(key, task)
+
+    def _finish(self, key: Hashable, task: _Task):
+        with self._lock:
+            state = self._keys[key]
+            state.running -= 1
+            if not task.concurrent:
+                state.exclusive = False
+            ready = self._take_ready(state)
+            if not state.queue and not state.running:
+                del self._keys[key]
+        self._start(key, ready)
+
+    def shutdown(self, wait: bool = True):
+        self._pool.shutdown(wait=wait)
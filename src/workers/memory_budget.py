@@ -0,0 +1,81 @@
+import io
+import tempfile
+import threading
+from contextlib import contextmanager
+from typing import IO, Iterator, Optional
+
+
+class MemoryBudget:
+    """
+    Admission control for in-flight download buffers.
+
+    Small payloads reserve their Content-Length from a global byte budget and
+    are buffered in memory (high concurrency). Payloads above `large_threshold`
+    (or of unknown size) go through a small number of large-file slots and are
+    spilled to disk, so memory use stays bounded no matter how big the file is.
+    """
+    def __init__(self,
+                 total_bytes: int = 256 * 1024 * 1024,
+                 large_threshold: int = 32 * 1024 * 1024,
+                 large_slots: int = 2,
+                 spool_dir: Optional[str] = None):
+        self.total_bytes = total_bytes
+        self.large_threshold = min(large_threshold, total_bytes)
+        self.spool_dir = spool_dir
+        self._available = total_bytes
+        self._cond = threading.Condition()
+        self._large_slots = threading.BoundedSemaphore(large_slots)
+        self.large_in_flight = 0
+
+    @property
+    def reserved_bytes(self) -> int:
+        return self.total_bytes - self._available
+
+    def is_large(self, size: Optional[int]) -> bool:
+        return size is None or size > self.large_threshold
+
+    @contextmanager
+    def reserve(self, nbytes: int, blocking: bool = True) -> Iterator[bool]:
+        """等待直到預算足夠，離開時歸還；blocking=False 時預算不足直接回傳 False"""
+        nbytes = min(max(0, nbytes), self.total_bytes)
+        with self._cond:
+            while self._available < nbytes and blocking:
+                self._cond.wait()
+            reserved = self._available >= nbytes
+            if reserved:
+                self._available -= nbytes
+        if not reserved:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            with self._cond:
+                self._available += nbytes
+                self._cond.notify_all()
+
+    @contextmanager
+    def buffer_for(self, size: Optional[int], blocking: bool = True) -> Iterator[Optional[IO[bytes]]]:
+        """
+        依大小取得下載緩衝區: 小檔案為記憶體 BytesIO，大檔案為磁碟暫存檔。
+        緩衝區與預算在離開 context 前都保持有效 (涵蓋上傳階段)。
+        blocking=False 時若需要等待預算或大檔案名額，改為回傳 None。
+        """
+        if self.is_large(size):
+            if not self._large_slots.acquire(blocking=blocking):
+                yield None
+                return
+            try:
+                with self._cond:
+                    self.large_in_flight += 1
+                try:
+                    with tempfile.TemporaryFile(dir=self.spool_dir) as fh:
+                        yield fh
+                finally:
+                    with self._cond:
+                        self.large_in_flight -= 1
+            finally:
+                self._large_slots.release()
+        else:
+            with self.reserve(size, blocking) as reserved:
+                yield io.BytesIO() if reserved else None
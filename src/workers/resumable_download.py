@@ -0,0 +1,155 @@
+import re
+import time
+import hashlib
+from typing import Any, Callable, IO, Optional
+
+# 4xx 中值得重試的狀態 (其餘如 404 內容過期、416 Range 無效則不重試)
+RETRIABLE_CLIENT_STATUS = (408, 429)
+
+
+def response_headers(resp) -> dict:
+    """SDK 的 Content 物件將 Header 放在 response 內"""
+    inner = getattr(resp, 'response', None)
+    return getattr(inner, 'headers', None) or getattr(resp, 'headers', None) or {}
+
+
+def response_status(resp) -> Optional[int]:
+    inner = getattr(resp, 'response', None)
+    status = getattr(inner, 'status_code', None) or getattr(resp, 'status_code', None)
+    return status if isinstance(status, int) else None
+
+
+def _close(resp):
+    for target in (resp, getattr(resp, 'response', None)):
+        close = getattr(target, 'close', None)
+        if callable(close):
+            try: close()
+            except Exception: pass
+
+
+def _is_retriable(e: Exception) -> bool:
+    status = getattr(e, 'status_code', None)
+    if isinstance(status, int) and 400 <= status < 500 and status not in RETRIABLE_CLIENT_STATUS:
+        return False
+    return True
+
+
+class ResumableDownload:
+    """
+    Chunked download with retry, resume and integrity checks.
+
+    `open_stream(start)` opens the content at byte offset `start`
+    (0 = plain request, otherwise a Range request). After a mid-stream
+    failure the download resumes from the bytes already written when the
+    server answers 206 with a matching Content-Range, and restarts cleanly
+    (sink truncated, checksum reset) when it does not. The byte count is
+    checked against Content-Length and a SHA-256 is computed while streaming.
+    Per-chunk timeouts are the read timeout that `open_stream` passes to
+    the HTTP client.
+    """
+    def __init__(self,
+                 open_stream: Callable[[int], Any],
+                 chunk_size: int = 256 * 1024,
+                 max_attempts: int = 4,
+                 backoff: float = 1.0,
+                 label: str = ""):
+        self.open_stream = open_stream
+        self.chunk_size = chunk_size
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.label = label
+
+        self.total_size: Optional[int] = None
+        self.content_type: str = ""
+        self.downloaded = 0
+        self.resumes = 0
+        self.restarts = 0
+        self._hasher = hashlib.sha256()
+        self._resp = None
+        self._attempts = 0
+
+    @property
+    def checksum(self) -> str:
+        return self._hasher.hexdigest()
+
+    def open(self) -> dict:
+        """開啟第一個連線並讀取 Header (呼叫端可先依大小準備緩衝區)"""
+        self._resp = self._open_with_retry(0)
+        headers = response_headers(self._resp)
+        self.content_type = headers.get('Content-Type', '')
+        if headers.get('Content-Length'):
+            self.total_size = int(headers['Content-Length'])
+        return headers
+
+    def copy_to(self, sink: IO[bytes], on_progress: Optional[Callable[[int, Optional[int]], None]] = None):
+        """串流寫入 sink；中斷時續傳或重新開始，直到位元組數與 Content-Length 相符"""
+        if self._resp is None:
+            self.open()
+        while True:
+            try:
+                for chunk in self._resp.iter_content(chunk_size=self.chunk_size):
+                    if not chunk:
+                        continue
+                    sink.write(chunk)
+                    self._hasher.update(chunk)
+                    self.downloaded += len(chunk)
+                    if on_progress:
+                        on_progress(self.downloaded, self.total_size)
+                if self.total_size is not None and self.downloaded != self.total_size:
+                    raise IOError(f"位元組數不符: 收到 {self.downloaded} / 預期 {self.total_size}")
+                return
+            except Exception as e:
+                _close(self._resp)
+                self._resp = None
+                self._attempts += 1
+                if self._attempts >= self.max_attempts or not _is_retriable(e):
+                    raise
+                print(f"🔁 [Download] {self.label} 中斷於 {self.downloaded} bytes ({e})，第 {self._attempts} 次重試", flush=True)
+                time.sleep(self.backoff * (2 ** (self._attempts - 1)))
+                self._reconnect(sink)
+
+    def _reconnect(self, sink: IO[bytes]):
+        start = self.downloaded if self.total_size is None or self.downloaded < self.total_size else 0
+        try:
+            self._resp = self._open_with_retry(start)
+        except Exception:
+            if not start:
+                raise
+            # Range 請求被拒 (例如 416)：改為從頭下載
+            self._resp = self._open_with_retry(0)
+            start = 0
+        if start and self._resumed_at(start):
+            self.resumes += 1
+            print(f"⏯️ [Download] {self.label} 從 {start} bytes 續傳", flush=True)
+            return
+        # 伺服器不支援 Range (回傳完整內容)：清空並重新計算
+        self.restarts += 1
+        sink.seek(0)
+        sink.truncate()
+        self._hasher = hashlib.sha256()
+        self.downloaded = 0
+        length = response_headers(self._resp).get('Content-Length')
+        if length:
+            self.total_size = int(length)
+
+    def _resumed_at(self, start: int) -> bool:
+        if response_status(self._resp) != 206:
+            return False
+        match = re.match(r'bytes (\d+)-\d+/(\d+|\*)', response_headers(self._resp).get('Content-Range', ''))
+        return bool(match) and int(match.group(1)) == start
+
+    def _open_with_retry(self, start: int):
+        while True:
+            try:
+                return self.open_stream(start)
+            except Exception as e:
+                self._attempts += 1
+                if self._attempts >= self.max_attempts or not _is_retriable(e):
+                    raise
+                print(f"🔁 [Download] {self.label} 連線失敗 ({e})，第 {self._attempts} 次重試", flush=True)
+                time.sleep(self.backoff * (2 ** (self._attempts - 1)))
+
+    def close(self):
+        if self._resp is not None:
+            _close(self._resp)
+            self._resp = None
@@ -0,0 +1,83 @@
+import sys
+import os
+import unittest
+from unittest.mock import MagicMock
+
+# Add src to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from googleapiclient.errors import HttpError
+from src.workers.adaptive_limit import AdaptiveLimit, ObservedLock, is_overload
+
+
+def http_error(status: int, reason: str = "") -> HttpError:
+    resp = MagicMock(status=status, reason=reason)
+    return HttpError(resp, reason.encode())
+
+
+class TestAdaptiveLimit(unittest.TestCase):
+    def setUp(self):
+        self.limiter = AdaptiveLimit(min_limit=2, max_limit=10, initial=4, cooldown=0)
+
+    def test_grows_additively_while_healthy(self):
+        for _ in range(40):
+            self.limiter.record("gdrive", 0.1)
+        self.assertGreater(self.limiter.limit, 4)
+        self.assertLessEqual(self.limiter.limit, 10)
+
+    def test_does_not_grow_when_pool_is_underused(self):
+        self.limiter.in_flight = lambda: 1
+        for _ in range(40):
+            self.limiter.record("gdrive", 0.1)
+        self.assertEqual(self.limiter.limit, 4)
+
+    def test_backs_off_on_rate_limit(self):
+        limiter = AdaptiveLimit(min_limit=2, max_limit=10, initial=10, cooldown=0)
+        changes = []
+        limiter.listeners.append(changes.append)
+        limiter.record("gdrive", 0.5, http_error(429))
+        self.assertEqual(limiter.limit, 7)
+        self.assertEqual(changes, [7])
+        for _ in range(10):
+            limiter.record("line", 0.5, TimeoutError())
+        self.assertEqual(limiter.limit, 2)
+
+    def test_burst_of_errors_counts_once_within_cooldown(self):
+        limiter = AdaptiveLimit(min_limit=2, max_limit=10, initial=10, cooldown=60)
+        for _ in range(5):
+            limiter.record("gdrive", 0.5, http_error(503))
+        self.assertEqual(limiter.limit, 7)
+
+    def test_latency_inflation_backs_off(self):
+        for _ in range(5):
+            self.limiter.record("line", 0.1)
+        before = self.limiter.limit
+        for _ in range(10):
+            self.limiter.record("line", 1.0)
+        self.assertLess(self.limiter.limit, before)
+        # 其他來源的延遲尺度不同，不會互相影響基準
+        self.assertEqual(self.limiter.snapshot()["sources"]["line"]["baseline_ms"] < 200, True)
+
+    def test_client_errors_are_not_overload(self):
+        self.assertFalse(is_overload(http_error(404)))
+        self.assertTrue(is_overload(http_error(403, "userRateLimitExceeded")))
+        limiter = AdaptiveLimit(min_limit=2, max_limit=10, initial=6, cooldown=0)
+        limiter.record("gdrive", 0.1, http_error(404))
+        self.assertEqual(limiter.limit, 6)
+        self.assertEqual(limiter.snapshot()["sources"]["gdrive"]["errors"], 1)
+
+    def test_observed_lock_reports_each_call(self):
+        limiter = MagicMock()
+        lock = ObservedLock(limiter, "gdrive")
+        with lock:
+            pass
+        with self.assertRaises(ValueError):
+            with lock("gdocs"):
+                raise ValueError("bad request")
+        sources = [c.args[0] for c in limiter.record.call_args_list]
+        self.assertEqual(sources, ["gdrive", "gdocs"])
+        self.assertIsInstance(limiter.record.call_args.args[2], ValueError)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+
+import sys
+import os
+import json
+import datetime
+import tempfile
+import threading
+import unittest
+from unittest.mock import MagicMock, patch
+
+# Add src to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from google.oauth2.credentials import Credentials
+from src.clients.credentials_manager import CredentialManager, REFRESH_LOCK_KEY, SHARED_TOKEN_KEY, _utcnow
+from src.clients.gdrive_client import GDriveClient
+from src.state.backend import SQLiteStateBackend
+
+SCOPES = ['https://www.googleapis.com/auth/drive']
+
+
+def fake_refresh(self, request):
+    self.token = "fresh-token"
+    self.expiry = _utcnow() + datetime.timedelta(hours=1)
+
+
+class TestCredentialManager(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.token_path = os.path.join(self.tmpdir.name, "token.json")
+        self.state = SQLiteStateBackend(os.path.join(self.tmpdir.name, "state.db"))
+
+    def tearDown(self):
+        self.state.close()
+        self.tmpdir.cleanup()
+
+    def _write_token(self, expires_in: float):
+        creds = Credentials(
+            token="old-token", refresh_token="refresh", client_id="id", client_secret="secret",
+            token_uri="https://oauth2.googleapis.com/token", scopes=SCOPES,
+            expiry=_utcnow() + datetime.timedelta(seconds=expires_in)
+        )
+        with open(self.token_path, 'w') as f:
+            f.write(creds.to_json())
+
+    def _manager(self):
+        return CredentialManager(SCOPES, token_path=self.token_path, state=self.state, refresh_margin=300)
+
+    @patch.object(Credentials, 'refresh', fake_refresh)
+    def test_refreshes_before_expiry_and_persists(self):
+        self._write_token(expires_in=60)
+        manager = self._manager()
+
+        self.assertTrue(manager.refresh_if_needed())
+        self.assertEqual(manager.credentials.token, "fresh-token")
+        with open(self.token_path) as f:
+            self.assertEqual(json.load(f)["token"], "fresh-token")
+        self.assertEqual([n for n in os.listdir(self.tmpdir.name) if n.endswith(".tmp")], [])
+
+    @patch.object(Credentials, 'refresh')
+    def test_skips_refresh_when_token_is_fresh(self, refresh):
+        self._write_token(expires_in=3600)
+        self.assertFalse(self._manager().refresh_if_needed())
+        refresh.assert_not_called()
+
+    def test_workers_share_refreshed_token(self):
+        self._write_token(expires_in=60)
+        first, second = self._manager(), self._manager()
+        _ = second.credentials
+
+        with patch.object(Credentials, 'refresh', fake_refresh):
+            first.refresh_if_needed()
+
+        with patch.object(Credentials, 'refresh') as refresh:
+            self.assertFalse(second.refresh_if_needed())
+            refresh.assert_not_called()
+        self.assertEqual(second.credentials.token, "fresh-token")
+
+
+    def test_waiting_for_peer_refresh_does_not_hold_lock(self):
+        self._write_token(expires_in=60)
+        manager = self._manager()
+        _ = manager.credentials
+        # 另一個 worker 持有刷新鎖
+        self.state.set_if_absent(REFRESH_LOCK_KEY, "peer", ttl=30)
+        result = {}
+        waiter = threading.Thread(target=lambda: result.update(refreshed=manager.refresh_if_needed()))
+        with patch.object(Credentials, 'refresh') as refresh:
+            waiter.start()
+            threading.Event().wait(0.2)
+            self.assertTrue(manager._lock.acquire(timeout=0.5))
+            manager._lock.release()
+
+            expiry = _utcnow() + datetime.timedelta(hours=1)
+            self.state.set(SHARED_TOKEN_KEY, json.dumps({"token": "peer-token", "expiry": expiry.isoformat() + "Z"}), ttl=3600)
+            waiter.join(timeout=5)
+            refresh.assert_not_called()
+        self.assertFalse(result["refreshed"])
+        self.assertEqual(manager.credentials.token, "peer-token")
+
+    @patch.object(Credentials, 'refresh', fake_refresh)
+    def test_claims_lock_after_peer_lock_expires(self):
+        self._write_token(expires_in=60)
+        manager = self._manager()
+        # 持有刷新鎖的 worker 中途退出，鎖在 TTL 後過期
+        self.state.set_if_absent(REFRESH_LOCK_KEY, "peer", ttl=1)
+        self.assertTrue(manager.refresh_if_needed())
+        self.assertEqual(manager.credentials.token, "fresh-token")
+        self.assertIsNone(self.state.get(REFRESH_LOCK_KEY))
+
+    def test_does_not_release_lock_held_by_peer(self):
+        manager = self._manager()
+        # 刷新期間本 worker 的鎖已過期並被其他 worker 取得
+        self.state.set(REFRESH_LOCK_KEY, "peer", ttl=30)
+        manager._release_refresh("mine")
+        self.assertEqual(self.state.get(REFRESH_LOCK_KEY), "peer")
+
+    def test_warm_up_starts_refresher_even_if_first_refresh_fails(self):
+        manager = MagicMock()
+        manager.refresh_if_needed.side_effect = ConnectionError("offline")
+        client = GDriveClient(credential_manager=manager)
+        client._drive_service = MagicMock()
+        client._docs_service = MagicMock()
+        with self.assertRaises(ConnectionError):
+            client.warm_up()
+        manager.start.assert_called_once()
+
+
+if __name__ == '__main__':
+    unittest.main()
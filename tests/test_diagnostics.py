@@ -0,0 +1,101 @@
+import sys
+import os
+import threading
+import unittest
+from unittest.mock import MagicMock, patch
+
+# Add src to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from src.services.diagnostics import SamplingProfiler, MemoryTracer
+
+try:
+    from fastapi.testclient import TestClient
+except (ImportError, RuntimeError):
+    TestClient = None
+
+
+def spin(stop: threading.Event):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+class TestSamplingProfiler(unittest.TestCase):
+    def test_collapsed_stacks_group_worker_threads(self):
+        stop = threading.Event()
+        threads = [threading.Thread(target=spin, args=(stop,), name=f"busy-worker-{i}") for i in range(2)]
+        for thread in threads:
+            thread.start()
+        try:
+            result = SamplingProfiler().profile(0.3, interval=0.005)
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+
+        self.assertGreater(result["samples"], 10)
+        busy = {stack: n for stack, n in result["stacks"].items() if stack.startswith("busy-worker;")}
+        self.assertTrue(busy)
+        # 葉節點可能是 spin 本身或它呼叫的 Event.is_set
+        self.assertTrue(all(any(frame.endswith(":spin") for frame in stack.split(";")[-2:]) for stack in busy))
+        # flamegraph 的 collapsed 格式: "frame;frame;... count"
+        line = SamplingProfiler.collapsed(result["stacks"]).splitlines()[0]
+        self.assertRegex(line, r"^\S+ \d+$")
+
+    def test_only_one_profile_at_a_time(self):
+        profiler = SamplingProfiler()
+        thread = threading.Thread(target=profiler.profile, args=(0.3,))
+        thread.start()
+        while not profiler.busy:
+            pass
+        with self.assertRaises(RuntimeError):
+            profiler.profile(0.1)
+        thread.join()
+
+
+class TestMemoryTracer(unittest.TestCase):
+    def tearDown(self):
+        MemoryTracer().stop()
+
+    def test_diff_points_at_allocating_line(self):
+        tracer = MemoryTracer()
+        with self.assertRaises(RuntimeError):
+            tracer.snapshot()
+        tracer.start(frames=5)
+        tracer.snapshot("before")
+        held = [bytearray(1024) for _ in range(2000)]  # noqa: F841
+        tracer.snapshot("after")
+
+        diff = tracer.diff("before", "after", match="*test_diagnostics.py")
+        self.assertGreater(diff[0]["size_diff_kb"], 1500)
+        self.assertIn("test_diagnostics.py", diff[0]["where"][0])
+        with self.assertRaises(KeyError):
+            tracer.diff("missing", "after")
+
+        self.assertFalse(tracer.stop()["tracing"])
+
+
+@unittest.skipUnless(TestClient, "TestClient 需要 httpx")
+class TestDebugEndpoints(unittest.TestCase):
+    def setUp(self):
+        from src.main import create_app
+        self.client = TestClient(create_app(MagicMock()))
+
+    def test_disabled_by_default(self):
+        with patch.dict(os.environ):
+            os.environ.pop("DEBUG_ADMIN_TOKEN", None)
+            resp = self.client.get("/debug/profile", params={"seconds": 0.05}, headers={"Authorization": "Bearer "})
+        self.assertEqual(resp.status_code, 404)
+
+    def test_requires_admin_token(self):
+        admin = {"Authorization": "Bearer s3cret"}
+        with patch.dict(os.environ, {"DEBUG_ADMIN_TOKEN": "s3cret"}):
+            self.assertEqual(self.client.get("/debug/profile", params={"seconds": 0.05}).status_code, 401)
+            resp = self.client.get("/debug/profile", params={"seconds": 0.05}, headers=admin)
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("X-Profile-Samples", resp.headers)
+            # tracemalloc 未啟動前不能拍攝快照
+            self.assertEqual(self.client.post("/debug/tracemalloc/snapshot", headers=admin).status_code, 409)
+
+if __name__ == '__main__':
+    unittest.main()
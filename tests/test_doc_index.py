@@ -0,0 +1,108 @@
+
+import sys
+import os
+import time
+import threading
+import unittest
+from unittest.mock import MagicMock
+
+# Add src to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from src.clients.gdrive_client import GDriveClient
+from src.clients.doc_index import escape_query_value
+
+DOC = 'application/vnd.google-apps.document'
+
+
+class TestDocIndex(unittest.TestCase):
+    def setUp(self):
+        self.client = GDriveClient(credential_manager=MagicMock())
+        self.client.folder_id = "folder"
+        self.drive = MagicMock()
+        self.client._drive_service = self.drive
+        self.drive.changes().getStartPageToken().execute.return_value = {"startPageToken": "t1"}
+        self.drive.files().list().execute.side_effect = [
+            {"files": [{"id": "d1", "name": "a"}], "nextPageToken": "p2"},
+            {"files": [{"id": "d2", "name": "b"}]},
+        ]
+        self.drive.changes().list().execute.return_value = {"changes": [], "newStartPageToken": "t1"}
+        self.drive.files().list.reset_mock()
+        self.drive.changes().list.reset_mock()
+
+    def test_seeded_from_paged_listing_then_served_from_memory(self):
+        self.assertEqual(self.client.get_doc_by_name("a"), "d1")
+        self.assertEqual(self.client.get_doc_by_name("b"), "d2")
+        self.assertEqual(self.drive.files().list.call_count, 2)
+        self.assertEqual(self.drive.files().list.call_args_list[1].kwargs["pageToken"], "p2")
+
+    def test_concurrent_seeds_list_the_folder_once(self):
+        pages = list(self.drive.files().list().execute.side_effect)
+        self.drive.files().list.reset_mock()
+
+        def slow_page(*args, **kwargs):
+            time.sleep(0.05)
+            return pages.pop(0)
+
+        self.drive.files().list().execute.side_effect = slow_page
+        self.drive.files().list.reset_mock()
+        # 預熱的 seed 與第一次查詢同時發生
+        threads = [threading.Thread(target=self.client.doc_index.seed),
+                   threading.Thread(target=self.client.get_doc_by_name, args=("a",))]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join(5)
+
+        self.assertEqual(self.drive.changes().getStartPageToken().execute.call_count, 1)
+        self.assertEqual(self.drive.files().list.call_count, 2)
+        self.assertEqual(self.client.doc_index._by_name, {"a": "d1", "b": "d2"})
+
+    def test_changes_invalidate_entries(self):
+        self.client.get_doc_by_name("a")
+        self.drive.changes().list().execute.return_value = {
+            "changes": [
+                {"fileId": "d1", "removed": True},
+                {"fileId": "d3", "file": {"name": "c", "mimeType": DOC, "trashed": False, "parents": ["folder"]}},
+                {"fileId": "d2", "file": {"name": "b2", "mimeType": DOC, "trashed": False, "parents": ["folder"]}},
+            ],
+            "newStartPageToken": "t2",
+        }
+        self.client.doc_index.sync(force=True)
+
+        self.assertEqual(self.client.doc_index._by_name, {"c": "d3", "b2": "d2"})
+        self.assertEqual(self.client.doc_index._page_token, "t2")
+
+    def test_created_docs_are_indexed(self):
+        self.client.get_doc_by_name("a")
+        self.drive.files().create().execute.return_value = {"id": "d9", "webViewLink": "https://docs/d9"}
+        self.client.create_blank_doc("journal")
+        calls = self.drive.files().list.call_count
+        self.assertEqual(self.client.get_doc_by_name("journal"), "d9")
+        self.assertEqual(self.drive.files().list.call_count, calls)
+
+    def test_failed_seed_is_not_retried_until_backoff(self):
+        self.drive.changes().getStartPageToken().execute.side_effect = ConnectionError("offline")
+        self.drive.files().list().execute.side_effect = None
+        self.drive.files().list().execute.return_value = {"files": []}
+        for name in ("a", "b", "c"):
+            self.assertIsNone(self.client.get_doc_by_name(name))
+        self.assertEqual(self.drive.changes().getStartPageToken().execute.call_count, 1)
+
+        # 退避時間過後再次嘗試建立索引
+        self.client.doc_index._seed_failed_at -= self.client.doc_index.sync_interval
+        self.client.get_doc_by_name("a")
+        self.assertEqual(self.drive.changes().getStartPageToken().execute.call_count, 2)
+
+    def test_miss_uses_escaped_query(self):
+        self.client.get_doc_by_name("a")
+        self.drive.files().list().execute.side_effect = None
+        self.drive.files().list().execute.return_value = {"files": []}
+        self.assertIsNone(self.client.get_doc_by_name("it's"))
+        query = self.drive.files().list.call_args.kwargs["q"]
+        self.assertIn("name = 'it\\'s'", query)
+        self.assertEqual(escape_query_value("a\\b'c"), "a\\\\b\\'c")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,147 @@
+
+import sys
+import os
+import time
+import threading
+import unittest
+
+# Add src to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from src.workers.fair_scheduler import FairScheduler
+from src.workers.adaptive_limit import AdaptiveLimit
+
+
+class TestFairScheduler(unittest.TestCase):
+    def setUp(self):
+        self.release = threading.Event()
+
+    def tearDown(self):
+        self.release.set()
+
+    def _blocking_job(self):
+        self.release.wait(5)
+
+    def test_light_saves_not_starved_by_heavy_uploader(self):
+        scheduler = FairScheduler(max_workers=4, heavy_per_user=10, light_reserved=1)
+        for _ in range(50):
+            scheduler.submit("heavy-user", self._blocking_job, heavy=True)
+
+        start = time.monotonic()
+        result = scheduler.submit("light-user", lambda: "ok").result(timeout=2)
+        self.assertEqual(result, "ok")
+        self.assertLess(time.monotonic() - start, 1.0)
+
+        self.release.set()
+        scheduler.shutdown()
+
+    def test_heavy_jobs_capped_per_user(self):
+        scheduler = FairScheduler(max_workers=6, heavy_per_user=2, light_reserved=0)
+        running = []
+        peak = []
+        lock = threading.Lock()
+
+        def job():
+            with lock:
+                running.append(1)
+                peak.append(len(running))
+            self.release.wait(0.05)
+            with lock:
+                running.pop()
+
+        futures = [scheduler.submit("u1", job, heavy=True) for _ in range(8)]
+        for f in futures:
+            f.result(timeout=5)
+        self.assertLessEqual(max(peak), 2)
+        scheduler.shutdown()
+
+    def test_round_robin_between_users(self):
+        # 單一 worker，先被阻塞住以便排入所有任務
+        scheduler = FairScheduler(max_workers=1, light_reserved=0)
+        order = []
+        gate = scheduler.submit("gate", self._blocking_job)
+        futures = [scheduler.submit("a", order.append, f"a{i}") for i in range(3)]
+        futures += [scheduler.submit("b", order.append, f"b{i}") for i in range(3)]
+        self.release.set()
+        gate.result(timeout=5)
+        for f in futures:
+            f.result(timeout=5)
+
+        self.assertEqual(order, ["a0", "b0", "a1", "b1", "a2", "b2"])
+        scheduler.shutdown()
+
+    def test_job_cost_above_quantum_bound_still_runs(self):
+        # 例如 BATCH_SAVE_MAX 很大時的批次存檔 (cost=len(refs))
+        scheduler = FairScheduler(max_workers=2)
+        self.assertEqual(scheduler.submit("u", lambda: "big", heavy=True, cost=40).result(timeout=2), "big")
+        self.assertEqual(scheduler.submit("u", lambda: "huge", cost=10_000).result(timeout=2), "huge")
+        scheduler.shutdown()
+
+    def test_large_cost_keeps_deficit_round_robin_order(self):
+        scheduler = FairScheduler(max_workers=1, light_reserved=0)
+        order = []
+        gate = scheduler.submit("gate", self._blocking_job)
+        futures = [scheduler.submit("big", order.append, "big", cost=100)]
+        futures += [scheduler.submit("small", order.append, f"s{i}") for i in range(3)]
+        self.release.set()
+        gate.result(timeout=5)
+        for f in futures:
+            f.result(timeout=5)
+
+        # 小任務不必等大任務累積完 100 個 quantum
+        self.assertEqual(order, ["s0", "s1", "s2", "big"])
+        scheduler.shutdown()
+
+    def test_exceptions_are_reported_on_future(self):
+        scheduler = FairScheduler(max_workers=1)
+        future = scheduler.submit("u1", lambda: 1 / 0)
+        with self.assertRaises(ZeroDivisionError):
+            future.result(timeout=5)
+        scheduler.shutdown()
+
+    def test_delayed_jobs_do_not_hold_workers(self):
+        scheduler = FairScheduler(max_workers=1, light_reserved=0)
+        order = []
+        done = threading.Event()
+        scheduler.submit_later(0.2, "a", lambda: (order.append("delayed"), done.set()))
+        self.assertEqual(scheduler.pending()["delayed"], 1)
+        scheduler.submit("b", order.append, "now").result(timeout=5)
+
+        self.assertTrue(done.wait(5))
+        self.assertEqual(order, ["now", "delayed"])
+        scheduler.shutdown()
+
+
+    def test_adaptive_limit_caps_running_jobs(self):
+        limiter = AdaptiveLimit(min_limit=1, max_limit=6, initial=2, cooldown=0)
+        scheduler = FairScheduler(max_workers=6, light_reserved=0, limiter=limiter)
+        running, peak = [], []
+        lock = threading.Lock()
+
+        def job():
+            with lock:
+                running.append(1)
+                peak.append(len(running))
+            self.release.wait(0.05)
+            with lock:
+                running.pop()
+
+        for f in [scheduler.submit(f"u{i}", job) for i in range(8)]:
+            f.result(timeout=5)
+        self.assertEqual(max(peak), 2)
+        self.assertEqual(scheduler.stats()["limit"], 2)
+
+        # 上限調高後立即喚醒等待中的 worker
+        limiter.in_flight = None
+        limiter.record("gdrive", 0.1)
+        limiter._limit = 5.9
+        limiter.record("gdrive", 0.1)
+        self.assertEqual(scheduler.limit, 6)
+        barrier = threading.Barrier(6, timeout=2)
+        for f in [scheduler.submit(f"u{i}", barrier.wait) for i in range(6)]:
+            f.result(timeout=5)
+        scheduler.shutdown()
+
+
+if __name__ == '__main__':
+    unittest.main()
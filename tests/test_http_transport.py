@@ -0,0 +1,92 @@
+import sys
+import os
+import json
+import socket
+import unittest
+from unittest.mock import MagicMock, patch
+
+# Add src to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from googleapiclient.discovery import build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+from src.clients.http_transport import HttpxHttp, TransportFactory
+from src.clients.gdrive_client import GDriveClient
+from src.clients.credentials_manager import CredentialManager
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+
+@unittest.skipUnless(httpx, "httpx 未安裝")
+class TestHttpxHttp(unittest.TestCase):
+    def _http(self, handler):
+        self.requests = []
+
+        def record(request):
+            self.requests.append(request)
+            return handler(request)
+        return HttpxHttp(client=httpx.Client(transport=httpx.MockTransport(record)))
+
+    def test_response_matches_httplib2_shape(self):
+        http = self._http(lambda r: httpx.Response(200, json={"ok": True}, headers={"X-Test": "1"}))
+        resp, content = http.request("https://example.com/a", "POST", body=b"payload", headers={"Content-Type": "text/plain"})
+
+        self.assertEqual(resp.status, 200)
+        self.assertEqual(resp["status"], "200")
+        self.assertEqual(resp["x-test"], "1")
+        self.assertEqual(json.loads(content), {"ok": True})
+        self.assertEqual(self.requests[0].content, b"payload")
+
+    def test_resumable_308_is_not_followed(self):
+        http = self._http(lambda r: httpx.Response(308, headers={"Range": "bytes=0-1023"}))
+        resp, _ = http.request("https://example.com/upload", "PUT", body=b"x")
+        self.assertEqual(resp.status, 308)
+        self.assertEqual(resp["range"], "bytes=0-1023")
+        self.assertEqual(len(self.requests), 1)
+
+    def test_timeouts_map_to_socket_timeout(self):
+        def handler(request):
+            raise httpx.ReadTimeout("slow", request=request)
+        http = self._http(handler)
+        with self.assertRaises(socket.timeout):
+            http.request("https://example.com/slow")
+
+    def test_drive_service_runs_over_transport(self):
+        http = self._http(lambda r: httpx.Response(200, json={"id": "f1", "webViewLink": "https://drive/f1"}))
+        drive = build_from_document(get_static_doc("drive", "v3"), http=http)
+        result = drive.files().get(fileId="f1", fields="webViewLink").execute()
+
+        self.assertEqual(result["webViewLink"], "https://drive/f1")
+        self.assertIn("/drive/v3/files/f1", str(self.requests[0].url))
+
+    def test_thread_safe_transport_drops_api_lock(self):
+        client = GDriveClient(MagicMock(), transport=TransportFactory(kind="http2"))
+        self.assertFalse(client._lock.exclusive)
+        self.assertTrue(GDriveClient(MagicMock(), transport=TransportFactory(kind="httplib2"))._lock.exclusive)
+
+
+class TestTransportFallback(unittest.TestCase):
+    def test_missing_httpx_falls_back_to_httplib2(self):
+        with patch('src.clients.http_transport.importlib.util.find_spec', return_value=None):
+            factory = TransportFactory(kind="http2")
+        self.assertEqual(factory.kind, "httplib2")
+        self.assertTrue(GDriveClient(MagicMock(), transport=factory)._lock.exclusive)
+
+    def test_build_failure_raises_without_changing_lock_mode(self):
+        factory = TransportFactory(kind="http2")
+        factory.kind = "http2"
+        factory.authorized_http = MagicMock(side_effect=ImportError("No module named 'h2'"))
+        with patch.object(CredentialManager, '_load', return_value=MagicMock()):
+            client = GDriveClient(transport=factory)
+            self.assertFalse(client._lock.exclusive)
+            with self.assertRaises(ImportError):
+                client.drive_service
+        # 使用中的 client 不會在執行期間改變傳輸層或鎖的模式
+        self.assertFalse(client._lock.exclusive)
+        self.assertEqual(factory.kind, "http2")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,173 @@
+
+import sys
+import os
+import time
+import tempfile
+import threading
+import unittest
+from unittest.mock import MagicMock
+
+# Add src to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from src.services.journal import DailyJournal
+from src.services.save_service import SaveService
+from src.clients.gdrive_client import GDriveClient
+from src.state.backend import SQLiteStateBackend
+
+
+class StatusError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+class TestDailyJournal(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.state = SQLiteStateBackend(os.path.join(self.tmpdir.name, "state.db"))
+        self.mock_gdrive = MagicMock(spec=GDriveClient)
+        self.mock_gdrive.get_doc_by_name.return_value = None
+        self.mock_gdrive.create_blank_doc.return_value = {"id": "doc1", "webViewLink": "https://docs/doc1"}
+        self.journal = DailyJournal(self.mock_gdrive, self.state, flush_interval=60)
+
+    def tearDown(self):
+        self.journal.close()
+        self.state.close()
+        self.tmpdir.cleanup()
+
+    def test_entries_are_buffered_and_flushed_in_one_batch(self):
+        self.journal.start()
+        for i in range(3):
+            link = self.journal.append("C1", "Group (Team)", f"entry {i}")
+        self.assertEqual(link, "https://docs/doc1")
+        self.mock_gdrive.append_to_doc.assert_not_called()
+
+        self.journal.flush()
+        self.mock_gdrive.append_to_doc.assert_called_once()
+        doc_id, blocks = self.mock_gdrive.append_to_doc.call_args[0]
+        self.assertEqual(doc_id, "doc1")
+        self.assertIn("Title:", blocks[0])
+        self.assertEqual(blocks[1:], ["entry 0", "entry 1", "entry 2"])
+
+    def test_doc_id_is_looked_up_once_per_chat_per_day(self):
+        self.journal.append("C1", "ctx", "a")
+        self.journal.append("C1", "ctx", "b")
+        # 另一個 worker 透過共享狀態取得同一份文件
+        other = DailyJournal(self.mock_gdrive, self.state)
+        other.append("C1", "ctx", "c")
+
+        self.mock_gdrive.get_doc_by_name.assert_called_once()
+        self.mock_gdrive.create_blank_doc.assert_called_once()
+
+    def test_failed_flush_is_retried_in_order(self):
+        self.journal.start()
+        self.journal.append("C1", "ctx", "a")
+        self.mock_gdrive.append_to_doc.side_effect = [RuntimeError("quota"), None]
+        self.journal.flush()
+        self.journal.append("C1", "ctx", "b")
+        self.journal.flush()
+        _, blocks = self.mock_gdrive.append_to_doc.call_args[0]
+        self.assertEqual(blocks[-2:], ["a", "b"])
+
+    def test_overflow_wakes_flusher_instead_of_writing_on_caller_thread(self):
+        journal = DailyJournal(self.mock_gdrive, self.state, flush_interval=60, max_pending=3)
+        writers = []
+        flushed = threading.Event()
+
+        def append_to_doc(doc_id, blocks):
+            writers.append(threading.current_thread().name)
+            flushed.set()
+        self.mock_gdrive.append_to_doc.side_effect = append_to_doc
+        journal.start()
+        try:
+            for i in range(3):
+                journal.append("C1", "ctx", f"entry {i}")
+            self.assertTrue(flushed.wait(timeout=2))
+            self.assertEqual(writers, ["journal-flusher"])
+        finally:
+            journal.close()
+
+    def test_concurrent_flushes_do_not_overlap(self):
+        active, overlaps = [], []
+        started = threading.Event()
+
+        def append_to_doc(doc_id, blocks):
+            started.set()
+            active.append(doc_id)
+            if len(active) > 1:
+                overlaps.append(doc_id)
+            time.sleep(0.05)
+            active.remove(doc_id)
+        self.mock_gdrive.append_to_doc.side_effect = append_to_doc
+        self.journal._pending = {"doc1": ["a"]}
+        flusher = threading.Thread(target=self.journal.flush)
+        flusher.start()
+        self.assertTrue(started.wait(timeout=1))
+        self.journal._pending["doc1"] = ["b"]
+        self.journal.flush()
+        flusher.join()
+        self.assertEqual(overlaps, [])
+
+    def test_deleted_doc_is_recreated(self):
+        self.journal.append("C1", "ctx", "a")
+        self.mock_gdrive.append_to_doc.side_effect = [StatusError(404), None]
+        self.mock_gdrive.get_doc_by_name.return_value = "doc1"
+        self.mock_gdrive.create_blank_doc.return_value = {"id": "doc2", "webViewLink": "https://docs/doc2"}
+        self.journal.append("C1", "ctx", "b")
+        self.journal.flush()
+
+        doc_id, blocks = self.mock_gdrive.append_to_doc.call_args[0]
+        self.assertEqual(doc_id, "doc2")
+        self.assertIn("Title:", blocks[0])
+        self.assertEqual(blocks[-1], "b")
+        self.assertEqual(self.journal.doc_for("C1", "ctx")["id"], "doc2")
+        # 其他 worker 也改用新文件
+        self.assertEqual(DailyJournal(self.mock_gdrive, self.state).doc_for("C1", "ctx")["id"], "doc2")
+
+    def test_failing_doc_is_given_up_after_max_attempts(self):
+        journal = DailyJournal(self.mock_gdrive, self.state, max_attempts=3)
+        journal.start()
+        journal.append("C1", "ctx", "a")
+        self.mock_gdrive.append_to_doc.side_effect = RuntimeError("quota")
+        for _ in range(3):
+            journal.flush()
+        self.assertEqual(self.mock_gdrive.append_to_doc.call_count, 3)
+        journal.flush()
+        self.assertEqual(self.mock_gdrive.append_to_doc.call_count, 3)
+        self.mock_gdrive.append_to_doc.side_effect = None
+        journal.close()
+
+    def test_only_one_worker_creates_the_daily_doc(self):
+        created = threading.Event()
+
+        def slow_create(title):
+            created.wait(2)
+            return {"id": "doc1", "webViewLink": "https://docs/doc1"}
+
+        self.mock_gdrive.create_blank_doc.side_effect = slow_create
+        workers = [DailyJournal(self.mock_gdrive, self.state, create_wait=5) for _ in range(2)]
+        docs = []
+        threads = [threading.Thread(target=lambda j=j: docs.append(j.doc_for("C1", "ctx"))) for j in workers]
+        for t in threads:
+            t.start()
+        time.sleep(0.3)
+        created.set()
+        for t in threads:
+            t.join(5)
+
+        self.mock_gdrive.create_blank_doc.assert_called_once()
+        self.assertEqual([d["id"] for d in docs], ["doc1", "doc1"])
+
+    def test_journal_save_skips_create_doc(self):
+        service = SaveService(self.mock_gdrive, MagicMock(), self.journal)
+        link = service.process_journal_save("LINE", "ctx", "text", text="hello", chat_id="C1")
+
+        self.assertEqual(link, "https://docs/doc1")
+        self.mock_gdrive.create_doc.assert_not_called()
+        _, blocks = self.mock_gdrive.append_to_doc.call_args[0]
+        self.assertIn("hello", blocks[-1])
+
+
+if __name__ == '__main__':
+    unittest.main()
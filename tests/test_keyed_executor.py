@@ -0,0 +1,66 @@
+import sys
+import os
+import time
+import threading
+import unittest
+
+# Add src to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from src.workers.keyed_executor import KeyedExecutor
+
+
+class TestKeyedExecutor(unittest.TestCase):
+    def setUp(self):
+        self.executor = KeyedExecutor(max_workers=4)
+        self.log = []
+        self.lock = threading.Lock()
+
+    def tearDown(self):
+        self.executor.shutdown()
+
+    def _record(self, name, delay=0.0):
+        with self.lock:
+            self.log.append(("start", name))
+        time.sleep(delay)
+        with self.lock:
+            self.log.append(("end", name))
+        return name
+
+    def test_same_key_runs_in_order(self):
+        futures = [self.executor.submit("chat", self._record, i, 0.01) for i in range(5)]
+        self.assertEqual([f.result(timeout=5) for f in futures], list(range(5)))
+        # 任務彼此不重疊且依提交順序
+        self.assertEqual(self.log, [(kind, i) for i in range(5) for kind in ("start", "end")])
+
+    def test_different_keys_run_in_parallel(self):
+        barrier = threading.Barrier(3, timeout=2)
+        futures = [self.executor.submit(f"chat-{i}", barrier.wait) for i in range(3)]
+        for f in futures:
+            f.result(timeout=5)
+
+    def test_concurrent_run_is_fenced_by_ordered_tasks(self):
+        first = self.executor.submit("chat", self._record, "first", 0.05)
+        album = [self.executor.submit("chat", self._record, f"img{i}", 0.1, concurrent=True) for i in range(3)]
+        last = self.executor.submit("chat", self._record, "last")
+        last.result(timeout=5)
+
+        starts = [name for kind, name in self.log if kind == "start"]
+        self.assertEqual(starts[0], "first")
+        self.assertEqual(self.log[-2:], [("start", "last"), ("end", "last")])
+        # 相簿的三張圖片同時處理
+        self.assertEqual([kind for kind, _ in self.log[2:5]], ["start"] * 3)
+        self.assertTrue(first.done() and all(f.done() for f in album))
+
+    def test_exception_does_not_block_key(self):
+        def boom():
+            raise ValueError("boom")
+        failed = self.executor.submit("chat", boom)
+        after = self.executor.submit("chat", lambda: "ok")
+        self.assertEqual(after.result(timeout=5), "ok")
+        self.assertIsInstance(failed.exception(), ValueError)
+        self.assertEqual(self.executor.pending(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
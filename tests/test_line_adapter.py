@@ -0,0 +1,354 @@
+
+import sys
+import os
+import json
+import hmac
+import base64
+import hashlib
+import time
+import tempfile
+import threading
+import unittest
+from unittest.mock import MagicMock
+
+# Add src to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+os.environ.setdefault('LINE_CHANNEL_ACCESS_TOKEN', 'fake_token')
+os.environ.setdefault('LINE_CHANNEL_SECRET', 'fake_secret')
+
+from linebot.exceptions import InvalidSignatureError
+from src.adapters.line_adapter import LineAdapter
+from src.state.backend import SQLiteStateBackend
+
+
+def sign(body: str) -> str:
+    digest = hmac.new(os.environ['LINE_CHANNEL_SECRET'].encode(), body.encode(), hashlib.sha256).digest()
+    return base64.b64encode(digest).decode()
+
+
+def text_event(msg_id, text, quoted_id=None, user_id="U1", redelivery=False):
+    message = {"type": "text", "id": msg_id, "text": text, "quoteToken": f"q-{msg_id}"}
+    if quoted_id:
+        message["quotedMessageId"] = quoted_id
+    return {
+        "type": "message",
+        "mode": "active",
+        "timestamp": 0,
+        "replyToken": f"r-{msg_id}",
+        "webhookEventId": f"evt-{msg_id}",
+        "deliveryContext": {"isRedelivery": redelivery},
+        "source": {"type": "user", "userId": user_id},
+        "message": message,
+    }
+
+
+def sticker_event(msg_id, user_id="U1"):
+    event = text_event(msg_id, "", user_id=user_id)
+    event["message"] = {"type": "sticker", "id": msg_id, "packageId": "1", "stickerId": "42", "stickerResourceType": "STATIC"}
+    return event
+
+
+def image_event(msg_id, user_id="U1"):
+    event = text_event(msg_id, "", user_id=user_id)
+    event["message"] = {"type": "image", "id": msg_id, "contentProvider": {"type": "line"}}
+    return event
+
+
+class TestLineAdapter(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.state = SQLiteStateBackend(os.path.join(self.tmpdir.name, "state.db"))
+        self.settings_file = os.path.join(self.tmpdir.name, "auto_save_settings.json")
+        self.adapter = LineAdapter(MagicMock(), self.state, settings_file=self.settings_file)
+        self.adapter.line_bot_api = MagicMock()
+
+    def tearDown(self):
+        self.adapter.shutdown()
+        self.adapter.scheduler.shutdown()
+        self.state.close()
+        self.tmpdir.cleanup()
+
+    def test_parse_events_attaches_quote_fields(self):
+        payload = {"events": [text_event("m1", "/save", quoted_id="m0"), text_event("m2", "hello")]}
+        events = self.adapter.parse_events(payload)
+
+        self.assertEqual(len(events), 2)
+        self.assertEqual(events[0].message.quoted_message_id, "m0")
+        self.assertEqual(events[0].message.quote_token, "q-m1")
+        self.assertIsNone(events[1].message.quoted_message_id)
+
+    def test_quoted_id_survives_other_requests(self):
+        # 另一個請求處理完畢不應影響這個請求的 quoted ID
+        first = self.adapter.parse_events({"events": [text_event("m1", "/save", quoted_id="m0")]})
+        self.adapter.parse_events({"events": [text_event("m9", "hello")]})
+        self.assertEqual(first[0].message.quoted_message_id, "m0")
+        self.assertEqual(self.adapter.get_manual_quoted_id("m1"), "m0")
+
+    def test_handle_request_rejects_bad_signature(self):
+        body = json.dumps({"events": [text_event("m1", "/help")]})
+        with self.assertRaises(InvalidSignatureError):
+            self.adapter.handle_request(body, "bad")
+
+    def test_handle_request_dispatches_command(self):
+        body = json.dumps({"events": [text_event("m1", "/help")]})
+        self.adapter.handle_request(body, sign(body))
+        self.adapter.line_bot_api.reply_message.assert_called_once()
+
+
+    def test_redelivered_event_processed_once(self):
+        body = json.dumps({"events": [text_event("m1", "/help")]})
+        redelivered = json.dumps({"events": [text_event("m1", "/help", redelivery=True)]})
+        self.adapter.handle_request(body, sign(body))
+        self.adapter.handle_request(redelivered, sign(redelivered))
+        self.adapter.line_bot_api.reply_message.assert_called_once()
+
+    def test_dedup_is_shared_across_workers(self):
+        other = LineAdapter(MagicMock(), self.state, settings_file=self.settings_file)
+        other.line_bot_api = MagicMock()
+        body = json.dumps({"events": [text_event("m1", "/help")]})
+        self.adapter.handle_request(body, sign(body))
+        other.handle_request(body, sign(body))
+        other.line_bot_api.reply_message.assert_not_called()
+
+    def test_failed_event_can_be_retried(self):
+        self.adapter.auto_save_settings.set("U1", True)
+        body = json.dumps({"events": [text_event("m1", "hello")]})
+        self.adapter.line_bot_api.reply_message.side_effect = [RuntimeError("LINE down"), None]
+        with self.assertRaises(RuntimeError):
+            self.adapter.handle_request(body, sign(body))
+        self.adapter.handle_request(body, sign(body))
+        self.assertEqual(self.adapter.line_bot_api.reply_message.call_count, 2)
+
+    def test_queue_count_is_per_process_and_returns_to_zero(self):
+        self.adapter.auto_save_settings.set("U1", True)
+        self.adapter.line_bot_api.reply_message.side_effect = RuntimeError("LINE down")
+        body = json.dumps({"events": [text_event("m1", "hello")]})
+        with self.assertRaises(RuntimeError):
+            self.adapter.handle_request(body, sign(body))
+        self.assertEqual(self.adapter.queue_count, 0)
+        self.assertIsNone(self.state.get("queue_count"))
+
+    def test_ingest_acks_before_processing(self):
+        body = json.dumps({"events": [text_event("m1", "/help")]})
+        self.adapter.ingest(body, sign(body))
+        self.adapter.line_bot_api.reply_message.assert_not_called()
+        self.assertEqual(self.state.queue_length("webhook_events"), 1)
+
+        self.adapter.start()
+        deadline = time.monotonic() + 5
+        while not self.adapter.line_bot_api.reply_message.called and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.adapter.line_bot_api.reply_message.assert_called_once()
+
+    def test_webhook_claimed_by_crashed_consumer_is_redelivered(self):
+        body = json.dumps({"events": [text_event("m1", "/help")]})
+        self.adapter.ingest(body, sign(body))
+        # 另一個程序領取後在處理前結束
+        self.state.claim("webhook_events", visibility=0.1)
+
+        self.adapter.start()
+        deadline = time.monotonic() + 5
+        while not self.adapter.line_bot_api.reply_message.called and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.adapter.line_bot_api.reply_message.assert_called_once()
+        # 處理完成後確認，項目從佇列中移除
+        self.adapter.shutdown()
+        self.assertEqual(self.state._conn.execute("SELECT COUNT(*) FROM queues").fetchone()[0], 0)
+
+    def test_ingest_rejects_bad_signature(self):
+        with self.assertRaises(InvalidSignatureError):
+            self.adapter.ingest("{}", "bad")
+        self.assertEqual(self.state.queue_length("webhook_events"), 0)
+
+    def _fake_content(self, data: bytes, content_type="image/jpeg"):
+        content = MagicMock()
+        content.response.headers = {'Content-Type': content_type, 'Content-Length': str(len(data))}
+        content.iter_content.return_value = [data[i:i + 4] for i in range(0, len(data), 4)]
+        return content
+
+    def _capture_upload(self):
+        seen = {}
+        def process_save(**kwargs):
+            fh = kwargs['file_content']
+            seen['data'] = fh.read()
+            seen['type'] = type(fh).__name__
+            seen['reserved'] = self.adapter.memory_budget.reserved_bytes
+            return "https://drive/link"
+        self.adapter.save_service.process_save.side_effect = process_save
+        return seen
+
+    def test_small_media_reserves_budget_in_memory(self):
+        seen = self._capture_upload()
+        self.adapter.line_bot_api.get_message_content.return_value = self._fake_content(b"0123456789")
+        event = self.adapter.parse_events({"events": [text_event("m1", "x")]})[0]
+
+        self.adapter._process_media_message(event, "ctx", "U1", msg_id="m0")
+
+        self.assertEqual(seen['data'], b"0123456789")
+        self.assertEqual(seen['type'], "BytesIO")
+        self.assertEqual(seen['reserved'], 10)
+        self.assertEqual(self.adapter.memory_budget.reserved_bytes, 0)
+
+    def test_large_media_spills_to_disk(self):
+        seen = self._capture_upload()
+        self.adapter.memory_budget.large_threshold = 4
+        self.adapter.line_bot_api.get_message_content.return_value = self._fake_content(b"0123456789")
+        event = self.adapter.parse_events({"events": [text_event("m1", "x")]})[0]
+
+        self.adapter._process_media_message(event, "ctx", "U1", msg_id="m0")
+
+        self.assertEqual(seen['data'], b"0123456789")
+        self.assertNotEqual(seen['type'], "BytesIO")
+        self.assertEqual(seen['reserved'], 0)
+
+    def test_stream_is_closed_while_waiting_for_budget(self):
+        seen = self._capture_upload()
+        first, second = self._fake_content(b"0123456789"), self._fake_content(b"0123456789")
+        self.adapter.line_bot_api.get_message_content.side_effect = [first, second]
+        event = self.adapter.parse_events({"events": [text_event("m1", "x")]})[0]
+        budget = self.adapter.memory_budget
+
+        with budget.reserve(budget.total_bytes):
+            worker = threading.Thread(target=self.adapter._process_media_message, args=(event, "ctx", "U1"), kwargs={"msg_id": "m0"})
+            worker.start()
+            deadline = time.monotonic() + 5
+            while not first.close.called and time.monotonic() < deadline:
+                time.sleep(0.02)
+            # 等待預算期間不持有 LINE 的內容串流
+            first.close.assert_called()
+            self.assertNotIn('data', seen)
+        worker.join(5)
+
+        self.assertEqual(self.adapter.line_bot_api.get_message_content.call_count, 2)
+        self.assertEqual(seen['data'], b"0123456789")
+        first.iter_content.assert_not_called()
+
+    def test_sticker_is_saved_without_download(self):
+        event = self.adapter.parse_events({"events": [sticker_event("m1")]})[0]
+        self.adapter._process_media_message(event, "ctx", "U1")
+
+        self.adapter.line_bot_api.get_message_content.assert_not_called()
+        kwargs = self.adapter.save_service.process_save.call_args.kwargs
+        self.assertEqual(kwargs["content_type"], "sticker")
+        self.assertEqual(kwargs["text"], "Sticker ID: 42")
+
+    def test_quoted_text_is_saved_from_recent_messages(self):
+        # 其他測試留下的 auto_save 快照不應影響此測試
+        self.adapter.auto_save_settings.set("U1", False)
+        body = json.dumps({"events": [text_event("m0", "remember this"), text_event("m1", "/save memo", quoted_id="m0")]})
+        self.adapter.handle_request(body, sign(body))
+        deadline = time.monotonic() + 5
+        while not self.adapter.save_service.process_save.called and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+        self.adapter.line_bot_api.get_message_content.assert_not_called()
+        kwargs = self.adapter.save_service.process_save.call_args.kwargs
+        self.assertEqual(kwargs["content_type"], "text")
+        self.assertEqual(kwargs["text"], "memo: remember this")
+
+    def test_unknown_quoted_content_is_sniffed(self):
+        seen = {}
+        self.adapter.save_service.process_save.side_effect = lambda **kwargs: seen.update(kwargs) or "https://drive/link"
+        self.adapter.line_bot_api.get_message_content.return_value = self._fake_content(
+            b"\x89PNG\r\n\x1a\n" + b"0" * 20, content_type="application/octet-stream"
+        )
+        event = self.adapter.parse_events({"events": [text_event("m1", "x")]})[0]
+
+        self.adapter._process_media_message(event, "ctx", "U1", msg_id="m0")
+
+        self.assertEqual(seen["content_type"], "image")
+        self.assertEqual(seen["filename"], "auto_m0.png")
+
+    def test_waits_for_transcoding_without_holding_worker(self):
+        statuses = iter(["processing", "processing", "succeeded"])
+        self.adapter.line_bot_api._get.side_effect = lambda *a, **kw: MagicMock(json={"status": next(statuses)})
+        self.adapter.transcode_base_delay = 0.01
+        done = threading.Event()
+        job = MagicMock(side_effect=lambda: done.set())
+
+        self.adapter._submit_when_ready("U1", "m1", "video", job)
+
+        self.assertTrue(done.wait(5))
+        job.assert_called_once_with()
+        self.assertEqual(self.adapter.line_bot_api._get.call_count, 3)
+        self.assertIn("/v2/bot/message/m1/content/transcoding", self.adapter.line_bot_api._get.call_args[0][0])
+        # 第一次延遲時通知使用者
+        self.adapter.line_bot_api.push_message.assert_called_once()
+
+    def test_batch_save_aggregates_recent_messages(self):
+        self.adapter.line_bot_api.get_message_content.return_value = self._fake_content(b"img")
+        self.adapter.save_service.upload_media.return_value = "https://drive/file"
+        self.adapter.save_service.process_batch_save.return_value = "https://docs/batch"
+        events = [text_event("m1", "first"), image_event("m2"), text_event("m3", "third"), text_event("m4", "/save_batch 3 notes")]
+        body = json.dumps({"events": events})
+        self.adapter.handle_request(body, sign(body))
+
+        deadline = time.monotonic() + 5
+        while not self.adapter.save_service.process_batch_save.called and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+        platform, _, entries, title = self.adapter.save_service.process_batch_save.call_args[0]
+        self.assertEqual(title, "notes")
+        self.assertEqual([e.get("text") or e.get("link") for e in entries], ["first", "https://drive/file", "third"])
+        self.adapter.save_service.upload_media.assert_called_once()
+        self.adapter.save_service.create_doc.assert_not_called()
+
+    def test_journal_mode_routes_saves_to_daily_doc(self):
+        body = json.dumps({"events": [text_event("m1", "/journal on"), text_event("m2", "/save note")]})
+        self.adapter.handle_request(body, sign(body))
+
+        self.assertTrue(self.adapter.journal_settings.get("U1"))
+        self.adapter.save_service.process_journal_save.assert_called_once()
+        self.assertEqual(self.adapter.save_service.process_journal_save.call_args.kwargs["chat_id"], "U1")
+        self.adapter.save_service.process_save.assert_not_called()
+
+    def test_payload_events_fan_out_with_per_chat_order(self):
+        log, lock = [], threading.Lock()
+
+        def on_message(event):
+            with lock:
+                log.append(("start", event.message.id))
+            time.sleep(0.1 if event.message.type == "image" else 0)
+            with lock:
+                log.append(("end", event.message.id))
+
+        self.adapter._on_message = on_message
+        self.adapter.parallel_media = True
+        events = [image_event(f"img{i}") for i in range(4)] + [text_event("t1", "/help"), text_event("o1", "hi", user_id="U2")]
+        body = json.dumps({"events": events})
+        started = time.monotonic()
+        self.adapter.handle_request(body, sign(body))
+
+        self.assertEqual(len(log), 12)
+        # 相簿圖片平行處理，之後的文字指令等它們全部完成才開始
+        self.assertLess(time.monotonic() - started, 0.35)
+        image_ends = [i for i, entry in enumerate(log) if entry[0] == "end" and entry[1].startswith("img")]
+        self.assertLess(max(image_ends), log.index(("start", "t1")))
+
+    def test_events_of_one_chat_stay_ordered_by_default(self):
+        log, lock = [], threading.Lock()
+
+        def on_message(event):
+            with lock:
+                log.append(("start", event.message.id))
+            time.sleep(0.05 if event.message.type == "image" else 0)
+            with lock:
+                log.append(("end", event.message.id))
+
+        self.adapter._on_message = on_message
+        events = [image_event("img0"), sticker_event("s1"), image_event("img1"), text_event("o1", "hi", user_id="U2")]
+        body = json.dumps({"events": events})
+        self.adapter.handle_request(body, sign(body))
+
+        chat = [entry for entry in log if entry[1] != "o1"]
+        self.assertEqual(chat, [("start", "img0"), ("end", "img0"), ("start", "s1"), ("end", "s1"),
+                                ("start", "img1"), ("end", "img1")])
+
+    def test_batch_save_by_ids_downloads_unknown_messages(self):
+        refs = self.adapter.resolve_batch(self.adapter.parse_events({"events": [text_event("m9", "x")]})[0], msg_ids=["468789577898262530"])
+        self.assertEqual(refs, [{"id": "468789577898262530"}])
+
+
+if __name__ == '__main__':
+    unittest.main()
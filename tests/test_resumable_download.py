@@ -0,0 +1,82 @@
+
+import sys
+import os
+import io
+import hashlib
+import unittest
+
+# Add src to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from src.workers.resumable_download import ResumableDownload
+
+DATA = b"0123456789abcdef"
+
+
+class FakeResponse:
+    def __init__(self, body: bytes, status=200, headers=None, fail_after=None):
+        self.body = body
+        self.status_code = status
+        self.headers = headers or {'Content-Length': str(len(body))}
+        self.fail_after = fail_after
+        self.closed = False
+
+    def iter_content(self, chunk_size):
+        for i in range(0, len(self.body), 4):
+            if self.fail_after is not None and i >= self.fail_after:
+                raise ConnectionError("connection reset")
+            yield self.body[i:i + 4]
+
+    def close(self):
+        self.closed = True
+
+
+class NotFound(Exception):
+    status_code = 404
+
+
+class TestResumableDownload(unittest.TestCase):
+    def _download(self, responses, **kwargs):
+        starts = []
+        def open_stream(start):
+            starts.append(start)
+            response = responses.pop(0)
+            if isinstance(response, Exception):
+                raise response
+            return response
+        download = ResumableDownload(open_stream, chunk_size=4, backoff=0, **kwargs)
+        sink = io.BytesIO()
+        download.copy_to(sink)
+        return download, sink.getvalue(), starts
+
+    def test_resumes_with_range(self):
+        download, data, starts = self._download([
+            FakeResponse(DATA, fail_after=8),
+            FakeResponse(DATA[8:], status=206, headers={'Content-Range': f"bytes 8-15/{len(DATA)}"}),
+        ])
+        self.assertEqual(data, DATA)
+        self.assertEqual(starts, [0, 8])
+        self.assertEqual(download.resumes, 1)
+        self.assertEqual(download.checksum, hashlib.sha256(DATA).hexdigest())
+
+    def test_restarts_cleanly_without_range_support(self):
+        download, data, starts = self._download([
+            FakeResponse(DATA, fail_after=8),
+            FakeResponse(DATA),
+        ])
+        self.assertEqual(data, DATA)
+        self.assertEqual(download.restarts, 1)
+        self.assertEqual(download.checksum, hashlib.sha256(DATA).hexdigest())
+
+    def test_short_body_is_detected(self):
+        truncated = FakeResponse(DATA[:8], headers={'Content-Length': str(len(DATA))})
+        with self.assertRaises(IOError):
+            self._download([truncated, FakeResponse(DATA[:8], headers={'Content-Length': str(len(DATA))})], max_attempts=2)
+
+    def test_expired_content_is_not_retried(self):
+        with self.assertRaises(NotFound):
+            self._download([NotFound(), FakeResponse(DATA)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -13,7 +13,10 @@ from src.clients.gdrive_client import GDriveClient
 class TestRichPreview(unittest.TestCase):
     def setUp(self):
         self.mock_gdrive = MagicMock(spec=GDriveClient)
-        self.service = SaveService(self.mock_gdrive)
+        # 圖片轉存不在此測試範圍，直接沿用原始網址
+        self.mock_image_stage = MagicMock()
+        self.mock_image_stage.rehost.side_effect = lambda urls: {u: u for u in urls if u}
+        self.service = SaveService(self.mock_gdrive, self.mock_image_stage)
 
     @patch('src.services.save_service.requests.get')
     def test_link_expansion(self, mock_get):
@@ -31,7 +34,9 @@ class TestRichPreview(unittest.TestCase):
             <body></body>
         </html>
         """
-        mock_response.encoding = 'utf-8'
+        mock_response.content = mock_response.text.encode('utf-8')
+        mock_response.iter_content.return_value = [mock_response.content]
+        mock_response.__enter__.return_value = mock_response
         mock_get.return_value = mock_response
 
         # Execute
@@ -71,7 +76,9 @@ class TestRichPreview(unittest.TestCase):
             </head>
         </html>
         """
-        mock_response.encoding = 'utf-8'
+        mock_response.content = mock_response.text.encode('utf-8')
+        mock_response.iter_content.return_value = [mock_response.content]
+        mock_response.__enter__.return_value = mock_response
         mock_get.return_value = mock_response
         
         self.service.process_save("LINE", "Context", "text", text="http://noimage.com")
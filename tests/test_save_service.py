@@ -0,0 +1,309 @@
+
+import sys
+import os
+import io
+import json
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+from googleapiclient.errors import HttpError
+
+# Add src to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from src.services.save_service import SaveService, _utf8_prefix
+from src.services.image_stage import ImageStage
+from src.services.html_parser import HtmlParsePool, parse_page
+from src.services.media_types import sniff_mime, guess_mime, guess_extension
+from src.services.link_health import LinkHealth
+from src.clients.gdrive_client import GDriveClient
+
+
+def html_response(body: str):
+    response = MagicMock()
+    response.status_code = 200
+    response.content = f"<html><head><title>Page</title></head><body><article>{body}</article></body></html>".encode('utf-8')
+    response.iter_content.side_effect = lambda chunk_size: (
+        response.content[i:i + chunk_size] for i in range(0, len(response.content), chunk_size)
+    )
+    response.__enter__.return_value = response
+    return response
+
+
+class TestHtmlComposition(unittest.TestCase):
+    def setUp(self):
+        self.mock_gdrive = MagicMock(spec=GDriveClient)
+        self.uploaded = {}
+
+        def create_doc(title, items, html_content=None):
+            self.uploaded['html'] = html_content.read().decode('utf-8') if html_content else None
+            return "https://docs/link"
+        self.mock_gdrive.create_doc.side_effect = create_doc
+        self.service = SaveService(self.mock_gdrive)
+
+    @patch('src.services.save_service.requests.get')
+    def test_pages_are_joined_with_separator(self, mock_get):
+        mock_get.side_effect = [html_response("first"), html_response("second")]
+        self.service.process_save("LINE", "ctx", "text", text="https://a.example https://b.example")
+
+        html = self.uploaded['html']
+        self.assertTrue(html.startswith("<html><body>"))
+        self.assertTrue(html.endswith("</body></html>"))
+        self.assertIn("first", html)
+        self.assertIn("<br><hr><br>", html)
+        self.assertIn("second", html)
+
+    @patch('src.services.save_service.requests.get')
+    def test_oversized_backup_is_truncated_with_note(self, mock_get):
+        self.service.max_html_bytes = 2000
+        mock_get.return_value = html_response("備份" * 5000)
+        self.service.process_save("LINE", "ctx", "text", text="https://big.example")
+
+        html = self.uploaded['html']
+        self.assertLessEqual(len(html.encode('utf-8')), 2000 + 200)
+        self.assertIn("Backup truncated", html)
+        self.assertTrue(html.endswith("</body></html>"))
+
+    def test_truncation_only_trims_split_tail_character(self):
+        data = "ab備份".encode('utf-8')  # 2 + 3 + 3 bytes
+        self.assertEqual(bytes(_utf8_prefix(data, 8)), data)
+        self.assertEqual(bytes(_utf8_prefix(data, 7)), "ab備".encode('utf-8'))
+        self.assertEqual(bytes(_utf8_prefix(data, 5)), "ab備".encode('utf-8'))
+        self.assertEqual(bytes(_utf8_prefix(data, 4)), b"ab")
+
+    @patch('src.services.save_service.requests.get')
+    def test_fetch_stops_reading_at_byte_cap(self, mock_get):
+        self.service.max_fetch_bytes = 1024
+        self.service.html_parser = MagicMock()
+        response = html_response("x" * 100000)
+        mock_get.return_value = response
+        self.service._fetch_url_content("https://huge.example")
+
+        self.assertTrue(mock_get.call_args.kwargs['stream'])
+        raw = self.service.html_parser.parse.call_args[0][0]
+        self.assertEqual(raw, response.content[:1024])
+
+    def test_batch_save_creates_single_doc(self):
+        entries = [
+            {"type": "text", "text": "see https://a.example"},
+            {"type": "image", "link": "https://drive/file"},
+        ]
+        self.service.process_batch_save("LINE", "ctx", entries, "notes")
+
+        self.mock_gdrive.create_doc.assert_called_once()
+        title, items = self.mock_gdrive.create_doc.call_args[0][:2]
+        self.assertIn("Batch_notes", title)
+        self.assertIn("- GDrive File Link: https://drive/file", items)
+        self.assertIn({"type": "link", "text": "https://a.example", "url": "https://a.example", "newline": True}, items)
+
+
+class TestHtmlParsePool(unittest.TestCase):
+    PAGE = (
+        "<html><head><meta property='og:title' content='標題'><meta property='og:image' content='/a.png'></head>"
+        "<body><nav>menu</nav><article onclick='x()'><p>內容</p><script>bad()</script></article></body></html>"
+    ).encode('utf-8')
+
+    def test_parse_page_extracts_metadata_and_sanitizes(self):
+        summary = parse_page(self.PAGE, "https://site.example/post")
+        self.assertEqual(summary["title"], "標題")
+        self.assertEqual(summary["image"], "https://site.example/a.png")
+        self.assertIn("內容", summary["html_content"])
+        self.assertNotIn("onclick", summary["html_content"])
+        self.assertNotIn("bad()", summary["html_content"])
+
+    def test_small_pages_parse_inline(self):
+        pool = HtmlParsePool(workers=1, inline_bytes=1024 * 1024)
+        pool.parse(self.PAGE, "https://site.example/post")
+        self.assertIsNone(pool._executor)
+
+    def test_large_pages_parse_in_worker_process(self):
+        pool = HtmlParsePool(workers=1, max_tasks_per_child=1, inline_bytes=0)
+        try:
+            for _ in range(2):
+                summary = pool.parse(self.PAGE, "https://site.example/post")
+                self.assertEqual(summary["title"], "標題")
+            self.assertIsNotNone(pool._executor)
+        finally:
+            pool.shutdown()
+
+    def test_timed_out_parse_is_interrupted_inside_its_worker(self):
+        pool = HtmlParsePool(workers=1, inline_bytes=0, timeout=1)
+        try:
+            pool.parse(self.PAGE, "https://site.example/post")
+            executor = pool._executor
+            start = time.monotonic()
+            with patch('src.services.html_parser.parse_page', slow_parse_page):
+                summary = pool.parse(self.PAGE, "https://site.example/slow")
+            self.assertEqual(summary["html_content"], "")
+            self.assertLess(time.monotonic() - start, 5)
+            # 同一個 pool 與行程繼續處理下一頁，不必重建
+            self.assertEqual(pool.parse(self.PAGE, "https://site.example/post")["title"], "標題")
+            self.assertIs(pool._executor, executor)
+        finally:
+            pool.shutdown()
+
+
+def slow_parse_page(raw, url):
+    # 模擬卡在病態頁面的解析
+    time.sleep(60)
+
+
+class TestLinkHealth(unittest.TestCase):
+    def setUp(self):
+        self.health = LinkHealth(failure_threshold=3, cooldown=0.2, negative_ttl=60)
+
+    @patch('src.services.save_service.requests.get')
+    def test_dead_domain_is_skipped_after_repeated_timeouts(self, mock_get):
+        import requests
+        mock_get.side_effect = requests.Timeout("timed out")
+        service = SaveService(MagicMock(spec=GDriveClient), MagicMock(), MagicMock(), link_health=self.health)
+        for i in range(5):
+            service._fetch_url_content(f"https://dead.example/{i}")
+        self.assertEqual(mock_get.call_count, 3)
+        # 同一網址在負面快取期間不再抓取
+        self.assertFalse(self.health.allow("https://dead.example/0")[0])
+
+    def test_half_open_allows_single_probe(self):
+        for i in range(3):
+            self.health.record_failure(f"https://flaky.example/{i}")
+        self.assertEqual(self.health.allow("https://flaky.example/new"), (False, "circuit open"))
+        time.sleep(0.25)
+        self.assertTrue(self.health.allow("https://flaky.example/a")[0])
+        self.assertFalse(self.health.allow("https://flaky.example/b")[0])
+        self.health.record_success("https://flaky.example/a", 0.1)
+        self.assertTrue(self.health.allow("https://flaky.example/b")[0])
+
+    def test_domain_state_is_bounded(self):
+        health = LinkHealth(max_domains=3)
+        for i in range(10):
+            health.record_failure(f"https://site{i}.example/")
+        health.allow("https://site7.example/other")
+        health.record_success("https://new.example/", 0.1)
+        self.assertEqual(list(health._domains), ["site9.example", "site7.example", "new.example"])
+
+    def test_not_found_does_not_trip_domain(self):
+        for i in range(5):
+            self.health.record_failure(f"https://site.example/{i}", status=404)
+        self.assertTrue(self.health.allow("https://site.example/other")[0])
+        self.assertFalse(self.health.allow("https://site.example/1")[0])
+
+    def test_timeout_adapts_to_latency_percentile(self):
+        self.assertEqual(self.health.timeout_for("https://fast.example/"), 15.0)
+        for _ in range(10):
+            self.health.record_success("https://fast.example/", 1.0)
+        self.assertAlmostEqual(self.health.timeout_for("https://fast.example/x"), 3.0)
+        self.assertEqual(self.health.timeout_for("https://other.example/"), 15.0)
+
+
+class TestMediaTypes(unittest.TestCase):
+    def test_sniff_common_signatures(self):
+        self.assertEqual(sniff_mime(b"\xff\xd8\xff\xe0" + b"0" * 12), "image/jpeg")
+        self.assertEqual(sniff_mime(b"\x00\x00\x00\x18ftypmp42"), "video/mp4")
+        self.assertEqual(sniff_mime(b"\x00\x00\x00\x18ftypM4A "), "audio/mp4")
+        self.assertEqual(sniff_mime(b"\x00\x00\x00\x18ftypheic"), "image/heic")
+        self.assertEqual(sniff_mime(b"RIFF\x00\x00\x00\x00WEBPVP8 "), "image/webp")
+        self.assertEqual(sniff_mime(b"%PDF-1.7"), "application/pdf")
+        self.assertIsNone(sniff_mime(b"plain text"))
+
+    def test_mime_and_extension_table(self):
+        self.assertEqual(guess_mime("file", "report.PDF"), "application/pdf")
+        self.assertEqual(guess_mime("video", "clip.mov"), "video/quicktime")
+        self.assertEqual(guess_mime("audio"), "audio/mp4")
+        self.assertEqual(guess_mime("file", "blob"), "application/octet-stream")
+        self.assertEqual(guess_extension("audio"), ".m4a")
+        self.assertEqual(guess_extension("file", "notes.docx"), ".docx")
+
+
+def image_response(data: bytes, content_type="image/png"):
+    response = MagicMock()
+    response.headers = {'Content-Type': content_type}
+    response.iter_content.return_value = [data]
+    response.__enter__.return_value = response
+    return response
+
+
+class TestImageStage(unittest.TestCase):
+    def setUp(self):
+        from PIL import Image
+        img = Image.new('RGB', (2000, 1000), 'red')
+        out = io.BytesIO()
+        img.save(out, format='PNG')
+        self.big_png = out.getvalue()
+
+        self.mock_gdrive = MagicMock(spec=GDriveClient)
+        self.mock_gdrive.upload_public_image.side_effect = lambda data, name, mime: f"https://drive/{name}"
+        self.mock_gdrive.publish_image.side_effect = lambda uri: uri
+        self.stage = ImageStage(self.mock_gdrive, max_dimension=400)
+
+    @patch('src.services.image_stage.requests.get')
+    def test_downscales_and_caches_by_source_url(self, mock_get):
+        mock_get.return_value = image_response(self.big_png)
+
+        first = self.stage.rehost(["http://img.example/a.png"])
+        second = self.stage.rehost(["http://img.example/a.png"])
+
+        self.assertEqual(first, second)
+        self.mock_gdrive.upload_public_image.assert_called_once()
+        # 快取命中時重新開放 (插入文件後權限已收回)
+        self.mock_gdrive.publish_image.assert_called_once_with(first["http://img.example/a.png"])
+        data, name, mime = self.mock_gdrive.upload_public_image.call_args[0]
+        self.assertEqual(mime, 'image/jpeg')
+        from PIL import Image
+        self.assertLessEqual(max(Image.open(io.BytesIO(data)).size), 400)
+
+    @patch('src.services.image_stage.requests.get')
+    def test_failed_image_degrades_alone(self, mock_get):
+        def fake_get(url, **kwargs):
+            if "broken" in url:
+                raise ConnectionError("boom")
+            return image_response(self.big_png)
+        mock_get.side_effect = fake_get
+
+        result = self.stage.rehost(["http://img.example/ok.png", "http://broken.example/x.png"])
+
+        self.assertIsNone(result["http://broken.example/x.png"])
+        self.assertTrue(result["http://img.example/ok.png"].startswith("https://drive/"))
+
+
+
+def docs_image_error(index: int) -> HttpError:
+    content = json.dumps({"error": {"message": f"Invalid requests[{index}].insertInlineImage: There was a problem retrieving the image."}})
+    return HttpError(MagicMock(status=400, reason="Bad Request"), content.encode())
+
+
+class TestCreateDocImages(unittest.TestCase):
+    def setUp(self):
+        self.client = GDriveClient(credential_manager=MagicMock())
+        self.client._drive_service = MagicMock()
+        self.client._docs_service = MagicMock()
+        self.client._drive_service.files().create().execute.return_value = {'id': 'doc1'}
+        self.batches = []
+
+        def batch_update(documentId, body):
+            self.batches.append(body['requests'])
+            call = MagicMock()
+            if len(self.batches) == 1:
+                call.execute.side_effect = docs_image_error(2)
+            return call
+        self.client._docs_service.documents().batchUpdate.side_effect = batch_update
+        self.good = "https://drive.google.com/uc?export=view&id=good"
+        self.bad = "https://drive.google.com/uc?export=view&id=bad"
+
+    def test_only_the_rejected_image_is_dropped(self):
+        self.client.create_doc("t", ["text", {"type": "image", "uri": self.bad}, {"type": "image", "uri": self.good}])
+
+        self.assertEqual(len(self.batches), 2)
+        retried = [r['insertInlineImage']['uri'] for r in self.batches[1] if 'insertInlineImage' in r]
+        self.assertEqual(retried, [self.good])
+        self.assertTrue(any('insertText' in r and r['insertText']['text'] == "text\n" for r in self.batches[1]))
+
+    def test_public_permission_is_revoked_after_insert(self):
+        self.client.create_doc("t", [{"type": "image", "uri": self.bad}, {"type": "image", "uri": self.good}])
+
+        revoked = {c.kwargs['fileId'] for c in self.client._drive_service.permissions().delete.call_args_list}
+        self.assertEqual(revoked, {"good", "bad"})
+
+
+
+if __name__ == '__main__':
+    unittest.main()
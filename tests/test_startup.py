@@ -0,0 +1,100 @@
+
+import sys
+import os
+import json
+import subprocess
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+
+# Add src to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from src.clients.gdrive_client import GDriveClient
+from src.clients.credentials_manager import CredentialManager
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'scripts'))
+from benchmark_startup import measure_import
+
+ROOT = os.path.join(os.path.dirname(__file__), '..')
+
+# 冷啟動到第一個 Webhook 回應的時間上限 (秒)
+TIME_TO_FIRST_WEBHOOK_BUDGET = float(os.getenv("TIME_TO_FIRST_WEBHOOK_BUDGET", 5.0))
+# 匯入 src.main 的時間上限 (毫秒)
+IMPORT_BUDGET_MS = float(os.getenv("STARTUP_BUDGET_MS", 1500))
+
+FIRST_WEBHOOK_SCRIPT = r"""
+import asyncio, base64, hashlib, hmac, json, os, time
+start = time.perf_counter()
+import src.main as main
+
+body = json.dumps({"destination": "bot", "events": []}).encode()
+signature = base64.b64encode(hmac.new(b"fake_secret", body, hashlib.sha256).digest())
+
+async def call():
+    sent = []
+    scope = {
+        "type": "http", "http_version": "1.1", "method": "POST", "scheme": "http",
+        "path": "/webhook/line", "raw_path": b"/webhook/line", "query_string": b"",
+        "root_path": "", "server": ("test", 80), "client": ("test", 1),
+        "headers": [(b"content-type", b"application/json"), (b"x-line-signature", signature)],
+    }
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+    async def send(message):
+        sent.append(message)
+    await main.app(scope, receive, send)
+    return sent[0]["status"]
+
+status = asyncio.run(call())
+print(json.dumps({"status": status, "elapsed": time.perf_counter() - start}))
+"""
+
+
+class TestStartup(unittest.TestCase):
+    def test_client_construction_is_lazy(self):
+        with patch.object(CredentialManager, '_load') as load_creds:
+            client = GDriveClient()
+            load_creds.assert_not_called()
+            self.assertIsNone(client._drive_service)
+
+    def test_services_built_from_bundled_discovery_doc(self):
+        with tempfile.TemporaryDirectory() as tmpdir, \
+                patch.object(CredentialManager, '_load', return_value=MagicMock()), \
+                patch('src.clients.gdrive_client.build') as remote_build:
+            os.environ['DISCOVERY_CACHE_DIR'] = tmpdir
+            try:
+                client = GDriveClient()
+                self.assertTrue(hasattr(client.drive_service, 'files'))
+                self.assertTrue(hasattr(client.docs_service, 'documents'))
+            finally:
+                del os.environ['DISCOVERY_CACHE_DIR']
+            remote_build.assert_not_called()
+
+    def test_time_to_first_webhook(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            env = dict(os.environ,
+                       LINE_CHANNEL_ACCESS_TOKEN='fake_token',
+                       LINE_CHANNEL_SECRET='fake_secret',
+                       STATE_DB_PATH=os.path.join(tmpdir, 'state.db'),
+                       GOOGLE_APPLICATION_CREDENTIALS=os.path.join(tmpdir, 'missing.json'),
+                       USE_NGROK='false')
+            result = subprocess.run(
+                [sys.executable, '-c', FIRST_WEBHOOK_SCRIPT],
+                cwd=ROOT, env=env, capture_output=True, text=True, timeout=60
+            )
+        self.assertEqual(result.returncode, 0, result.stderr)
+        report = json.loads(result.stdout.strip().splitlines()[-1])
+        print(f"\n⏱️ time-to-first-webhook: {report['elapsed']:.3f}s")
+        self.assertEqual(report['status'], 200)
+        self.assertLess(report['elapsed'], TIME_TO_FIRST_WEBHOOK_BUDGET)
+
+    def test_import_defers_heavy_subsystems(self):
+        report = measure_import("src.main")
+        print(f"\n⏱️ import src.main: {report['cumulative_ms']:.1f} ms")
+        self.assertEqual(report['deferred_violations'], [])
+        self.assertLess(report['cumulative_ms'], IMPORT_BUDGET_MS)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,286 @@
+
+import sys
+import os
+import json
+import time
+import sqlite3
+import tempfile
+import unittest
+from unittest.mock import patch
+
+# Add src to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from src.state.backend import SQLiteStateBackend, RedisStateBackend
+from src.state.auto_save_store import AutoSaveSettings, snapshot_path_from_env
+
+
+class LocalRedis:
+    """Minimal in-process stand-in for the redis-py client API used by RedisStateBackend."""
+    def __init__(self):
+        self.data = {}
+        self.expiry = {}
+
+    def _alive(self, key):
+        if key in self.expiry and self.expiry[key] <= time.time():
+            self.data.pop(key, None)
+            self.expiry.pop(key, None)
+        return key in self.data
+
+    def get(self, key):
+        return self.data[key].encode() if self._alive(key) else None
+
+    def set(self, key, value, nx=False, px=None):
+        if nx and self._alive(key):
+            return None
+        self.data[key] = str(value)
+        self.expiry.pop(key, None)
+        if px:
+            self.expiry[key] = time.time() + px / 1000
+        return True
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+    def incrby(self, key, amount):
+        value = int(self.data.get(key, 0)) + amount
+        self.data[key] = str(value)
+        return value
+
+    def hget(self, name, field):
+        value = self.data.get(name, {}).get(field)
+        return value.encode() if value is not None else None
+
+    def hset(self, name, field=None, value=None, mapping=None):
+        target = self.data.setdefault(name, {})
+        if mapping:
+            target.update(mapping)
+        else:
+            target[field] = value
+
+    def hgetall(self, name):
+        return {k.encode(): v.encode() for k, v in self.data.get(name, {}).items()}
+
+    def rpush(self, key, item):
+        self.data.setdefault(key, []).append(item)
+
+    def lpop(self, key):
+        items = self.data.get(key) or []
+        return items.pop(0).encode() if items else None
+
+    def blpop(self, keys, timeout=0):
+        item = self.lpop(keys[0])
+        return (keys[0].encode(), item) if item is not None else None
+
+    def lpush(self, key, item):
+        self.data.setdefault(key, []).insert(0, item)
+
+    def lmove(self, source, destination, src="LEFT", dest="RIGHT"):
+        items = self.data.get(source) or []
+        if not items:
+            return None
+        item = items.pop(0)
+        self.data.setdefault(destination, []).append(item)
+        return item.encode()
+
+    def blmove(self, source, destination, timeout, src="LEFT", dest="RIGHT"):
+        return self.lmove(source, destination, src, dest)
+
+    def lrem(self, key, count, item):
+        items = self.data.get(key) or []
+        if item in items:
+            items.remove(item)
+            return 1
+        return 0
+
+    def llen(self, key):
+        return len(self.data.get(key) or [])
+
+    def ltrim(self, key, start, end):
+        items = self.data.get(key) or []
+        self.data[key] = items[start:] if end == -1 else items[start:end + 1]
+
+    def lrange(self, key, start, end):
+        items = self.data.get(key) or []
+        return [v.encode() for v in (items[start:] if end == -1 else items[start:end + 1])]
+
+    def pexpire(self, key, px):
+        self.expiry[key] = time.time() + px / 1000
+
+
+class BackendContract:
+    def test_get_set_delete(self):
+        self.assertIsNone(self.backend.get("a"))
+        self.backend.set("a", "1")
+        self.assertEqual(self.backend.get("a"), "1")
+        self.backend.delete("a")
+        self.assertIsNone(self.backend.get("a"))
+
+    def test_ttl_expiry(self):
+        self.backend.set("short", "x", ttl=0.05)
+        self.assertEqual(self.backend.get("short"), "x")
+        time.sleep(0.1)
+        self.assertIsNone(self.backend.get("short"))
+
+    def test_set_if_absent(self):
+        self.assertTrue(self.backend.set_if_absent("evt", "1", ttl=60))
+        self.assertFalse(self.backend.set_if_absent("evt", "1", ttl=60))
+
+    def test_incr(self):
+        self.assertEqual(self.backend.incr("n"), 1)
+        self.assertEqual(self.backend.incr("n", 2), 3)
+        self.assertEqual(self.backend.incr("n", -3), 0)
+
+    def test_hash(self):
+        self.backend.hset("h", "u1", "1")
+        self.backend.hset("h", "u2", "0")
+        self.assertEqual(self.backend.hget("h", "u1"), "1")
+        self.assertEqual(self.backend.hgetall("h"), {"u1": "1", "u2": "0"})
+
+    def test_queue_fifo(self):
+        self.backend.enqueue("jobs", "a")
+        self.backend.enqueue("jobs", "b")
+        self.assertEqual(self.backend.queue_length("jobs"), 2)
+        self.assertEqual(self.backend.dequeue("jobs"), "a")
+        self.assertEqual(self.backend.dequeue("jobs"), "b")
+        self.assertIsNone(self.backend.dequeue("jobs"))
+
+    def test_claim_hides_item_until_ack(self):
+        self.backend.enqueue("jobs", "a")
+        self.backend.enqueue("jobs", "b")
+        receipt, item = self.backend.claim("jobs", visibility=60)
+        self.assertEqual(item, "a")
+        self.assertEqual(self.backend.queue_length("jobs"), 1)
+        self.assertEqual(self.backend.claim("jobs", visibility=60)[1], "b")
+        self.assertIsNone(self.backend.claim("jobs"))
+        self.backend.ack("jobs", receipt)
+        self.assertIsNone(self.backend.claim("jobs"))
+
+    def test_unacked_claim_is_redelivered(self):
+        self.backend.enqueue("jobs", "a")
+        self.backend.claim("jobs", visibility=0.05)
+        # 消費者在確認前當機
+        time.sleep(0.1)
+        if isinstance(self.backend, RedisStateBackend):
+            self.backend._last_requeue.clear()
+        receipt, item = self.backend.claim("jobs", visibility=60)
+        self.assertEqual(item, "a")
+        self.backend.ack("jobs", receipt)
+        self.assertEqual(self.backend.queue_length("jobs"), 0)
+
+    def test_identical_items_are_claimed_and_acked_separately(self):
+        self.backend.enqueue("jobs", "same")
+        self.backend.enqueue("jobs", "same")
+        first, _ = self.backend.claim("jobs", visibility=60)
+        second, item = self.backend.claim("jobs", visibility=60)
+        self.assertEqual(item, "same")
+        self.assertNotEqual(first, second)
+        # 確認其中一筆後，另一筆仍在領取中，逾時前不會重新派送
+        self.backend.ack("jobs", first)
+        if isinstance(self.backend, RedisStateBackend):
+            self.backend._last_requeue.clear()
+        self.assertIsNone(self.backend.claim("jobs"))
+        self.backend.ack("jobs", second)
+
+    def test_capped_list(self):
+        for i in range(5):
+            self.backend.append_capped("recent", str(i), maxlen=3, ttl=60)
+        self.assertEqual(self.backend.tail("recent", 10), ["2", "3", "4"])
+        self.assertEqual(self.backend.tail("recent", 2), ["3", "4"])
+
+    def test_hset_many(self):
+        self.backend.hset_many("h", {"a": "1", "b": "0"})
+        self.assertEqual(self.backend.hgetall("h"), {"a": "1", "b": "0"})
+
+    def test_auto_save_settings(self):
+        settings = AutoSaveSettings(self.backend, legacy_file=None)
+        self.assertFalse(settings.get("user"))
+        settings.set("user", True)
+        self.assertTrue(AutoSaveSettings(self.backend, legacy_file=None).get("user"))
+
+
+class TestSQLiteStateBackend(BackendContract, unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.backend = SQLiteStateBackend(os.path.join(self.tmpdir.name, "state.db"))
+
+    def tearDown(self):
+        self.backend.close()
+        self.tmpdir.cleanup()
+
+    def test_shared_between_instances(self):
+        # 模擬兩個 worker 進程各自開啟同一個檔案
+        other = SQLiteStateBackend(self.backend.path)
+        self.backend.set("quote:1", "999")
+        self.assertEqual(other.get("quote:1"), "999")
+        other.close()
+
+    def test_empty_poll_does_not_take_write_lock(self):
+        # 另一個連線持有寫入鎖時，空佇列的 claim 仍立即回傳
+        other = sqlite3.connect(self.backend.path, isolation_level=None, timeout=0.1)
+        other.execute("BEGIN IMMEDIATE")
+        try:
+            self.assertIsNone(self.backend.claim("jobs"))
+        finally:
+            other.execute("ROLLBACK")
+            other.close()
+
+
+class TestRedisStateBackend(BackendContract, unittest.TestCase):
+    def setUp(self):
+        self.backend = RedisStateBackend(LocalRedis())
+
+
+class TestAutoSaveWriteBehind(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.backend = RedisStateBackend(LocalRedis())
+        self.snapshot = os.path.join(self.tmpdir.name, "auto_save_settings.json")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_writes_are_batched_until_flush(self):
+        settings = AutoSaveSettings(self.backend, legacy_file=self.snapshot, flush_interval=60)
+        settings.start()
+        settings.set("u1", True)
+        settings.set("u2", True)
+
+        # 讀取走記憶體，後端尚未寫入
+        self.assertTrue(settings.get("u1"))
+        self.assertEqual(self.backend.hgetall(AutoSaveSettings.HASH_NAME), {})
+
+        settings.close()
+        self.assertEqual(self.backend.hgetall(AutoSaveSettings.HASH_NAME), {"u1": "1", "u2": "1"})
+
+    def test_snapshot_is_written_and_reimported(self):
+        settings = AutoSaveSettings(self.backend, legacy_file=self.snapshot, flush_interval=60)
+        settings.start()
+        settings.set("u1", True)
+        settings.close()
+
+        with open(self.snapshot) as f:
+            self.assertEqual(json.load(f), {"u1": True})
+        self.assertEqual([n for n in os.listdir(self.tmpdir.name) if n.endswith(".tmp")], [])
+
+        fresh_backend = RedisStateBackend(LocalRedis())
+        self.assertTrue(AutoSaveSettings(fresh_backend, legacy_file=self.snapshot).get("u1"))
+
+    def test_refresh_picks_up_other_workers(self):
+        settings = AutoSaveSettings(self.backend, legacy_file=None)
+        other = AutoSaveSettings(self.backend, legacy_file=None)
+        other.set("u1", True)
+        self.assertFalse(settings.get("u1"))
+        settings.refresh()
+        self.assertTrue(settings.get("u1"))
+
+    def test_snapshot_path_follows_state_db(self):
+        db_path = os.path.join(self.tmpdir.name, "state.db")
+        with patch.dict(os.environ, {"STATE_DB_PATH": db_path, "AUTO_SAVE_SNAPSHOT_PATH": ""}):
+            self.assertEqual(snapshot_path_from_env(), self.snapshot)
+        with patch.dict(os.environ, {"AUTO_SAVE_SNAPSHOT_PATH": "/data/flags.json"}):
+            self.assertEqual(snapshot_path_from_env(), "/data/flags.json")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import sys
+import os
+import json
+import tempfile
+import unittest
+
+# Add src to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from src.services.webhook_recorder import WebhookRecorder, iter_recording
+
+
+def payload(text, user_id="U123", event_id="e1"):
+    return json.dumps({"destination": "Ubot", "events": [{
+        "type": "message",
+        "replyToken": "reply-token",
+        "webhookEventId": event_id,
+        "source": {"type": "user", "userId": user_id},
+        "message": {"type": "text", "id": "m1", "text": text, "quoteToken": "q"},
+    }]})
+
+
+class TestWebhookRecorder(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "webhooks.jsonl")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_records_are_redacted_and_replayable(self):
+        recorder = WebhookRecorder(self.path, salt="test")
+        recorder.record(payload("my secret note"), 100.0)
+        recorder.record(payload("/save_batch 3 trip photos", event_id="e2"), 101.5)
+        recorder.close()
+
+        records = list(iter_recording(self.path))
+        self.assertEqual([t for t, _ in records], [100.0, 101.5])
+        first, second = (p["events"][0] for _, p in records)
+        self.assertEqual(first["message"]["text"], "x" * len("my secret note"))
+        # 指令名稱保留，參數遮蔽
+        self.assertEqual(second["message"]["text"], "/save_batch " + "x" * len("3 trip photos"))
+        self.assertNotIn("reply-token", json.dumps(first))
+        # 同一使用者對應到相同的代號
+        self.assertNotEqual(first["source"]["userId"], "U123")
+        self.assertEqual(first["source"]["userId"], second["source"]["userId"])
+        self.assertEqual(first["webhookEventId"], "e1")
+
+    def test_appends_across_restarts_and_skips_torn_line(self):
+        WebhookRecorder(self.path, mask_fields=()).record(payload("hello"), 1.0)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write('{"t": 2.0, "b": {"ev')
+            f.write("\n")
+        recorder = WebhookRecorder(self.path, mask_fields=())
+        recorder.record(payload("again"), 3.0)
+        recorder.close()
+
+        texts = [p["events"][0]["message"]["text"] for _, p in iter_recording(self.path)]
+        self.assertEqual(texts, ["hello", "again"])
+
+    def test_stops_at_size_cap(self):
+        recorder = WebhookRecorder(self.path, max_bytes=600)
+        for i in range(10):
+            recorder.record(payload("hello", event_id=f"e{i}"), float(i))
+        self.assertLess(recorder.recorded, 10)
+        self.assertLessEqual(os.path.getsize(self.path), 600)
+        recorder.close()
+
+    def test_disabled_without_path(self):
+        os.environ.pop("WEBHOOK_RECORD_PATH", None)
+        self.assertIsNone(WebhookRecorder.from_env())
+
+
+if __name__ == '__main__':
+    unittest.main()